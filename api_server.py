@@ -0,0 +1,226 @@
+# api_server.py
+"""本地 OpenAI 兼容接口：把 model_app_id_map 中的科技金融应用以 POST /v1/chat/completions（支持 SSE 流式输出）
+提供给内部工具，所有客户端共用同一个 DashScope 连接池、重试策略与按模型的并发限制。
+
+用法: python api_server.py --port 8000 [--token 访问令牌]
+然后在客户端中设置 base_url = "http://127.0.0.1:8000/v1"，model 填写 qwen-plus 等模型名。
+各工具可以在请求头 X-Client-Id 中带上自己的名称，调度器按它在工具之间公平排队。
+"""
+import sys
+import json
+import time
+import uuid
+import hashlib
+import signal
+import asyncio
+import logging
+import argparse
+import threading
+from aiohttp import web
+from controller import Controller, model_app_id_map
+from request_scheduler import RequestScheduler
+from app_config import get_config_path, load_config, get_api_key, configure_controller
+def _error_response(status, message, error_type='invalid_request_error', code=None, headers=None):
+    return web.json_response({'error': {'message': message, 'type': error_type, 'code': code}}, status=status, headers=headers)
+def _message_text(content):
+    """OpenAI 的 content 可以是字符串或 [{'type': 'text', 'text': ...}] 分段列表，应用只接受纯文本"""
+    if isinstance(content, list):
+        return ''.join(part.get('text', '') for part in content if isinstance(part, dict) and part.get('type') == 'text')
+    return content if isinstance(content, str) else ''
+class ChatCompletionServer:
+    """运行在 Controller 的共享事件循环中：请求直接交给 aprocess_api_request，由调度器限制各模型的并发，
+    排队的请求超过 max_queue 时立即返回 429。流式输出时客户端读得慢会让写入等待（进而暂停读取上游），
+    单次写入等待超过 write_timeout 秒即断开该客户端并释放并发名额"""
+    def __init__(self, api_key, access_token=None, max_queue=64, write_timeout=30, write_buffer_bytes=64 * 1024):
+        self.api_key = api_key
+        self.access_token = access_token
+        self.max_queue = max_queue
+        self.write_timeout = write_timeout
+        self.write_buffer_bytes = write_buffer_bytes
+        self.stats = {'requests': 0, 'streaming': 0, 'completed': 0, 'errors': 0, 'rejected': 0, 'disconnects': 0,
+                      'slow_clients': 0}
+    def create_app(self):
+        app = web.Application(client_max_size=4 * 1024 * 1024)
+        app.router.add_post('/v1/chat/completions', self.handle_chat_completions)
+        app.router.add_get('/v1/models', self.handle_models)
+        app.router.add_get('/stats', self.handle_stats)
+        return app
+    def _authorized(self, request):
+        if not self.access_token:
+            return True
+        return request.headers.get('Authorization', '').removeprefix('Bearer ').strip() == self.access_token
+    def _client_owner(self, request):
+        """调度器按发起方公平排队用的标识：服务只监听本机时各工具的地址相同，所以优先使用 X-Client-Id 请求头，
+        其次是各自的 Bearer 令牌（只用于区分，取摘要），都没有时使用对端地址。不使用端口：同一工具的多个连接算作一个发起方"""
+        client_id = request.headers.get('X-Client-Id', '').strip()
+        if client_id:
+            return f'client:{client_id}'
+        token = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+        if token and token != self.access_token:
+            return 'token:' + hashlib.sha256(token.encode('utf-8')).hexdigest()[:12]
+        return f'host:{request.remote}'
+    async def handle_models(self, request):
+        if not self._authorized(request):
+            return _error_response(401, '访问令牌无效。', 'authentication_error', 'invalid_api_key')
+        return web.json_response({'object': 'list', 'data': [
+            {'id': name, 'object': 'model', 'created': 0, 'owned_by': 'dashscope'} for name in model_app_id_map]})
+    async def handle_stats(self, request):
+        scheduler = Controller.scheduler
+        return web.json_response(dict(self.stats, scheduler=scheduler.stats() if scheduler is not None else None))
+    async def handle_chat_completions(self, request):
+        self.stats['requests'] += 1
+        if not self._authorized(request):
+            return _error_response(401, '访问令牌无效。', 'authentication_error', 'invalid_api_key')
+        try:
+            body = await request.json()
+            model_name = body['model']
+            messages = [{'role': m['role'], 'content': _message_text(m.get('content'))} for m in body['messages']]
+        except (ValueError, KeyError, TypeError):
+            return _error_response(400, '请求体需要包含 model 与 messages。')
+        if not messages:
+            return _error_response(400, 'messages 不能为空。')
+        if model_name not in model_app_id_map:
+            return _error_response(404, f'模型 {model_name} 不存在，可用模型: {", ".join(model_app_id_map)}', code='model_not_found')
+        scheduler = Controller.scheduler
+        if scheduler is not None and scheduler.queued_count >= self.max_queue:
+            self.stats['rejected'] += 1
+            return _error_response(429, '排队的请求过多，请稍后再试。', 'rate_limit_error', 'too_many_queued', headers={'Retry-After': '1'})
+        completion_id = f'chatcmpl-{uuid.uuid4().hex}'
+        # 调度器按发起方公平排队：同一个客户端的请求排在一起，不会挤占其他工具
+        events = Controller.aprocess_api_request(self.api_key, messages, model_name, use_cache=False,
+                                                 owner=self._client_owner(request))
+        try:
+            if body.get('stream'):
+                return await self._stream(request, events, completion_id, model_name)
+            return await self._complete(events, completion_id, model_name)
+        finally:
+            await events.aclose() # 客户端断开或写入超时时取消上游请求并释放名额
+    async def _complete(self, events, completion_id, model_name):
+        parts = []
+        async for event in events:
+            if not event.get('is_end'):
+                parts.append(event.get('text') or '')
+                continue
+            if event.get('error'):
+                self.stats['errors'] += 1
+                return _error_response(event.get('status_code') or 502, event.get('text'), 'upstream_error', event.get('error_code'))
+            break
+        self.stats['completed'] += 1
+        return web.json_response({
+            'id': completion_id,
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': model_name,
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': ''.join(parts)}, 'finish_reason': 'stop'}],
+            'usage': self._usage(event),
+        })
+    @staticmethod
+    def _usage(event):
+        usage = event.get('usage') or {}
+        if usage.get('input_tokens') is None or usage.get('output_tokens') is None:
+            return None
+        return {'prompt_tokens': usage['input_tokens'], 'completion_tokens': usage['output_tokens'],
+                'total_tokens': usage['input_tokens'] + usage['output_tokens']}
+    async def _stream(self, request, events, completion_id, model_name):
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream; charset=utf-8', 'Cache-Control': 'no-cache',
+                                               'X-Accel-Buffering': 'no'})
+        await response.prepare(request)
+        if request.transport is not None:
+            # 缓冲区写满时 write() 会等待客户端读走数据，每个连接占用的内存有上限
+            request.transport.set_write_buffer_limits(high=self.write_buffer_bytes)
+        created = int(time.time())
+        def chunk(delta, finish_reason=None, usage=None):
+            data = {'id': completion_id, 'object': 'chat.completion.chunk', 'created': created, 'model': model_name,
+                    'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]}
+            if usage is not None:
+                data['usage'] = usage
+            return data
+        self.stats['streaming'] += 1
+        try:
+            await self._send(response, chunk({'role': 'assistant', 'content': ''}))
+            async for event in events:
+                if not event.get('is_end'):
+                    if event.get('text'):
+                        await self._send(response, chunk({'content': event['text']}))
+                    continue
+                if event.get('error'):
+                    self.stats['errors'] += 1
+                    await self._send(response, {'error': {'message': event.get('text'), 'type': 'upstream_error',
+                                                          'code': event.get('error_code')}})
+                else:
+                    self.stats['completed'] += 1
+                    await self._send(response, chunk({}, 'stop', self._usage(event)))
+                break
+            await asyncio.wait_for(response.write(b'data: [DONE]\n\n'), self.write_timeout)
+            await response.write_eof()
+        except asyncio.TimeoutError:
+            self.stats['slow_clients'] += 1
+            logging.warning(f"客户端 {request.remote} 超过 {self.write_timeout} 秒未读取数据，已断开: {completion_id}")
+            if request.transport is not None:
+                request.transport.close()
+        except (ConnectionResetError, ConnectionError):
+            self.stats['disconnects'] += 1
+            logging.info(f"客户端 {request.remote} 已断开: {completion_id}")
+        finally:
+            self.stats['streaming'] -= 1
+        return response
+    async def _send(self, response, data):
+        payload = f'data: {json.dumps(data, ensure_ascii=False)}\n\n'.encode('utf-8')
+        await asyncio.wait_for(response.write(payload), self.write_timeout)
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='科技金融小助手本地 OpenAI 兼容接口')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--token', help='客户端访问令牌（Authorization: Bearer ...），不设置时不校验')
+    parser.add_argument('--global-limit', type=int, help='总并发上限，默认取配置中的 scheduler.global_limit')
+    parser.add_argument('--per-model-limit', type=int, help='单个模型的并发上限，默认取配置中的 scheduler.per_model_limit')
+    parser.add_argument('--max-queue', type=int, default=64, help='排队请求数上限，超过时返回 429')
+    parser.add_argument('--write-timeout', type=float, default=30, help='单次写入等待客户端读取的最长秒数，超过即断开')
+    parser.add_argument('--config', default=get_config_path(), help='配置文件路径（API 密钥、接口地址、重试策略等）')
+    return parser.parse_args(argv)
+def main(argv=None):
+    args = parse_args(argv)
+    config = load_config(args.config)
+    api_key = get_api_key(config)
+    if not api_key:
+        logging.error('缺少 API 密钥：请在配置文件中填写 api_key 或设置环境变量 DASHSCOPE_API_KEY。')
+        return 2
+    configure_controller(config)
+    scheduler_config = config.get('scheduler', {})
+    Controller.configure_scheduler(RequestScheduler(
+        global_limit=args.global_limit or int(scheduler_config.get('global_limit', 4)),
+        per_model_limit=args.per_model_limit or int(scheduler_config.get('per_model_limit', 2)),
+        model_limits=scheduler_config.get('model_limits'),
+    ))
+    server = ChatCompletionServer(api_key, args.token, args.max_queue, args.write_timeout)
+    runner = web.AppRunner(server.create_app())
+    async def start():
+        # 服务与 Controller 的后端运行在同一个事件循环中，请求之间共用连接池与调度器
+        await runner.setup()
+        await web.TCPSite(runner, args.host, args.port).start()
+    try:
+        Controller.submit(start()).result()
+    except OSError as e:
+        logging.error(f'启动服务失败: {e}')
+        Controller.shutdown()
+        return 1
+    Controller.warm_up()
+    logging.info(f"本地接口已启动: http://{args.host}:{args.port}/v1 ，可用模型: {', '.join(model_app_id_map)}")
+    stop_requested = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_requested.set()) # 作为服务运行时按 SIGTERM 正常退出
+    try:
+        while not stop_requested.wait(0.5): # 定时醒来，主线程才能及时响应 Ctrl+C
+            pass
+    except KeyboardInterrupt:
+        pass
+    logging.info("正在停止本地接口…")
+    try:
+        Controller.submit(runner.cleanup()).result(10)
+    except Exception as e:
+        logging.warning(f"关闭本地接口时出错: {e}")
+    Controller.shutdown()
+    return 0
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s',
+                        handlers=[logging.StreamHandler(sys.stdout)])
+    sys.exit(main())
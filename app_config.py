@@ -0,0 +1,40 @@
+# app_config.py
+import os
+import sys
+import json
+import logging
+from controller import Controller
+from retry_policy import RetryPolicy
+def get_config_path():
+    """与界面程序共用的配置文件 assets/config.json"""
+    base_path = sys._MEIPASS if getattr(sys, 'frozen', False) else os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(base_path, 'assets', 'config.json')
+def load_config(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        logging.warning(f'未找到配置文件 {path}，将使用默认值。')
+    except (OSError, ValueError) as e:
+        logging.error(f'读取配置文件时出错: {e}')
+    return {}
+def get_api_key(config):
+    """无界面入口的 API 密钥：环境变量 DASHSCOPE_API_KEY 优先，其次是配置文件"""
+    return os.environ.get('DASHSCOPE_API_KEY') or config.get('api_key', '')
+def configure_controller(config):
+    """按配置设置后端、接口地址、自定义模型与重试策略（供批量问答、本地服务等无界面入口使用）；
+    这些入口需要模型的真实回答，不使用界面的回答缓存"""
+    Controller.configure(base_url=config.get('api_base_url') or None, backend=config.get('backend', 'dashscope'),
+                         models=config.get('models', {}))
+    retry_config = config.get('retry', {})
+    if retry_config.get('enabled', True):
+        Controller.configure_retry(RetryPolicy(
+            max_retries=int(retry_config.get('max_retries', 2)),
+            base_delay_ms=float(retry_config.get('base_delay_ms', 500)),
+            max_delay_ms=float(retry_config.get('max_delay_ms', 8000)),
+            overload_retries=int(retry_config.get('overload_retries', 1)),
+            hedge_after_ms=float(retry_config.get('hedge_after_ms') or 0),
+        ))
+    else:
+        Controller.configure_retry(None)
+    Controller.configure_cache(None)
@@ -0,0 +1,245 @@
+# batch.py
+"""无界面批量问答：从 JSONL 或 CSV 读取问题，用有界的工作线程池交给各模型回答，每完成一个就追加一行到结果 JSONL。
+结果文件同时是检查点，中断后加 --resume 重新运行只会补跑尚未成功的问题。
+
+输入 JSONL 每行一个对象：{"id": "q1", "prompt": "...", "model": "可选，只发给该模型"}（也接受 "question"）；
+CSV 需要表头，列名同上。没有 id 时使用行号。
+
+用法: python batch.py questions.jsonl -o results.jsonl --models qwen-plus,deepseek-r1 [--workers 4] [--resume]
+"""
+import os
+import sys
+import csv
+import json
+import time
+import logging
+import argparse
+import threading
+from collections import deque, Counter
+from datetime import datetime
+from controller import Controller, model_app_id_map
+from app_config import get_config_path, load_config, get_api_key, configure_controller
+def read_questions(path):
+    """读取问题文件，返回 [{'id', 'prompt', 'model'}]；按扩展名区分 CSV 与 JSONL"""
+    if path.lower().endswith('.csv'):
+        with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+            rows = list(csv.DictReader(f))
+    else:
+        rows = []
+        with open(path, 'r', encoding='utf-8') as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    rows.append(json.loads(line))
+                except ValueError as e:
+                    raise ValueError(f'{path} 第 {line_number} 行不是有效的 JSON: {e}') from e
+    questions = []
+    seen = set()
+    for row_number, row in enumerate(rows, 1):
+        prompt = (row.get('prompt') or row.get('question') or '').strip()
+        if not prompt:
+            logging.warning(f'第 {row_number} 条没有 prompt，已跳过。')
+            continue
+        question_id = str(row.get('id') or row_number)
+        if question_id in seen:
+            raise ValueError(f'问题 id 重复: {question_id}')
+        seen.add(question_id)
+        questions.append({'id': question_id, 'prompt': prompt, 'model': (row.get('model') or '').strip() or None})
+    return questions
+def read_checkpoint(path):
+    """结果文件中已成功的 (问题 id, 模型)；出错的会在续跑时重新请求。最后一行可能因中断而不完整，忽略即可"""
+    done = set()
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get('status') == 'ok':
+                    done.add((record.get('id'), record.get('model')))
+    except FileNotFoundError:
+        pass
+    return done
+class BatchRunner:
+    """工作线程池：每个线程从各模型的待办队列中轮流取出还有并发名额的模型的下一个问题，
+    某个模型满额时其余模型的问题不会被它挡住"""
+    def __init__(self, api_key, jobs, output_path, workers=4, per_model_limit=2, model_limits=None):
+        self.api_key = api_key
+        self.output_path = output_path
+        self.workers = max(1, workers)
+        self.per_model_limit = max(1, per_model_limit)
+        self.model_limits = dict(model_limits or {})
+        self._pending = {} # 模型 -> deque[问题]
+        for job in jobs:
+            self._pending.setdefault(job['model'], deque()).append(job)
+        self._models = list(self._pending) # 轮流取题的顺序
+        self._active = Counter()
+        self._condition = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._stop = threading.Event()
+        self.total = len(jobs)
+        self.finished = 0
+        self.failed = 0
+    def _model_limit(self, model_name):
+        return max(1, self.model_limits.get(model_name, self.per_model_limit))
+    def _take_job(self):
+        """取出下一个可以执行的问题；全部取完时返回 None"""
+        with self._condition:
+            while not self._stop.is_set():
+                if not any(self._pending.values()):
+                    return None
+                for index, model_name in enumerate(self._models):
+                    if self._pending[model_name] and self._active[model_name] < self._model_limit(model_name):
+                        self._models.append(self._models.pop(index)) # 下次从其他模型开始找
+                        self._active[model_name] += 1
+                        return self._pending[model_name].popleft()
+                self._condition.wait()
+            return None
+    def _finish_job(self, job, record):
+        with self._condition:
+            self._active[job['model']] -= 1
+            self._condition.notify_all()
+        if record is None: # 被中断，不写结果，续跑时重新请求
+            return
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with self._write_lock:
+            with open(self.output_path, 'a', encoding='utf-8') as f:
+                f.write(line)
+            self.finished += 1
+            if record['status'] != 'ok':
+                self.failed += 1
+            logging.info(f"[{self.finished}/{self.total}] {record['id']} @ {record['model']}: {record['status']}，"
+                         f"耗时 {record['duration_ms']:.0f} ms")
+    def _run_job(self, job):
+        """在工作线程中执行一个问题，返回结果记录；被中断时返回 None"""
+        started_at = time.perf_counter()
+        first_token_at = None
+        parts = []
+        end_event = {}
+        messages = [{'role': 'user', 'content': job['prompt']}]
+        events = Controller.process_api_request(self.api_key, messages, job['model'])
+        try:
+            for event in events:
+                if self._stop.is_set():
+                    return None # 关闭生成器会取消事件循环中的请求
+                if event.get('is_end'):
+                    end_event = event
+                    break
+                if event.get('text'):
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                    parts.append(event['text'])
+        finally:
+            events.close()
+        duration = time.perf_counter() - started_at
+        answer = ''.join(parts)
+        error = (end_event.get('text') or '未收到回答。') if end_event.get('error') or not answer else None
+        return {
+            'id': job['id'],
+            'model': job['model'],
+            'prompt': job['prompt'],
+            'status': 'error' if error is not None else 'ok',
+            'answer': answer,
+            'error': error,
+            'error_code': end_event.get('error_code'),
+            'retries': end_event.get('retries', 0),
+            'failover_model': end_event.get('failover_model'),
+            'ttft_ms': round((first_token_at - started_at) * 1000, 1) if first_token_at is not None else None,
+            'duration_ms': round(duration * 1000, 1),
+            'ts': datetime.now().isoformat(timespec='seconds'),
+        }
+    def _worker(self):
+        while True:
+            job = self._take_job()
+            if job is None:
+                return
+            record = None
+            try:
+                record = self._run_job(job)
+            except Exception as e:
+                logging.exception(f"问题 {job['id']} @ {job['model']} 执行出错: {e}")
+            finally:
+                self._finish_job(job, record)
+    def stop(self):
+        self._stop.set()
+        with self._condition:
+            self._condition.notify_all()
+    def run(self):
+        threads = [threading.Thread(target=self._worker, name=f'batch-worker-{i}', daemon=True) for i in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(0.5) # 定时醒来，主线程才能及时响应 Ctrl+C
+        except KeyboardInterrupt:
+            logging.warning("收到中断，正在取消进行中的请求；已完成的结果已写入，可用 --resume 续跑。")
+            self.stop()
+            for thread in threads:
+                thread.join(5)
+            return False
+        return True
+def parse_model_limit(value):
+    name, _, limit = value.partition('=')
+    if not name or not limit.isdigit():
+        raise argparse.ArgumentTypeError(f'格式应为 模型名=并发数: {value}')
+    return name, int(limit)
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='科技金融小助手批量问答（无界面）')
+    parser.add_argument('questions', help='问题文件（.jsonl 或 .csv）')
+    parser.add_argument('-o', '--output', required=True, help='结果 JSONL 文件，同时用作续跑的检查点')
+    parser.add_argument('--models', help='逗号分隔的模型名，每个问题发给每个模型；默认使用配置中选择的模型')
+    parser.add_argument('--workers', type=int, help='工作线程数（总并发上限），默认取配置中的 scheduler.global_limit')
+    parser.add_argument('--per-model-limit', type=int, help='单个模型的并发上限，默认取配置中的 scheduler.per_model_limit')
+    parser.add_argument('--model-limit', action='append', type=parse_model_limit, metavar='模型名=并发数', help='单独设置某个模型的并发上限，可重复')
+    parser.add_argument('--resume', action='store_true', help='跳过结果文件中已成功的问题，只补跑其余的')
+    parser.add_argument('--overwrite', action='store_true', help='清空已存在的结果文件后重新运行')
+    parser.add_argument('--config', default=get_config_path(), help='配置文件路径（API 密钥、接口地址、重试策略等）')
+    return parser.parse_args(argv)
+def main(argv=None):
+    args = parse_args(argv)
+    config = load_config(args.config)
+    api_key = get_api_key(config)
+    if not api_key:
+        logging.error('缺少 API 密钥：请在配置文件中填写 api_key 或设置环境变量 DASHSCOPE_API_KEY。')
+        return 2
+    configure_controller(config)
+    Controller.configure_scheduler(None) # 并发由 BatchRunner 按模型控制，不再经过调度器
+    models = [m.strip() for m in (args.models or config.get('selected_model', '')).split(',') if m.strip()]
+    unknown = [m for m in models if m not in model_app_id_map]
+    if not models or unknown:
+        logging.error(f"无效的模型: {', '.join(unknown) or '（未指定）'}，可用模型: {', '.join(model_app_id_map)}")
+        return 2
+    try:
+        questions = read_questions(args.questions)
+    except (OSError, ValueError) as e:
+        logging.error(f'读取问题文件失败: {e}')
+        return 2
+    if os.path.exists(args.output) and not args.resume:
+        if not args.overwrite:
+            logging.error(f'结果文件 {args.output} 已存在：加 --resume 续跑，或加 --overwrite 重新运行。')
+            return 2
+        os.remove(args.output)
+    done = read_checkpoint(args.output) if args.resume else set()
+    jobs = [dict(question, model=model) for question in questions for model in ([question['model']] if question['model'] else models)
+            if (question['id'], model) not in done]
+    logging.info(f"共 {len(questions)} 个问题，{len(done)} 个结果已完成，本次运行 {len(jobs)} 个。")
+    scheduler_config = config.get('scheduler', {})
+    runner = BatchRunner(
+        api_key, jobs, args.output,
+        workers=args.workers or int(scheduler_config.get('global_limit', 4)),
+        per_model_limit=args.per_model_limit or int(scheduler_config.get('per_model_limit', 2)),
+        model_limits={**scheduler_config.get('model_limits', {}), **dict(args.model_limit or [])},
+    )
+    completed = runner.run()
+    Controller.shutdown()
+    logging.info(f"本次完成 {runner.finished} 个，其中失败 {runner.failed} 个，结果见 {args.output}")
+    if not completed:
+        return 130
+    return 1 if runner.failed else 0
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s',
+                        handlers=[logging.StreamHandler(sys.stdout)])
+    sys.exit(main())
@@ -0,0 +1,224 @@
+# benchmark.py
+"""无界面性能基准：在 offscreen Qt 平台上运行 ChatGUI，用可配置的假流式后端替代真实接口，
+结果以 JSON 输出，便于在不同版本之间比较。
+
+用法: python benchmark.py [--output bench.json] [--chunks 2000] [--chunk-chars 4] [--rate 0] ...
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import logging
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+from PySide6 import __version__ as PYSIDE_VERSION
+from PySide6.QtCore import QTimer, QEventLoop
+from PySide6.QtWidgets import QApplication
+import gui
+from controller import Controller
+from session_store import SessionStore
+from context_manager import get_token_counter
+try:
+    import resource
+except ImportError: # Windows 没有 resource 模块
+    resource = None
+SAMPLE_TEXT = '科技金融是指通过科技手段提升金融服务效率，例如 AI 风控、区块链结算与智能投顾。'
+def make_fake_backend(chunks, chunk_chars, rate):
+    """返回替代 Controller.aprocess_api_request 的异步生成器：每秒产出 rate 个增量（0 表示不限速）"""
+    chunk = (SAMPLE_TEXT * (chunk_chars // len(SAMPLE_TEXT) + 1))[:chunk_chars]
+    async def fake_aprocess_api_request(api_key, dialog_history, model_name, session_id=None, full_history=None, use_cache=True,
+                                        owner=None):
+        interval = 1.0 / rate if rate > 0 else 0
+        start = time.perf_counter()
+        for i in range(chunks):
+            if interval:
+                # 按时间表发送，避免 sleep 误差累积导致实际速率偏低
+                delay = start + i * interval - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            elif i % 64 == 0:
+                await asyncio.sleep(0)
+            yield {'text': chunk, 'session_id': 'benchmark-session', 'is_end': False}
+        yield {'text': '', 'session_id': 'benchmark-session', 'is_end': True, 'answer': chunk * chunks}
+    return fake_aprocess_api_request
+class StallMonitor:
+    """在 GUI 线程上按固定间隔触发定时器，统计实际间隔超出预期的部分，即 UI 线程被阻塞的时间"""
+    def __init__(self, interval_ms=5, stall_threshold_ms=50):
+        self.interval_ms = interval_ms
+        self.stall_threshold_ms = stall_threshold_ms
+        self.gaps = []
+        self._last = None
+        self._timer = QTimer()
+        self._timer.setInterval(interval_ms)
+        self._timer.timeout.connect(self._tick)
+    def _tick(self):
+        now = time.perf_counter()
+        if self._last is not None:
+            self.gaps.append((now - self._last) * 1000)
+        self._last = now
+    def start(self):
+        # 从开始时刻计时，触发操作中的同步阻塞（第一次定时器触发之前）也计入第一个间隔
+        self.gaps.clear()
+        self._last = time.perf_counter()
+        self._timer.start()
+    def stop(self):
+        self._timer.stop()
+        self._tick() # 最后一次触发到结束之间的阻塞同样计入
+        gaps = sorted(self.gaps) or [0.0]
+        stalls = [gap - self.interval_ms for gap in gaps if gap > self.stall_threshold_ms]
+        return {
+            'max_gap_ms': round(gaps[-1], 2),
+            'p95_gap_ms': round(gaps[int(len(gaps) * 0.95) - 1 if len(gaps) > 1 else 0], 2),
+            'stall_count': len(stalls),
+            'total_stall_ms': round(sum(stalls), 2),
+        }
+def wait_for(signal, timeout_s, trigger=None):
+    """运行 Qt 事件循环直到 signal 触发或超时，返回是否在超时前触发。
+    trigger 在连接信号之后调用，避免操作完成得太快、信号在开始等待之前就已发出"""
+    loop = QEventLoop()
+    fired = []
+    def on_signal(*args):
+        fired.append(True)
+        loop.quit()
+    signal.connect(on_signal)
+    if trigger is not None:
+        trigger()
+    if fired:
+        signal.disconnect(on_signal)
+        return True
+    QTimer.singleShot(int(timeout_s * 1000), loop.quit)
+    loop.exec()
+    signal.disconnect(on_signal)
+    return bool(fired)
+def process_events(duration_s=0.05):
+    loop = QEventLoop()
+    QTimer.singleShot(int(duration_s * 1000), loop.quit)
+    loop.exec()
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return (time.perf_counter() - start) * 1000, result
+def make_messages(count, content_chars=200):
+    content = (SAMPLE_TEXT * (content_chars // len(SAMPLE_TEXT) + 1))[:content_chars]
+    return [{'role': 'user' if i % 2 == 0 else 'assistant', 'content': f'{i}: {content}'} for i in range(count)]
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024, 1) # macOS 单位为字节，Linux 为 KB
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+def create_window(history_dir):
+    # 历史记录写入临时目录，不读写真实的配置文件
+    gui.get_history_path = lambda file_name="": os.path.join(history_dir, file_name)
+    window = gui.ChatGUI()
+    window._save_config = lambda: None
+    window.api_key = 'benchmark'
+    window.selected_model = 'qwen-plus'
+    window.response_cache_config['enabled'] = False
+    Controller.configure_cache(None)
+    wait_for(window.startup_finished, 5)
+    return window
+def bench_streaming(window, args):
+    token_counter = get_token_counter()
+    results = []
+    monitor = StallMonitor()
+    for _ in range(args.repeat):
+        window.handle_user_command('/reset')
+        monitor.start()
+        start = time.perf_counter()
+        finished = wait_for(window.api_request_finished_signal, args.timeout,
+                            lambda: window.handle_user_command('请介绍一下科技金融'))
+        elapsed = time.perf_counter() - start
+        stall = monitor.stop()
+        answer = window.dialog_history[-1]['content'] if finished and window.dialog_history else ''
+        tokens = token_counter.count_text(answer)
+        results.append(dict(stall, elapsed_s=round(elapsed, 3), chars=len(answer), tokens=tokens,
+                            tokens_per_s=round(tokens / elapsed, 1) if elapsed else None, completed=finished))
+    return {
+        'runs': results,
+        'median_tokens_per_s': statistics.median(r['tokens_per_s'] or 0 for r in results),
+        'max_stall_ms': max(r['max_gap_ms'] for r in results),
+    }
+def bench_save_history(window, args):
+    window.handle_user_command('/reset')
+    window.dialog_history = make_messages(args.messages)
+    full_ms, _ = timed(window._save_current_history)
+    window.dialog_history += make_messages(2)
+    incremental_ms, _ = timed(window._save_current_history)
+    return {'messages': args.messages, 'full_save_ms': round(full_ms, 2), 'incremental_save_ms': round(incremental_ms, 2)}
+def bench_history_list(window, history_dir, args):
+    store = SessionStore(history_dir)
+    messages = make_messages(4, 100)
+    for i in range(args.sessions):
+        store.append(f'chat_2000{i:010d}.jsonl', messages)
+    store.close()
+    # 扫描在写入线程中进行，计时到侧边栏收到结果为止
+    load_ms, _ = timed(wait_for, window.history_list_loaded_signal, args.timeout, window._load_history_list)
+    paint_ms, _ = timed(window.history_list_view.repaint)
+    return {'sessions': args.sessions, 'load_ms': round(load_ms, 2), 'first_paint_ms': round(paint_ms, 2)}
+def bench_display_history(window, history_dir, args):
+    filename = 'chat_19990101000000.jsonl'
+    store = SessionStore(history_dir)
+    store.append(filename, make_messages(args.messages))
+    store.close()
+    display_ms, _ = timed(window._display_historical_chat, filename)
+    process_events(0.2) # 让后台预取完成
+    return {'messages': args.messages, 'display_ms': round(display_ms, 2)}
+def run(args):
+    app = QApplication.instance() or QApplication([])
+    history_dir = tempfile.mkdtemp(prefix='chat-benchmark-')
+    original_backend = Controller.aprocess_api_request
+    Controller.aprocess_api_request = staticmethod(make_fake_backend(args.chunks, args.chunk_chars, args.rate))
+    try:
+        startup_ms, window = timed(create_window, history_dir)
+        results = {'startup_ms': round(startup_ms, 2)}
+        results['streaming'] = bench_streaming(window, args)
+        results['save_history'] = bench_save_history(window, args)
+        results['history_list'] = bench_history_list(window, history_dir, args)
+        results['display_history'] = bench_display_history(window, history_dir, args)
+        window.close()
+        app.processEvents()
+        results['peak_rss_mb'] = peak_rss_mb()
+    finally:
+        Controller.aprocess_api_request = original_backend
+        shutil.rmtree(history_dir, ignore_errors=True)
+    return {
+        'revision': git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'pyside': PYSIDE_VERSION,
+        'platform': platform.platform(),
+        'params': vars(args),
+        'results': results,
+    }
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='科技金融小助手无界面性能基准')
+    parser.add_argument('--output', help='结果 JSON 文件路径，默认输出到标准输出')
+    parser.add_argument('--chunks', type=int, default=2000, help='每次回答的流式增量个数')
+    parser.add_argument('--chunk-chars', type=int, default=4, help='每个增量的字符数')
+    parser.add_argument('--rate', type=float, default=0, help='每秒产出的增量个数，0 表示不限速')
+    parser.add_argument('--repeat', type=int, default=3, help='流式渲染测试的重复次数')
+    parser.add_argument('--sessions', type=int, default=1000, help='历史记录列表测试的会话数')
+    parser.add_argument('--messages', type=int, default=2000, help='保存/查看历史测试的消息条数')
+    parser.add_argument('--timeout', type=float, default=120, help='单次回答的超时时间（秒）')
+    return parser.parse_args(argv)
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    args = parse_args()
+    report = json.dumps(run(args), ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(report + '\n')
+    else:
+        print(report)
@@ -0,0 +1,60 @@
+# chat_tab.py
+import itertools
+from PySide6.QtCore import QObject
+from PySide6.QtGui import QFont
+from PySide6.QtWidgets import QTextBrowser
+from transcript import TranscriptRenderer
+from stream_buffer import StreamBuffer
+from history_viewer import HistoryPager
+from context_manager import ContextWindow
+_tab_ids = itertools.count(1)
+class ChatTab(QObject):
+    """一个聊天标签页：自己的视图、对话历史、服务端会话、流式缓冲和正在进行的请求，各标签页可以同时输出"""
+    def __init__(self, session_store, format_message, flush_policy, on_stream_flush, parent=None, wait_for_writes=None,
+                 register_resources=None):
+        super().__init__(parent)
+        self.tab_id = next(_tab_ids)
+        self.title = "新对话"
+        self.view = QTextBrowser()
+        self.view.setReadOnly(True)
+        self.view.setFont(QFont("微软雅黑", 12))
+        self.view.setOpenExternalLinks(True)
+        self.view.document().setUndoRedoEnabled(False) # 只读视图，流式渲染的反复编辑不需要撤销记录
+        self.renderer = TranscriptRenderer(self.view, register_resources)
+        self.history_pager = HistoryPager(session_store, self.renderer, format_message, self, wait_for_writes)
+        self.history_pager.messages_prepended.connect(self._on_messages_prepended)
+        # 请求协程写入的增量文本由 GUI 线程按固定帧率合并刷新到本标签页的文档
+        self.stream_buffer = StreamBuffer(lambda text: on_stream_flush(self, text), flush_policy, self)
+        self.context_window = ContextWindow() # 增量统计本会话各消息的 token 数
+        self.dialog_history = []
+        self.session_id = None
+        self.current_history_file = None
+        self.is_displaying_historical_chat = False
+        self.current_assistant_response_text = "" # 已显示的流式输出文本
+        self.saved_message_count = 0 # dialog_history 中已追加写入历史文件的消息条数
+        self.evicted_message_count = 0 # 已写入历史文件、为控制内存从 dialog_history 开头移除的消息条数
+        self.pending_delta_savings = None # 本次请求若成功，按增量模式节省的 (字节数, token 数)
+        self.active_request_id = 0 # 每次发起或取消请求时递增，用于丢弃过期请求的信号
+        self.active_request_future = None
+        self.stream_message_index = None # 正在流式输出的助手消息在视图中的序号
+        self.is_queued = False # 请求正在调度器中排队
+    @property
+    def is_busy(self):
+        return self.active_request_future is not None
+    def _on_messages_prepended(self, count):
+        # 生成过程中向上滚动读回了较早的消息，正在输出的消息序号随之后移
+        if self.stream_message_index is not None:
+            self.stream_message_index += count
+    def memory_usage(self):
+        """本标签页的主要内存占用（按字符数估算）：视图文档与对话历史"""
+        return {
+            'document_chars': self.view.document().characterCount(),
+            'rendered_messages': len(self.renderer),
+            'history_messages': len(self.dialog_history),
+            'history_chars': sum(len(m['content']) for m in self.dialog_history),
+            'evicted_messages': self.evicted_message_count,
+        }
+    def dispose(self):
+        self.stream_buffer.stop()
+        self.history_pager.shutdown()
+        self.view.deleteLater()
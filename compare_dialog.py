@@ -0,0 +1,215 @@
+# compare_dialog.py
+import time
+import itertools
+from PySide6.QtCore import Signal, Slot
+from PySide6.QtGui import QFont
+from PySide6.QtWidgets import (
+    QDialog, QVBoxLayout, QHBoxLayout, QLabel, QTextEdit, QTextBrowser, QPushButton, QCheckBox, QFrame, QWidget
+)
+from controller import Controller
+from stream_buffer import StreamBuffer
+from markdown_render import MarkdownStream
+_compare_ids = itertools.count(1)
+class CompareColumn(QFrame):
+    """一个模型的回答列：流式显示回答，结束后显示首字时间与总耗时，可以采用这一列的回答"""
+    adopt_requested = Signal(str) # 模型名
+    def __init__(self, model_name, flush_policy, parent=None):
+        super().__init__(parent)
+        self.setObjectName("compare_column")
+        self.model_name = model_name
+        self.answer = ""
+        self.succeeded = False
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        title_label = QLabel(model_name)
+        title_label.setFont(QFont("微软雅黑", 11, QFont.Bold))
+        layout.addWidget(title_label)
+        self.status_label = QLabel("等待开始")
+        self.status_label.setFont(QFont("微软雅黑", 9))
+        layout.addWidget(self.status_label)
+        self.view = QTextBrowser()
+        self.view.setFont(QFont("微软雅黑", 11))
+        self.view.setOpenExternalLinks(True)
+        layout.addWidget(self.view, 1)
+        self.adopt_button = QPushButton("采用此回答")
+        self.adopt_button.setEnabled(False)
+        self.adopt_button.clicked.connect(lambda: self.adopt_requested.emit(self.model_name))
+        layout.addWidget(self.adopt_button)
+        # 请求协程写入的增量文本按帧率合并刷新，多列同时输出时不会为每个增量发一次信号
+        self.stream_buffer = StreamBuffer(self._append_text, flush_policy, self)
+        self._markdown = None
+    def start(self):
+        self.answer = ""
+        self.succeeded = False
+        self.view.clear()
+        document = self.view.document()
+        self._markdown = MarkdownStream(document, lambda: document.characterCount() - 1)
+        self.status_label.setText("请求中…")
+        self.adopt_button.setEnabled(False)
+        self.adopt_button.setText("采用此回答")
+        self.stream_buffer.start()
+    def _append_text(self, text):
+        self.answer += text
+        self._markdown.feed(text)
+    def finish(self, result):
+        """result: 结束事件加上 'ttft_ms' 与 'duration_ms'"""
+        self.stream_buffer.stop()
+        self._markdown.finish()
+        ttft = f"{result['ttft_ms']:.0f} ms" if result.get('ttft_ms') is not None else "-"
+        timing = f"首字 {ttft}，总耗时 {result['duration_ms']:.0f} ms"
+        if result.get('cancelled'):
+            self.status_label.setText(f"已取消（{timing}）")
+        elif result.get('error') or not self.answer:
+            self.status_label.setText(f"失败（{timing}）")
+            self.view.setPlainText(result.get('text') or "未收到回答。")
+        else:
+            self.succeeded = True
+            notes = []
+            if result.get('cached'):
+                notes.append("来自缓存")
+            if result.get('failover_model'):
+                notes.append(f"由 {result['failover_model']} 回答")
+            self.status_label.setText(f"完成：{timing}" + (f"（{'，'.join(notes)}）" if notes else ""))
+            self.adopt_button.setEnabled(True)
+    def stop(self):
+        self.stream_buffer.stop()
+class CompareDialog(QDialog):
+    """多模型对比：同一个问题同时发给多个模型，各自在一列中流式输出；可选择“最先完成者胜出”，自动采用最快的回答并取消其余请求"""
+    answer_chosen = Signal(str, str, str) # 问题, 模型名, 回答
+    _model_finished = Signal(int, str, dict) # 轮次, 模型名, 结束事件
+    def __init__(self, api_key, history_messages, question, model_names, selected_models, flush_policy, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("多模型对比")
+        self.resize(1200, 720)
+        self.api_key = api_key
+        self.history_messages = history_messages # 问题之前的对话上下文
+        self.flush_policy = flush_policy
+        self._owner = f'compare-{next(_compare_ids)}'
+        self._run_id = 0
+        self._future = None
+        self._columns = {}
+        self._pending = set() # 尚未结束的模型
+        self._question = ""
+        self._first_wins = False
+        self._adopted = False
+        layout = QVBoxLayout(self)
+        self.question_edit = QTextEdit()
+        self.question_edit.setPlaceholderText("输入要同时发给多个模型的问题")
+        self.question_edit.setFont(QFont("微软雅黑", 11))
+        self.question_edit.setFixedHeight(80)
+        self.question_edit.setPlainText(question)
+        layout.addWidget(self.question_edit)
+        options_layout = QHBoxLayout()
+        self.model_checkboxes = {}
+        for model_name in model_names:
+            checkbox = QCheckBox(model_name)
+            checkbox.setChecked(model_name in selected_models)
+            self.model_checkboxes[model_name] = checkbox
+            options_layout.addWidget(checkbox)
+        options_layout.addStretch(1)
+        self.first_wins_checkbox = QCheckBox("最先完成者胜出（自动采用并取消其余请求）")
+        options_layout.addWidget(self.first_wins_checkbox)
+        self.start_button = QPushButton("开始对比")
+        self.start_button.clicked.connect(self.start)
+        options_layout.addWidget(self.start_button)
+        self.stop_button = QPushButton("停止")
+        self.stop_button.setEnabled(False)
+        self.stop_button.clicked.connect(self.stop)
+        options_layout.addWidget(self.stop_button)
+        layout.addLayout(options_layout)
+        self.columns_widget = QWidget()
+        self.columns_layout = QHBoxLayout(self.columns_widget)
+        self.columns_layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.columns_widget, 1)
+        self.hint_label = QLabel("每个模型的首字时间与总耗时也会记录到性能统计中。")
+        self.hint_label.setFont(QFont("微软雅黑", 9))
+        layout.addWidget(self.hint_label)
+        self._model_finished.connect(self._on_model_finished)
+    @property
+    def adopted(self):
+        return self._adopted
+    def selected_models(self):
+        return [name for name, checkbox in self.model_checkboxes.items() if checkbox.isChecked()]
+    def start(self):
+        question = self.question_edit.toPlainText().strip()
+        models = self.selected_models()
+        if not question or len(models) < 2:
+            self.hint_label.setText("请输入问题并至少选择两个模型。")
+            return
+        self.stop()
+        self._run_id += 1
+        self._adopted = False
+        self._question = question
+        self._first_wins = self.first_wins_checkbox.isChecked()
+        for column in self._columns.values():
+            column.deleteLater()
+        self._columns = {}
+        for model_name in models:
+            column = CompareColumn(model_name, self.flush_policy, self.columns_widget)
+            column.adopt_requested.connect(self._adopt)
+            self.columns_layout.addWidget(column, 1)
+            self._columns[model_name] = column
+            column.start()
+        messages = self.history_messages + [{'role': 'user', 'content': question}]
+        self._pending = set(models)
+        self.start_button.setEnabled(False)
+        self.stop_button.setEnabled(True)
+        self.hint_label.setText(f"已同时发给 {len(models)} 个模型。")
+        self._future = Controller.submit(self._run(self._run_id, messages, models, self._first_wins, dict(self._columns)))
+    async def _run(self, run_id, messages, models, first_wins, columns):
+        """在事件循环线程中运行：增量写入各列的缓冲，每个模型结束时通过信号通知 GUI 线程"""
+        started_at = time.perf_counter()
+        first_token_at = {}
+        async for model_name, event in Controller.afan_out(self.api_key, messages, models, first_wins, owner=self._owner):
+            now = time.perf_counter()
+            if not event.get('is_end'):
+                if event.get('text'):
+                    first_token_at.setdefault(model_name, now)
+                    columns[model_name].stream_buffer.push(event['text'])
+                continue
+            ttft = first_token_at.get(model_name)
+            self._model_finished.emit(run_id, model_name, dict(
+                event, ttft_ms=(ttft - started_at) * 1000 if ttft is not None else None, duration_ms=(now - started_at) * 1000))
+    @Slot(int, str, dict)
+    def _on_model_finished(self, run_id, model_name, result):
+        if run_id != self._run_id:
+            return
+        column = self._columns[model_name]
+        column.finish(result)
+        self._pending.discard(model_name)
+        if self._first_wins and column.succeeded and not self._adopted:
+            self._adopt(model_name)
+        if not self._pending:
+            self._future = None
+            self.start_button.setEnabled(True)
+            self.stop_button.setEnabled(False)
+    @Slot(str)
+    def _adopt(self, model_name):
+        """把选中的回答写回对话；手动采用后关闭窗口，自动采用时保留窗口以便查看各模型的结果"""
+        if self._adopted:
+            return
+        column = self._columns[model_name]
+        self._adopted = True
+        self.answer_chosen.emit(self._question, model_name, column.answer)
+        for other in self._columns.values():
+            other.adopt_button.setEnabled(False)
+        column.adopt_button.setText("已采用")
+        if self._first_wins:
+            self.hint_label.setText(f"{model_name} 最先完成，回答已写入对话。")
+        else:
+            self.accept()
+    def stop(self):
+        if self._future is not None:
+            self._future.cancel()
+            self._future = None
+        self._run_id += 1 # 之后到达的结束信号都会被忽略
+        for column in self._columns.values():
+            column.stop()
+            if column.model_name in self._pending:
+                column.status_label.setText("已停止")
+        self._pending = set()
+        self.start_button.setEnabled(True)
+        self.stop_button.setEnabled(False)
+    def done(self, result):
+        self.stop()
+        super().done(result)
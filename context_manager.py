@@ -0,0 +1,143 @@
+# context_manager.py
+import re
+import logging
+import threading
+from collections import OrderedDict
+from controller import get_context_budget
+MESSAGE_OVERHEAD_TOKENS = 4 # 每条消息的角色、分隔符等额外开销
+SUMMARY_BUDGET_RATIO = 0.1 # 被裁剪对话的摘要最多占用预算的比例
+CJK_PATTERN = re.compile(r'[　-〿㐀-䶿一-鿿＀-￯]')
+WORD_PATTERN = re.compile(r'[A-Za-z0-9_]+|[^\sA-Za-z0-9_　-〿㐀-䶿一-鿿＀-￯]')
+class _HeuristicTokenizer:
+    """tiktoken 不可用时的估算：中文按字计，英文单词约 1.3 个 token"""
+    name = 'heuristic'
+    @staticmethod
+    def count(text):
+        cjk = len(CJK_PATTERN.findall(text))
+        words = WORD_PATTERN.findall(text)
+        return cjk + sum(max(1, round(len(w) / 4)) if w.isalnum() else 1 for w in words)
+class _TiktokenTokenizer:
+    name = 'tiktoken'
+    def __init__(self, encoding):
+        self.encoding = encoding
+    def count(self, text):
+        return len(self.encoding.encode(text, disallowed_special=()))
+_heuristic_tokenizer = _HeuristicTokenizer()
+_loaded_tokenizer = None
+_tokenizer_lock = threading.Lock()
+def load_tokenizer():
+    """加载 tiktoken 分词器（首次可能需要下载编码文件，耗时不定），只应在后台线程中调用；
+    并发调用时等待同一次加载，失败时改用估算方式"""
+    global _loaded_tokenizer
+    with _tokenizer_lock:
+        if _loaded_tokenizer is None:
+            try:
+                import tiktoken
+                _loaded_tokenizer = _TiktokenTokenizer(tiktoken.get_encoding('cl100k_base'))
+            except Exception as e:
+                logging.warning(f"tiktoken 不可用，改用估算方式统计 token: {e}")
+                _loaded_tokenizer = _heuristic_tokenizer
+        return _loaded_tokenizer
+def get_tokenizer():
+    """当前可用的分词器：后台加载完成之前使用估算方式，调用线程不会等待加载或下载"""
+    return _loaded_tokenizer or _heuristic_tokenizer
+class TokenCounter:
+    """带 LRU 缓存的 token 计数，相同内容只计算一次"""
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+    def count_text(self, text):
+        tokenizer = get_tokenizer()
+        key = (tokenizer.name, len(text), hash(text)) # 分词器加载完成后不再使用估算时缓存的结果
+        with self._lock:
+            count = self._cache.get(key)
+            if count is not None:
+                self._cache.move_to_end(key)
+                return count
+        count = tokenizer.count(text)
+        with self._lock:
+            self._cache[key] = count
+            if len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return count
+    def count_message(self, message):
+        return self.count_text(message['content']) + MESSAGE_OVERHEAD_TOKENS
+_shared_counter = TokenCounter()
+def get_token_counter():
+    return _shared_counter
+class ContextWindow:
+    """一个会话的上下文窗口：增量维护每条消息的 token 数，按模型预算裁剪较早的对话"""
+    def __init__(self, counter=None):
+        self.counter = counter or get_token_counter()
+        self._counts = [] # 与已同步的消息一一对应的 token 数
+        self._keys = [] # 用于判断消息列表是否只是在末尾追加
+        self._summary_cache = {} # 被裁剪的消息条数 -> 摘要消息
+        self._tokenizer_name = None # _counts 是用哪个分词器统计的
+        self.last_stats = {}
+    @staticmethod
+    def _key(message):
+        return (message['role'], len(message['content']), hash(message['content']))
+    def _sync(self, messages):
+        synced = len(self._counts)
+        is_append_only = (synced <= len(messages) and
+                          (synced == 0 or (self._keys[0] == self._key(messages[0]) and
+                                           self._keys[-1] == self._key(messages[synced - 1]))))
+        tokenizer_name = get_tokenizer().name
+        if not is_append_only or tokenizer_name != self._tokenizer_name:
+            # 会话被清空或切换，或分词器已从估算换成 tiktoken，重新同步（内容级缓存使得这一步仍然很快）
+            self._tokenizer_name = tokenizer_name
+            self._counts, self._keys = [], []
+            self._summary_cache.clear()
+            synced = 0
+        for message in messages[synced:]:
+            self._counts.append(self.counter.count_message(message))
+            self._keys.append(self._key(message))
+    @property
+    def total_tokens(self):
+        return sum(self._counts)
+    def fit(self, messages, model_name, budget=None):
+        """返回在预算内要发送的消息列表：始终保留最后一条，从最早的完整轮次开始裁剪，被裁剪的部分以摘要代替"""
+        self._sync(messages)
+        budget = budget or get_context_budget(model_name)
+        total = sum(self._counts)
+        if not messages or total <= budget:
+            self.last_stats = {'total_tokens': total, 'sent_tokens': total, 'dropped_messages': 0, 'budget': budget}
+            return list(messages)
+        summary_budget = int(budget * SUMMARY_BUDGET_RATIO)
+        remaining = budget - summary_budget
+        start = len(messages)
+        while start > 0 and (start == len(messages) or self._counts[start - 1] <= remaining):
+            remaining -= self._counts[start - 1]
+            start -= 1
+        # 从用户消息开始发送，避免以孤立的助手回复开头
+        while start < len(messages) - 1 and messages[start]['role'] != 'user':
+            start += 1
+        kept = messages[start:]
+        summary = self._summary_for(messages, start, summary_budget) if start > 0 else None
+        selected = ([summary] if summary else []) + list(kept)
+        sent_tokens = sum(self._counts[start:]) + (self.counter.count_message(summary) if summary else 0)
+        self.last_stats = {'total_tokens': total, 'sent_tokens': sent_tokens, 'dropped_messages': start, 'budget': budget}
+        logging.info(f"上下文裁剪: 共 {total} tokens，发送 {sent_tokens} tokens，省略最早的 {start} 条消息（预算 {budget}）")
+        return selected
+    def _summary_for(self, messages, dropped_count, summary_budget):
+        summary = self._summary_cache.get(dropped_count)
+        if summary is not None:
+            return summary
+        # 抽取式摘要：按时间顺序列出被省略轮次中用户的问题，超出摘要预算时只保留最近的
+        questions = [m['content'].strip().replace('\n', ' ') for m in messages[:dropped_count] if m['role'] == 'user']
+        lines = []
+        used = 0
+        for question in reversed(questions):
+            line = f"- {question[:80]}{'…' if len(question) > 80 else ''}"
+            cost = self.counter.count_text(line) + 1
+            if used + cost > summary_budget:
+                break
+            lines.append(line)
+            used += cost
+        if not lines:
+            return None
+        content = f"（为控制上下文长度，已省略较早的 {dropped_count} 条对话。用户此前问过：）\n" + '\n'.join(reversed(lines))
+        summary = {'role': 'system', 'content': content}
+        self._summary_cache = {dropped_count: summary}
+        return summary
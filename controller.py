@@ -1,64 +1,506 @@
 # controller.py
-from dashscope import Application
+import os
+import json
+import asyncio
+import queue
 import logging
+import importlib
+from abc import ABC, abstractmethod
 from http import HTTPStatus # 引入 HTTPStatus
-class Controller:
-    @staticmethod
-    def process_api_request(api_key, dialog_history, model_name, session_id=None):
-        model_app_id_map = {
-            'deepseek-r1-distill-qwen-32b': '39d8f00473e14906b3fe4c32cbdb4f18',
-            'deepseek-r1': '9facbc3b881943eaa6debfe508deee32',
-            'qwen-plus': 'f196f5679be34d4cb2942fad915f21f3',
-            'qwen-max': '79602e8ff8564665958c8392b507256a'
+from event_loop import get_event_loop_thread
+from response_cache import ResponseCache
+DEFAULT_BASE_URL = 'https://dashscope.aliyuncs.com/api/v1'
+ERROR_DOC_URL = 'https://help.aliyun.com/zh/model-studio/developer-reference/error-code'
+DEFAULT_CONTEXT_BUDGET = 24000
+# app_id: 百炼应用ID；context_budget: 每次请求发送的对话历史 token 上限（低于模型上下文长度，给回答留出空间）；
+# fallbacks: 该模型过载或重试用完时依次改用的备用模型
+model_app_id_map = {
+    'deepseek-r1-distill-qwen-32b': {'app_id': '39d8f00473e14906b3fe4c32cbdb4f18', 'context_budget': 24000},
+    'deepseek-r1': {'app_id': '9facbc3b881943eaa6debfe508deee32', 'context_budget': 48000,
+                    'fallbacks': ['deepseek-r1-distill-qwen-32b']},
+    'qwen-plus': {'app_id': 'f196f5679be34d4cb2942fad915f21f3', 'context_budget': 96000, 'fallbacks': ['qwen-max']},
+    'qwen-max': {'app_id': '79602e8ff8564665958c8392b507256a', 'context_budget': 24000, 'fallbacks': ['qwen-plus']},
+}
+# 换用模型或重试时已经输出了部分回答：把部分回答作为助手消息发送，请模型从中断处接着写
+RESUME_PROMPT = '上面的回答因网络或服务问题中断了。请从中断处继续输出剩余内容，不要重复已经输出的部分，也不要加任何说明。'
+def get_app_id(model_name):
+    model_config = model_app_id_map.get(model_name)
+    return model_config['app_id'] if model_config else None
+def get_context_budget(model_name):
+    model_config = model_app_id_map.get(model_name)
+    return model_config.get('context_budget', DEFAULT_CONTEXT_BUDGET) if model_config else DEFAULT_CONTEXT_BUDGET
+def get_fallback_models(model_name):
+    model_config = model_app_id_map.get(model_name) or {}
+    return [m for m in model_config.get('fallbacks', []) if m != model_name and m in model_app_id_map]
+def build_resume_messages(messages, partial_answer):
+    return list(messages) + [{'role': 'assistant', 'content': partial_answer}, {'role': 'user', 'content': RESUME_PROMPT}]
+class DashScopeAPIError(Exception):
+    """DashScope 应用接口返回的错误（HTTP 状态码非 200 或流中的错误事件）"""
+    def __init__(self, status_code, code, message, request_id=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.code = code
+        self.message = message
+        self.request_id = request_id
+    def to_user_message(self):
+        return (
+            f'请求ID: {self.request_id}\n'
+            f'错误码: {self.code or self.status_code}\n'
+            f'错误信息: {self.message}\n'
+            f'请参考文档：{ERROR_DOC_URL}'
+        )
+class DashScopeHttpClient:
+    """DashScope 应用调用的 HTTP 客户端：在事件循环线程中复用一个带 keep-alive 连接池的 aiohttp 会话"""
+    def __init__(self, base_url=DEFAULT_BASE_URL, pool_size=16, keepalive_timeout=60):
+        self.base_url = base_url.rstrip('/')
+        self.pool_size = pool_size
+        self.keepalive_timeout = keepalive_timeout
+        self._session = None
+    def _get_session(self):
+        # 只能在事件循环线程中调用；会话与连接池在首次请求时创建并一直复用
+        if self._session is None or self._session.closed:
+            import aiohttp # 导入较慢（约 0.2 秒），推迟到第一次使用时，不影响启动
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=300,
+            )
+            timeout = aiohttp.ClientTimeout(total=None, connect=10, sock_read=120)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout, read_bufsize=2 ** 20)
+        return self._session
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+    async def stream_completion(self, api_key, app_id, messages, session_id=None):
+        """以 SSE 流式调用应用接口，逐个产出服务端返回的 JSON 数据。
+        input.messages 与 session_id 同时出现时服务端只使用 messages，所以会话增量请求（带 session_id、
+        只有新一轮的用户消息）改用 input.prompt，由服务端会话提供之前的上下文；完整历史才放在 messages 中"""
+        if session_id and len(messages) == 1 and messages[0]['role'] == 'user':
+            request_input = {'prompt': messages[0]['content']}
+        else:
+            request_input = {'messages': messages}
+        if session_id:
+            request_input['session_id'] = session_id
+        payload = {
+            'input': request_input,
+            'parameters': {'incremental_output': True},
+            'debug': {},
         }
-        app_id = model_app_id_map.get(model_name)
+        headers = {
+            'Authorization': f'Bearer {api_key}',
+            'Content-Type': 'application/json',
+            'Accept': 'text/event-stream',
+            'X-DashScope-SSE': 'enable',
+        }
+        url = f'{self.base_url}/apps/{app_id}/completion'
+        async with self._get_session().post(url, json=payload, headers=headers) as response:
+            if response.status != HTTPStatus.OK:
+                body = await response.text()
+                raise self._error_from_body(response.status, body)
+            event_status = HTTPStatus.OK
+            data_lines = []
+            try:
+                async for raw_line in response.content:
+                    line = raw_line.decode('utf-8').rstrip('\r\n')
+                    if line.startswith(':HTTP_STATUS/'):
+                        event_status = int(line.split('/', 1)[1] or HTTPStatus.OK)
+                    elif line.startswith('data:'):
+                        data_lines.append(line[5:])
+                    elif not line and data_lines:
+                        data = '\n'.join(data_lines)
+                        data_lines = []
+                        if event_status != HTTPStatus.OK:
+                            raise self._error_from_body(event_status, data)
+                        yield json.loads(data)
+            except (asyncio.CancelledError, GeneratorExit):
+                # 请求被取消或调用方提前停止读取：直接关闭连接，不再读完剩余的流，避免继续消耗流量
+                response.close()
+                raise
+    @staticmethod
+    def _error_from_body(status_code, body):
+        try:
+            data = json.loads(body)
+        except (TypeError, ValueError):
+            data = {'message': body}
+        return DashScopeAPIError(status_code, data.get('code'), data.get('message', body), data.get('request_id'))
+class ChatBackend(ABC):
+    """聊天后端接口。stream() 是异步生成器，按顺序产出增量事件 {'text': 增量文本, 'session_id': 服务端会话ID或None}，
+    可选的 'usage': {'input_tokens', 'output_tokens'} 为截至该事件的用量；
+    出错时抛出 DashScopeAPIError（会话失效请使用 SESSION_ERROR_CODES 中的错误码），被取消时应立即释放连接"""
+    name = None
+    def __init__(self, base_url=None):
+        self.base_url = base_url
+    def supports_model(self, model_name):
+        return True
+    @abstractmethod
+    async def stream(self, api_key, model_name, messages, session_id=None):
+        """产出本次请求的增量事件，子类以异步生成器实现"""
+    async def warm_up(self):
+        """窗口显示后在后台调用，用于预先导入依赖或建立连接"""
+    async def close(self):
+        pass
+class DashScopeAppBackend(ChatBackend):
+    """百炼应用接口后端，模型按 model_app_id_map 映射为应用ID；也可指向兼容该协议的本地替身服务器（standin_server.py）"""
+    name = 'dashscope'
+    def __init__(self, base_url=DEFAULT_BASE_URL):
+        super().__init__(base_url or DEFAULT_BASE_URL)
+        self.http_client = DashScopeHttpClient(self.base_url)
+    def supports_model(self, model_name):
+        return get_app_id(model_name) is not None
+    async def stream(self, api_key, model_name, messages, session_id=None):
+        async for data in self.http_client.stream_completion(api_key, get_app_id(model_name), messages, session_id):
+            output = data.get('output') or {}
+            delta = {'text': output.get('text') or '', 'session_id': output.get('session_id')}
+            models_usage = (data.get('usage') or {}).get('models') or []
+            if models_usage:
+                delta['usage'] = {'input_tokens': models_usage[0].get('input_tokens'),
+                                  'output_tokens': models_usage[0].get('output_tokens')}
+            yield delta
+    async def warm_up(self):
+        await asyncio.to_thread(importlib.import_module, 'aiohttp')
+        self.http_client._get_session()
+    async def close(self):
+        await self.http_client.close()
+backend_factories = {'dashscope': DashScopeAppBackend} # 后端名称 -> 工厂函数(base_url)
+def register_backend(name, factory):
+    """注册新的聊天后端，之后可通过 Controller.configure(backend=name) 或配置文件中的 backend 选用"""
+    backend_factories[name] = factory
+SESSION_ERROR_CODES = {'InvalidSession', 'SessionNotFound', 'SessionExpired', 'Session.NotFound', 'Session.Expired'}
+def is_session_error(error):
+    """判断错误是否表示服务端会话已过期或无效"""
+    if error.code in SESSION_ERROR_CODES:
+        return True
+    return error.status_code in (HTTPStatus.BAD_REQUEST, HTTPStatus.NOT_FOUND) and 'session' in (error.message or '').lower()
+async def _read_until_text(stream):
+    """从增量流中读到第一个带文本的事件（或流结束）为止，返回已读出的事件"""
+    deltas = []
+    async for delta in stream:
+        deltas.append(delta)
+        if delta.get('text'):
+            break
+    return deltas
+class Controller:
+    base_url = os.environ.get('DASHSCOPE_HTTP_BASE_URL', DEFAULT_BASE_URL)
+    backend_name = 'dashscope'
+    response_cache = None # ResponseCache 实例，为 None 时不使用缓存
+    telemetry = None # telemetry.Telemetry 实例，为 None 时不记录请求指标
+    scheduler = None # request_scheduler.RequestScheduler 实例，为 None 时不限制并发
+    retry_policy = None # retry_policy.RetryPolicy 实例，为 None 时出错立即返回
+    _backend = None
+    @classmethod
+    def configure(cls, base_url=None, backend=None, models=None):
+        """设置后端与接口地址（例如指向本地的替身服务器），models 为追加或覆盖的 {模型名: {'app_id', 'context_budget'}}；
+        后端或地址变化时重建后端及其连接池"""
+        if models:
+            for model_name, model_config in models.items():
+                model_app_id_map[model_name] = {**model_app_id_map.get(model_name, {}), **model_config}
+        base_url = (base_url or os.environ.get('DASHSCOPE_HTTP_BASE_URL') or DEFAULT_BASE_URL).rstrip('/')
+        backend = backend or 'dashscope'
+        if backend not in backend_factories:
+            logging.warning(f"未知的后端 {backend}，改用 dashscope")
+            backend = 'dashscope'
+        if base_url == cls.base_url and backend == cls.backend_name and cls._backend is not None:
+            return
+        old_backend = cls._backend
+        cls.base_url = base_url
+        cls.backend_name = backend
+        cls._backend = None
+        if old_backend is not None:
+            get_event_loop_thread().submit(old_backend.close())
+        logging.info(f"聊天后端: {backend}，接口地址: {base_url}")
+    @classmethod
+    def configure_cache(cls, cache):
+        cls.response_cache = cache
+    @classmethod
+    def configure_scheduler(cls, scheduler):
+        cls.scheduler = scheduler
+    @classmethod
+    def configure_retry(cls, retry_policy):
+        cls.retry_policy = retry_policy
+    @classmethod
+    def configure_telemetry(cls, telemetry):
+        cls.telemetry = telemetry
+    @classmethod
+    def cache_stats(cls):
+        return cls.response_cache.stats() if cls.response_cache is not None else None
+    @classmethod
+    def _get_backend(cls):
+        if cls._backend is None:
+            cls._backend = backend_factories[cls.backend_name](cls.base_url)
+        return cls._backend
+    @classmethod
+    def submit(cls, coro):
+        """在共享事件循环中运行协程（供 GUI 调度请求），返回 concurrent.futures.Future"""
+        return get_event_loop_thread().submit(coro)
+    @classmethod
+    def warm_up(cls):
+        """在后台预先导入网络库并创建连接池（窗口显示后调用），使第一次请求不必等待"""
+        return cls.submit(cls._get_backend().warm_up())
+    @classmethod
+    def shutdown(cls):
+        """关闭连接池并停止事件循环线程"""
+        backend, cls._backend = cls._backend, None
+        async def cleanup():
+            if backend is not None:
+                await backend.close()
+        get_event_loop_thread().stop(cleanup)
+    @classmethod
+    async def aprocess_api_request(cls, api_key, dialog_history, model_name, session_id=None, full_history=None, use_cache=True,
+                                   owner=None):
+        """异步生成器：产出与 process_api_request 相同格式的增量事件。
+        full_history 用于会话增量模式：dialog_history 只包含新一轮消息，若服务端报告会话失效则改用完整历史重新请求；
+        owner 为发起方标识（例如标签页），调度器按发起方公平排队，排队时先产出一个带 'queued' 的空事件"""
         if not api_key:
             logging.warning("API key is missing in controller.")
             # 返回一个字典，包含错误信息和表示流式结束的标记
             yield {'text': '请先在设置中填写有效的 API 密钥。', 'session_id': None, 'is_end': True}
             return
-        if not app_id:
+        if not cls._get_backend().supports_model(model_name):
             logging.warning(f"Invalid model name: {model_name}")
             yield {'text': '请选择有效的模型。', 'session_id': None, 'is_end': True}
             return
+        telemetry = cls.telemetry
+        metrics = telemetry.start(model_name, cls.backend_name, dialog_history) if telemetry is not None else None
         try:
-            logging.info(f"Calling Application with app_id: {app_id}, messages: {dialog_history}, session_id: {session_id}, stream=True, incremental_output=True")
-            
-            # 使用流式输出和增量输出
-            responses = Application.call(
-                api_key=api_key,
-                app_id=app_id,
-                messages=dialog_history,
-                session_id=session_id,
-                stream=True,  # 启用流式输出
-                incremental_output=True # 启用增量输出
-            )
-            full_response_text = ""
-            returned_session_id = session_id # 初始化为传入的session_id
-            for response in responses: # 遍历流式响应
-                if response.status_code != HTTPStatus.OK: # 检查响应状态码
-                    error_message = (
-                        f'请求ID: {response.request_id}\n'
-                        f'错误码: {response.status_code}\n'
-                        f'错误信息: {response.message}\n'
-                        f'请参考文档：https://help.aliyun.com/zh/model-studio/developer-reference/error-code'
-                    )
-                    logging.error(f"API流式响应错误: {error_message}")
-                    # 发生错误时，发送错误信息并标记为结束
-                    yield {'text': error_message, 'session_id': returned_session_id, 'is_end': True, 'error': True}
-                    return # 终止生成器
-                else:
-                    delta_text = response.output.text # 获取增量文本
-                    current_session_id = response.output.session_id # 获取当前的session_id
-                    if current_session_id:
-                        returned_session_id = current_session_id # 更新session_id
-                    if delta_text:
-                        full_response_text += delta_text
-                        # 每次收到增量内容，通过 yield 返回，并标记 is_end 为 False
-                        yield {'text': delta_text, 'session_id': returned_session_id, 'is_end': False}
+            async for event in cls._acached_or_stream(api_key, dialog_history, model_name, session_id, full_history, use_cache,
+                                                      owner):
+                if metrics is not None:
+                    metrics.observe(event)
+                yield event
+        finally:
+            # 正常结束、出错或被取消（取消时状态为 cancelled）都记录一条指标
+            if metrics is not None:
+                try:
+                    telemetry.record(metrics)
+                except Exception as e:
+                    logging.warning(f"记录请求指标失败: {e}")
+    @classmethod
+    async def afan_out(cls, api_key, dialog_history, model_names, first_complete_wins=False, owner=None):
+        """把同一组消息同时发给多个模型，按到达顺序产出 (模型名, 事件)，事件格式与 aprocess_api_request 相同。
+        first_complete_wins 为 True 时，第一个成功结束的模型胜出，其余请求立即取消，并各产出一个带 'cancelled' 的结束事件"""
+        events = asyncio.Queue()
+        async def pump(model_name):
+            # 每个模型单独排队，避免某个模型名额已满时挡住同一问题发往其他模型的请求
+            try:
+                async for event in cls.aprocess_api_request(api_key, dialog_history, model_name, owner=f'{owner}:{model_name}'):
+                    events.put_nowait((model_name, event))
+            finally:
+                events.put_nowait((model_name, None))
+        tasks = {model_name: asyncio.ensure_future(pump(model_name)) for model_name in dict.fromkeys(model_names)}
+        running = set(tasks)
+        try:
+            while running:
+                model_name, event = await events.get()
+                if model_name not in running:
+                    continue # 已结束或已取消的模型残留在队列中的事件
+                if event is None:
+                    running.discard(model_name)
+                    continue
+                if event.get('is_end'):
+                    running.discard(model_name)
+                yield model_name, event
+                succeeded = event.get('is_end') and not event.get('error') and (event.get('answer') or event.get('cached'))
+                if first_complete_wins and succeeded:
+                    for other in list(running):
+                        tasks[other].cancel()
+                        running.discard(other)
+                        logging.info(f"{model_name} 最先完成，取消 {other} 的请求")
+                        yield other, {'text': '', 'session_id': None, 'is_end': True, 'cancelled': True}
+        finally:
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+    @classmethod
+    async def _acached_or_stream(cls, api_key, dialog_history, model_name, session_id, full_history, use_cache, owner=None):
+        cache = cls.response_cache if use_cache else None
+        cache_key = None
+        if cache is not None:
+            # 缓存键使用完整的对话上下文，而不是增量模式下只发送的新一轮消息
+            cache_key = ResponseCache.make_key(model_name, full_history if full_history is not None else dialog_history,
+                                               (cls.backend_name, cls.base_url, get_app_id(model_name)))
+            cached = await asyncio.to_thread(cache.get, cache_key)
+            if cached is not None:
+                text, tier = cached
+                logging.info(f"回答缓存命中（{tier}），长度: {len(text)}")
+                async for event in cls._replay_cached(text, tier):
+                    yield event
+                return
+        # 缓存命中不占用并发名额，只有真正发往服务端的请求才经过调度器
+        slot = cls.scheduler.request(model_name, owner) if cls.scheduler is not None else None
+        try:
+            if slot is not None and not slot.granted:
+                yield {'text': '', 'session_id': session_id, 'is_end': False, 'queued': cls.scheduler.queued_count}
+                await slot.wait()
+            async for event in cls._astream_request(api_key, model_name, dialog_history, session_id, full_history):
+                # 由备用模型生成或中断后续写拼接的回答不属于 model_name，不写入缓存
+                if event.get('is_end') and not event.get('error') and cache_key is not None and event.get('answer') \
+                        and not event.get('failover_model') and not event.get('resumed'):
+                    await asyncio.to_thread(cache.put, cache_key, event['answer'], model_name)
+                yield event
+        finally:
+            if slot is not None:
+                slot.release()
+    @staticmethod
+    async def _replay_cached(text, tier, chunk_size=32):
+        """按与实时流相同的事件格式回放缓存的回答；缓存的这一轮不在服务端会话中，所以 session_id 为 None"""
+        for start in range(0, len(text), chunk_size):
+            yield {'text': text[start:start + chunk_size], 'session_id': None, 'is_end': False, 'cached': tier}
+            await asyncio.sleep(0) # 让出事件循环，避免长回答阻塞其他请求
+        yield {'text': '', 'session_id': None, 'is_end': True, 'cached': tier}
+    @classmethod
+    async def _astream_request(cls, api_key, model_name, dialog_history, session_id=None, full_history=None):
+        policy = cls.retry_policy
+        base_history = full_history if full_history is not None else dialog_history # 不依赖服务端会话的完整上下文
+        candidates = [model_name] + get_fallback_models(model_name) if policy is not None else [model_name]
+        current_model = model_name
+        messages, request_session_id = dialog_history, session_id
+        full_response_text = ""
+        usage = None
+        returned_session_id = session_id # 初始化为传入的session_id
+        session_fallback = False
+        retries = 0 # 累计重试次数（含换用备用模型）
+        model_retries = 0 # 当前模型上的重试次数
+        hedged = None
+        resumed = False # 是否把部分回答交给模型续写
+        try:
+            while True:
+                try:
+                    logging.info(f"Calling {cls.backend_name} model {current_model} at {cls.base_url}, messages: {len(messages)}, session_id: {request_session_id}")
+                    hedge_messages = base_history if not full_response_text else messages # 对冲请求不带 session_id
+                    async for delta in cls._hedged_stream(api_key, current_model, messages, request_session_id, hedge_messages):
+                        if delta.get('hedged'):
+                            hedged = delta['hedged']
+                            continue
+                        delta_text = delta.get('text') # 获取增量文本
+                        current_session_id = delta.get('session_id') # 获取当前的session_id
+                        usage = delta.get('usage') or usage
+                        if current_session_id:
+                            returned_session_id = current_session_id # 更新session_id
+                        if delta_text:
+                            full_response_text += delta_text
+                            # 每次收到增量内容，通过 yield 返回，并标记 is_end 为 False
+                            yield {'text': delta_text, 'session_id': returned_session_id, 'is_end': False}
+                    break
+                except Exception as e:
+                    if isinstance(e, DashScopeAPIError) and request_session_id and full_history is not None and \
+                            not full_response_text and not session_fallback and is_session_error(e):
+                        logging.warning(f"服务端会话 {request_session_id} 已失效（{e.code}: {e.message}），改为发送完整历史。")
+                        session_fallback = True
+                        messages, request_session_id, returned_session_id = full_history, None, None
+                        continue
+                    if policy is None or not policy.is_retryable(e):
+                        raise
+                    if model_retries < policy.retries_for(e):
+                        model_retries += 1
+                    elif candidates.index(current_model) + 1 < len(candidates):
+                        current_model = candidates[candidates.index(current_model) + 1]
+                        model_retries = 0
+                        logging.warning(f"模型繁忙或多次失败，切换到备用模型 {current_model}")
+                    else:
+                        raise
+                    delay = policy.backoff(retries)
+                    retries += 1
+                    logging.warning(f"请求失败（{getattr(e, 'code', None) or type(e).__name__}），{delay:.2f} 秒后第 {retries} 次重试，"
+                                    f"模型 {current_model}，已输出 {len(full_response_text)} 个字符")
+                    await asyncio.sleep(delay)
+                    if full_response_text:
+                        # 已经输出了部分回答：不能让服务端从头生成，带上部分回答请模型接着写；这一轮不再使用服务端会话
+                        messages, request_session_id = build_resume_messages(base_history, full_response_text), None
+                        resumed = True
+                    elif current_model != model_name:
+                        messages, request_session_id = base_history, None # 备用模型没有主模型的服务端会话
+                    returned_session_id = request_session_id
+            failover_model = current_model if current_model != model_name else None
+            if failover_model or resumed:
+                # 这一轮回答不在原模型的服务端会话里，下一轮需要发送完整历史
+                returned_session_id = None
             # 流式传输结束，发送最终结果并标记 is_end 为 True
             logging.info(f"API stream finished. Final response text length: {len(full_response_text)}, session_id: {returned_session_id}")
-            yield {'text': '', 'session_id': returned_session_id, 'is_end': True} 
+            yield {'text': '', 'session_id': returned_session_id, 'is_end': True, 'session_fallback': session_fallback,
+                   'answer': full_response_text, 'usage': usage, 'retries': retries, 'failover_model': failover_model,
+                   'resumed': resumed, 'hedged': hedged}
+        except DashScopeAPIError as e:
+            logging.error(f"API流式响应错误: {e.to_user_message()}")
+            # 发生错误时，发送错误信息并标记为结束
+            yield {'text': e.to_user_message(), 'session_id': returned_session_id, 'is_end': True, 'error': True,
+                   'error_code': e.code, 'status_code': e.status_code, 'retries': retries}
         except Exception as e:
             logging.error(f"Error during streaming API request: {e}", exc_info=True)
-            yield {'text': f'请求出错，请稍后再试。错误信息：{e}', 'session_id': None, 'is_end': True, 'error': True}
\ No newline at end of file
+            yield {'text': f'请求出错，请稍后再试。错误信息：{e}', 'session_id': None, 'is_end': True, 'error': True,
+                   'retries': retries}
+    @classmethod
+    async def _hedged_stream(cls, api_key, model_name, messages, session_id, hedge_messages):
+        """产出后端的增量事件；开启对冲时，首个增量超过 hedge_after 仍未到达就用 hedge_messages 再发一个请求，
+        先出字的请求胜出，另一个立即取消。发生对冲时先产出 {'hedged': 'primary' 或 'hedge'}"""
+        backend = cls._get_backend()
+        hedge_after = cls.retry_policy.hedge_after if cls.retry_policy is not None else None
+        primary = backend.stream(api_key, model_name, messages, session_id)
+        started = [primary] # 出错或调用方提前关闭时都要逐个 aclose，释放底层响应与连接
+        streams, winner = {}, None
+        try:
+            if hedge_after is None:
+                async for delta in primary:
+                    yield delta
+                return
+            streams[asyncio.ensure_future(_read_until_text(primary))] = primary
+            try:
+                done, _ = await asyncio.wait(streams, timeout=hedge_after)
+                if done:
+                    winner = next(iter(done))
+                    buffered = winner.result() # 主请求出错时直接抛出，由上层按重试策略处理
+                else:
+                    logging.info(f"首个增量超过 {hedge_after * 1000:.0f} ms 仍未到达，发出对冲请求")
+                    hedge = backend.stream(api_key, model_name, hedge_messages, None)
+                    started.append(hedge)
+                    streams[asyncio.ensure_future(_read_until_text(hedge))] = hedge
+                    pending, error = set(streams), None
+                    while pending and winner is None:
+                        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                        for task in sorted(done, key=lambda t: streams[t] is not primary): # 同时完成时优先主请求
+                            if task.exception() is None:
+                                winner = task
+                                break
+                            error = error or task.exception()
+                    if winner is None:
+                        raise error
+                    buffered = winner.result()
+            finally:
+                # 落选的请求立即取消，不等胜出的请求输出完毕
+                for task, stream in streams.items():
+                    if task is not winner:
+                        task.cancel()
+                        await asyncio.gather(task, return_exceptions=True)
+                        await stream.aclose()
+            if len(started) > 1:
+                yield {'hedged': 'primary' if streams[winner] is primary else 'hedge'}
+            for delta in buffered:
+                yield delta
+            async for delta in streams[winner]:
+                yield delta
+        finally:
+            for task in streams:
+                if not task.done():
+                    task.cancel()
+                    await asyncio.gather(task, return_exceptions=True)
+            for stream in started:
+                await stream.aclose()
+    @classmethod
+    def process_api_request(cls, api_key, dialog_history, model_name, session_id=None, full_history=None):
+        """同步生成器接口：请求在共享事件循环中执行，调用方线程只负责取出事件；提前关闭生成器会取消请求"""
+        events = queue.Queue()
+        async def pump():
+            try:
+                async for event in cls.aprocess_api_request(api_key, dialog_history, model_name, session_id, full_history):
+                    events.put(event)
+            finally:
+                events.put(None)
+        future = cls.submit(pump())
+        try:
+            while True:
+                event = events.get()
+                if event is None:
+                    break
+                yield event
+        finally:
+            future.cancel()
@@ -0,0 +1,70 @@
+# event_loop.py
+import asyncio
+import logging
+import threading
+class EventLoopThread:
+    """在单个后台守护线程中运行的 asyncio 事件循环，所有网络请求都在这里执行"""
+    def __init__(self, name="asyncio-loop"):
+        self.name = name
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+    @property
+    def loop(self):
+        self._ensure_started()
+        return self._loop
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            ready = threading.Event()
+            def run():
+                self._loop = asyncio.new_event_loop()
+                asyncio.set_event_loop(self._loop)
+                ready.set()
+                try:
+                    self._loop.run_forever()
+                finally:
+                    self._loop.close()
+                    logging.info(f"事件循环线程 {self.name} 已退出。")
+            self._thread = threading.Thread(target=run, name=self.name, daemon=True)
+            self._thread.start()
+            ready.wait()
+    def submit(self, coro):
+        """在事件循环中调度协程，返回 concurrent.futures.Future，可在任意线程调用"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+    def call_soon(self, callback, *args):
+        self.loop.call_soon_threadsafe(callback, *args)
+    def stop(self, cleanup=None, timeout=3.0):
+        """停止事件循环：先取消未完成的任务，cleanup 为停止前在循环中执行的协程函数（例如关闭连接池）"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                return
+            loop, thread = self._loop, self._thread
+        async def finish():
+            # 取消仍在运行的任务（例如未完成的请求或预热），再执行清理
+            current = asyncio.current_task()
+            pending = [task for task in asyncio.all_tasks() if task is not current]
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            if cleanup is not None:
+                await cleanup()
+        try:
+            asyncio.run_coroutine_threadsafe(finish(), loop).result(timeout)
+        except Exception as e:
+            logging.warning(f"关闭事件循环前的清理失败: {e}")
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout)
+        with self._lock:
+            self._thread = None
+            self._loop = None
+_default_loop_thread = None
+_default_lock = threading.Lock()
+def get_event_loop_thread():
+    """进程内共享的事件循环线程"""
+    global _default_loop_thread
+    with _default_lock:
+        if _default_loop_thread is None:
+            _default_loop_thread = EventLoopThread()
+        return _default_loop_thread
@@ -1,21 +1,41 @@
 # gui.py
 import os
 import sys
-import threading
+import copy
 import json
 import logging
-from datetime import datetime
 import re
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from PySide6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
-    QTextBrowser, QTextEdit, QPushButton, QLabel, QLineEdit, QComboBox,
-    QDialog, QMessageBox, QSpacerItem, QSizePolicy, QListWidget, QListWidgetItem
+    QTextEdit, QPushButton, QLabel, QLineEdit, QComboBox,
+    QDialog, QMessageBox, QSpacerItem, QSizePolicy, QListView, QFileDialog,
+    QTableWidget, QTableWidgetItem, QHeaderView, QTabWidget, QToolButton
 )
 from PySide6.QtGui import QFont, QPixmap, QIcon, QTextCursor
-from PySide6.QtCore import Qt, Signal, Slot, QSize
+from PySide6.QtCore import Qt, Signal, Slot, QModelIndex, QTimer
 # 导入 controller
-from controller import Controller
+from controller import Controller, model_app_id_map, get_context_budget
+from session_store import SessionStore
+from stream_buffer import StreamFlushPolicy
+from history_model import HistoryListModel, HistorySearchModel, HistoryItemDelegate, format_history_title
+from response_cache import ResponseCache
+from search_index import SearchIndex
+from chat_tab import ChatTab
+from request_scheduler import RequestScheduler
+from retry_policy import RetryPolicy
+from compare_dialog import CompareDialog
+from markdown_render import render_markdown
+from context_manager import ContextWindow, load_tokenizer
+from telemetry import Telemetry, MetricsLog
+from persistence import PersistenceWorker, atomic_write, atomic_write_json
+from message_templates import MessageTemplates
+import startup_profile
 # --- 辅助函数，用于资源路径 ---
+@lru_cache(maxsize=None)
 def get_asset_path(asset_name):
     """获取资源文件的绝对路径，兼容打包和直接运行"""
     if getattr(sys, 'frozen', False):
@@ -23,6 +43,15 @@ def get_asset_path(asset_name):
     else:
         base_path = os.path.dirname(os.path.abspath(__file__))
     return os.path.join(base_path, 'assets', asset_name)
+@lru_cache(maxsize=None)
+def load_stylesheet(stylesheet_name):
+    """读取样式表文本并缓存，切换主题时不再读取磁盘；文件不存在时返回 None"""
+    stylesheet_path = get_asset_path(stylesheet_name)
+    if not os.path.exists(stylesheet_path):
+        logging.warning(f"样式表文件未找到: {stylesheet_path}")
+        return None
+    with open(stylesheet_path, 'r', encoding='utf-8') as f:
+        return f.read()
 def get_history_path(file_name=""):
     """获取历史记录文件的绝对路径"""
     if getattr(sys, 'frozen', False):
@@ -31,6 +60,22 @@ def get_history_path(file_name=""):
         base_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'history')
     os.makedirs(base_path, exist_ok=True)
     return os.path.join(base_path, file_name)
+def get_cache_path(file_name=""):
+    """获取回答缓存目录的绝对路径"""
+    if getattr(sys, 'frozen', False):
+        base_path = os.path.join(sys._MEIPASS, 'cache')
+    else:
+        base_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache')
+    os.makedirs(base_path, exist_ok=True)
+    return os.path.join(base_path, file_name)
+def get_metrics_path(file_name=""):
+    """获取请求指标目录的绝对路径"""
+    if getattr(sys, 'frozen', False):
+        base_path = os.path.join(sys._MEIPASS, 'metrics')
+    else:
+        base_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'metrics')
+    os.makedirs(base_path, exist_ok=True)
+    return os.path.join(base_path, file_name)
 # --- 设置窗口 ---
 class SettingsDialog(QDialog):
     settings_saved = Signal(str, str)
@@ -59,7 +104,7 @@ class SettingsDialog(QDialog):
         model_layout = QHBoxLayout()
         model_label = QLabel("选择模型：")
         self.model_combo = QComboBox()
-        self.models = ['deepseek-r1-distill-qwen-32b', 'deepseek-r1', 'qwen-plus', 'qwen-max']
+        self.models = list(model_app_id_map) # 包括配置文件 models 中追加的模型
         self.model_combo.addItems(self.models)
         if current_model in self.models:
             self.model_combo.setCurrentText(current_model)
@@ -91,33 +136,154 @@ class SettingsDialog(QDialog):
         self.accept()
     def get_settings(self):
         return self.api_entry.text().strip(), self.model_combo.currentText()
+# --- 性能统计窗口 ---
+class MetricsDialog(QDialog):
+    """按模型显示最近请求的滚动 p50/p95 延迟（不含缓存命中），打开期间每秒刷新"""
+    COLUMNS = [
+        ("模型", None), ("请求数", 'count'), ("错误数", 'errors'), ("重试", 'retried'), ("换用备用", 'failovers'),
+        ("首字 p50 (ms)", 'ttft_p50'), ("首字 p95 (ms)", 'ttft_p95'),
+        ("间隔 p50 (ms)", 'itl_p50'), ("间隔 p95 (ms)", 'itl_p95'),
+        ("tokens/s p50", 'tps_p50'), ("总耗时 p95 (ms)", 'duration_p95'),
+    ]
+    def __init__(self, telemetry_getter, parent=None, memory_getter=None):
+        super().__init__(parent)
+        self.setWindowTitle("性能统计")
+        self.resize(1000, 260)
+        self.telemetry_getter = telemetry_getter
+        self.memory_getter = memory_getter
+        layout = QVBoxLayout(self)
+        self.table = QTableWidget(0, len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels([title for title, _ in self.COLUMNS])
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.ResizeToContents)
+        self.table.horizontalHeader().setStretchLastSection(True)
+        self.table.verticalHeader().setVisible(False)
+        self.table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        layout.addWidget(self.table)
+        self.hint_label = QLabel()
+        self.hint_label.setFont(QFont("微软雅黑", 9))
+        layout.addWidget(self.hint_label)
+        self.memory_label = QLabel()
+        self.memory_label.setFont(QFont("微软雅黑", 9))
+        layout.addWidget(self.memory_label)
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setInterval(1000)
+        self.refresh_timer.timeout.connect(self.refresh)
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.refresh()
+        self.refresh_timer.start()
+    def hideEvent(self, event):
+        self.refresh_timer.stop()
+        super().hideEvent(event)
+    def refresh(self):
+        telemetry = self.telemetry_getter()
+        summary = telemetry.summary() if telemetry is not None else {}
+        self.table.setRowCount(len(summary))
+        for row, (model, stats) in enumerate(sorted(summary.items(), key=lambda item: str(item[0]))):
+            for column, (_, key) in enumerate(self.COLUMNS):
+                value = model if key is None else stats.get(key)
+                text = "-" if value is None else (f"{value:.1f}" if isinstance(value, float) else str(value))
+                self.table.setItem(row, column, QTableWidgetItem(text))
+        if telemetry is None:
+            self.hint_label.setText("未启用请求指标记录。")
+        else:
+            self.hint_label.setText(f"按模型统计最近 {telemetry.window} 次请求，明细见 {telemetry.metrics_log.path if telemetry.metrics_log else '（未写入文件）'}")
+        if self.memory_getter is not None:
+            usage = self.memory_getter()
+            self.memory_label.setText(
+                f"聊天视图：{usage.get('rendered_messages', 0)} 条消息 / {usage.get('document_chars', 0) / 1024:.0f} K 字符；"
+                f"内存中的对话历史：{usage.get('history_messages', 0)} 条 / {usage.get('history_chars', 0) / 1024:.0f} K 字符；"
+                f"已移出内存（仅保存在文件中）：{usage.get('evicted_messages', 0)} 条")
+def _tab_state(name):
+    """把 ChatGUI 上的会话状态属性转发到当前处理的标签页（见 ChatGUI.current_tab）"""
+    return property(lambda self: getattr(self.current_tab, name),
+                    lambda self, value: setattr(self.current_tab, name, value))
 class ChatGUI(QMainWindow):
+    # 以下会话状态属于各个标签页，默认指向当前显示的标签页，处理后台标签页的回调时指向该标签页
+    dialog_history = _tab_state('dialog_history')
+    _session_id = _tab_state('session_id')
+    current_history_file = _tab_state('current_history_file')
+    is_displaying_historical_chat = _tab_state('is_displaying_historical_chat')
+    current_assistant_response_text = _tab_state('current_assistant_response_text')
+    _saved_message_count = _tab_state('saved_message_count')
+    _evicted_message_count = _tab_state('evicted_message_count')
+    _pending_delta_savings = _tab_state('pending_delta_savings')
+    _active_request_id = _tab_state('active_request_id')
+    _active_request_future = _tab_state('active_request_future')
+    _stream_message_index = _tab_state('stream_message_index')
+    context_window = _tab_state('context_window')
+    stream_buffer = _tab_state('stream_buffer')
+    renderer = _tab_state('renderer')
+    history_pager = _tab_state('history_pager')
+    chat_history_view = _tab_state('view')
     update_chat_signal = Signal(str, str) # 用于更新聊天历史显示
     # 新增信号，用于实时更新助手的流式输出
     stream_new_text_signal = Signal(str, str) # role, text_delta
     # 新增信号，用于API请求完成后在主线程处理后续操作（包括流式结束）
     api_request_finished_signal = Signal(dict)
+    search_index_synced_signal = Signal() # 后台补建索引完成
+    history_search_finished_signal = Signal(int, object) # 搜索序号, 结果（跨线程投递到 GUI 线程）
+    startup_finished = Signal() # 窗口显示后的延迟初始化全部完成
+    tab_status_signal = Signal(int, bool) # tab_id, 请求是否正在排队
+    history_list_loaded_signal = Signal(list) # 后台扫描到的历史文件名
+    persistence_failed_signal = Signal(str) # 后台写入失败的提示
     def __init__(self):
         super().__init__()
         self.api_key = ""
         self.selected_model = ""
-        self.dialog_history = []
-        self._session_id = None
         self.is_dark_mode = False
-        self.current_history_file = None
-        self.is_displaying_historical_chat = False
-        self.current_assistant_response_text = "" # 用于累积流式输出的文本
+        self._tabs = {} # tab_id -> ChatTab
+        self._bound_tab = None # 正在处理回调的标签页，为 None 时使用当前显示的标签页
+        self.session_store = SessionStore(get_history_path())
+        # 历史记录与配置都由后台线程写入，GUI 线程不等待磁盘（网络盘上一次写入可能要几百毫秒）
+        self.persistence = PersistenceWorker(on_error=lambda key, e: self.persistence_failed_signal.emit(f"{key[0]}: {e}"))
+        self.search_index = SearchIndex(get_history_path('search_index.sqlite3'))
+        self._search_sync_stop = threading.Event()
+        self.stream_flush_policy = StreamFlushPolicy()
+        self.api_base_url = "" # 为空时使用 DashScope 官方地址，可指向本地替身服务器
+        self.backend_name = "dashscope"
+        self.custom_models = {} # 配置文件中追加或覆盖的模型: {模型名: {'app_id', 'context_budget'}}
+        self.context_token_budget = 0 # 大于 0 时覆盖各模型默认的上下文 token 预算
+        self.session_delta_mode = True # 已有服务端会话时只发送新一轮消息
+        self._delta_savings_total = [0, 0]
+        self.response_cache_config = {'enabled': True, 'memory_entries': 256, 'disk_mb': 50, 'ttl_hours': 168}
+        self.telemetry_config = {'enabled': True, 'max_mb': 5, 'backups': 3, 'window': 200}
+        self.scheduler_config = {'global_limit': 4, 'per_model_limit': 2, 'model_limits': {}}
+        self.retry_config = {'enabled': True, 'max_retries': 2, 'base_delay_ms': 500, 'max_delay_ms': 8000,
+                             'overload_retries': 1, 'hedge_after_ms': 0}
+        # 实时会话在视图中保留的消息条数与内存中保留的对话历史条数，超出约 1/4 时把较早的部分移出（0 表示不限制）
+        self.transcript_config = {'max_rendered_messages': 200, 'max_history_messages': 400}
+        self.metrics_dialog = None
+        self._search_sync_thread = None
+        # 消息模板与头像只准备一次，所有标签页共用
+        self.message_templates = MessageTemplates({'user': get_asset_path('user.ico'), 'assistant': get_asset_path('robot.ico')})
+        startup_profile.mark("窗口状态初始化")
         self._load_config()
+        startup_profile.mark("读取配置")
         self._init_ui()
+        startup_profile.mark("创建界面")
         self._load_stylesheet()
+        startup_profile.mark("加载样式表")
         self._connect_signals()
         self.initial_welcome_message = (
             "<b>我是一个科技金融小助手</b>，很高兴回答你的问题！<br>"
             "输入 <code>/reset</code> 可以清空对话历史并开始新的会话。<br>"
             "您可以在左侧的“历史记录”中查看和管理以往的对话。"
         )
-        self.add_message_to_history("assistant", self.initial_welcome_message, is_stream=False) # 初始欢迎消息非流式
+        self._new_tab() # 新标签页显示初始欢迎消息
+        self.showMaximized()
+        startup_profile.mark("显示窗口")
+        # 扫描历史目录、补建索引、预热网络库与分词器都放到窗口显示之后
+        QTimer.singleShot(0, self._deferred_startup)
+    def _deferred_startup(self):
         self._load_history_list()
+        startup_profile.mark("加载历史记录列表")
+        self._start_search_index_sync()
+        self._configure_telemetry()
+        Controller.warm_up()
+        threading.Thread(target=load_tokenizer, name="tokenizer-warm-up", daemon=True).start()
+        startup_profile.mark("启动后台预热")
+        self.startup_finished.emit()
     def _init_ui(self):
         self.setWindowTitle("科技金融小助手")
         try:
@@ -129,7 +295,6 @@ class ChatGUI(QMainWindow):
         except Exception as e:
             logging.warning(f"无法加载窗口图标: {e}")
         self.resize(1280, 720)
-        self.showMaximized()
         main_widget = QWidget()
         self.setCentralWidget(main_widget)
         self.main_h_layout = QHBoxLayout(main_widget)
@@ -146,19 +311,46 @@ class ChatGUI(QMainWindow):
         sidebar_label.setAlignment(Qt.AlignCenter)
         sidebar_label.setFont(QFont("微软雅黑", 11, QFont.Bold))
         self.sidebar_layout.addWidget(sidebar_label)
-        self.history_list_widget = QListWidget()
-        self.history_list_widget.setFont(QFont("微软雅黑", 10))
-        self.sidebar_layout.addWidget(self.history_list_widget)
+        self.history_search_edit = QLineEdit()
+        self.history_search_edit.setObjectName("history_search_edit")
+        self.history_search_edit.setPlaceholderText("搜索聊天记录…")
+        self.history_search_edit.setClearButtonEnabled(True)
+        self.history_search_edit.setFont(QFont("微软雅黑", 10))
+        self.sidebar_layout.addWidget(self.history_search_edit)
+        # 输入停顿后再检索，避免每个按键都查询一次
+        self.history_search_timer = QTimer(self)
+        self.history_search_timer.setSingleShot(True)
+        self.history_search_timer.setInterval(150)
+        self.history_search_model = HistorySearchModel(self)
+        self._history_search_generation = 0 # 每次输入变化时递增，丢弃过期的搜索结果
+        self._history_search_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history-search")
+        # 模型/视图结构：行由委托绘制，不再为每条记录创建控件
+        self.history_model = HistoryListModel(get_history_path(), self)
+        self.history_delegate = HistoryItemDelegate(get_asset_path('delete.png'), self)
+        self.history_list_view = QListView()
+        self.history_list_view.setFont(QFont("微软雅黑", 10))
+        self.history_list_view.setModel(self.history_model)
+        self.history_list_view.setItemDelegate(self.history_delegate)
+        self.history_list_view.setUniformItemSizes(True)
+        self.history_list_view.setMouseTracking(True)
+        self.sidebar_layout.addWidget(self.history_list_view)
         self.main_h_layout.addWidget(self.sidebar_widget)
         self.chat_area_widget = QWidget()
         self.chat_area_layout = QVBoxLayout(self.chat_area_widget)
         self.chat_area_layout.setContentsMargins(0, 0, 0, 0)
         self.chat_area_layout.setSpacing(10)
-        self.chat_history_view = QTextBrowser()
-        self.chat_history_view.setReadOnly(True)
-        self.chat_history_view.setFont(QFont("微软雅黑", 12))
-        self.chat_history_view.setOpenExternalLinks(True)
-        self.chat_area_layout.addWidget(self.chat_history_view, 1)
+        # 每个标签页是一个独立的会话，可以同时流式输出
+        self.chat_tabs = QTabWidget()
+        self.chat_tabs.setObjectName("chat_tabs")
+        self.chat_tabs.setDocumentMode(True)
+        self.chat_tabs.setTabsClosable(True)
+        self.chat_tabs.setMovable(True)
+        self.new_tab_button = QToolButton()
+        self.new_tab_button.setObjectName("new_tab_button")
+        self.new_tab_button.setText("＋")
+        self.new_tab_button.setToolTip("新建对话标签页")
+        self.chat_tabs.setCornerWidget(self.new_tab_button, Qt.TopRightCorner)
+        self.chat_area_layout.addWidget(self.chat_tabs, 1)
         input_frame = QWidget()
         input_layout = QHBoxLayout(input_frame)
         input_layout.setContentsMargins(0,0,0,0)
@@ -173,6 +365,12 @@ class ChatGUI(QMainWindow):
         self.send_button.setFont(QFont("微软雅黑", 11, QFont.Bold))
         self.send_button.setFixedHeight(self.user_input_edit.height())
         input_layout.addWidget(self.send_button)
+        self.stop_button = QPushButton("停止 ⏹")
+        self.stop_button.setObjectName("stop_button")
+        self.stop_button.setFont(QFont("微软雅黑", 11, QFont.Bold))
+        self.stop_button.setFixedHeight(self.user_input_edit.height())
+        self.stop_button.setEnabled(False)
+        input_layout.addWidget(self.stop_button)
         self.chat_area_layout.addWidget(input_frame)
         bottom_button_layout = QHBoxLayout()
         bottom_button_layout.addSpacerItem(QSpacerItem(40, 20, QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Minimum))
@@ -188,20 +386,51 @@ class ChatGUI(QMainWindow):
         self.clear_history_button.setObjectName("clear_history_button")
         self.clear_history_button.setFont(QFont("微软雅黑", 10))
         bottom_button_layout.addWidget(self.clear_history_button)
+        self.export_history_button = QPushButton("导出记录")
+        self.export_history_button.setObjectName("export_history_button")
+        self.export_history_button.setFont(QFont("微软雅黑", 10))
+        bottom_button_layout.addWidget(self.export_history_button)
+        self.metrics_button = QPushButton("📊 性能统计")
+        self.metrics_button.setObjectName("metrics_button")
+        self.metrics_button.setFont(QFont("微软雅黑", 10))
+        bottom_button_layout.addWidget(self.metrics_button)
+        self.compare_button = QPushButton("🔀 多模型对比")
+        self.compare_button.setObjectName("compare_button")
+        self.compare_button.setFont(QFont("微软雅黑", 10))
+        bottom_button_layout.addWidget(self.compare_button)
         self.chat_area_layout.addLayout(bottom_button_layout)
         self.main_h_layout.addWidget(self.chat_area_widget, 1)
+        self.delta_savings_label = QLabel()
+        self.delta_savings_label.setObjectName("delta_savings_label")
+        self.delta_savings_label.setFont(QFont("微软雅黑", 9))
+        self.statusBar().addPermanentWidget(self.delta_savings_label)
     def _connect_signals(self):
         self.send_button.clicked.connect(self.on_send_button_clicked)
+        self.stop_button.clicked.connect(self.stop_current_request)
         self.user_input_edit.keyPressEvent = self.input_key_press_event
         self.settings_button.clicked.connect(self.show_settings_dialog)
         self.clear_history_button.clicked.connect(lambda: self.handle_user_command("/reset"))
+        self.export_history_button.clicked.connect(self.export_current_history)
+        self.metrics_button.clicked.connect(self.show_metrics_dialog)
+        self.compare_button.clicked.connect(self.show_compare_dialog)
+        self.new_tab_button.clicked.connect(lambda: self._new_tab())
+        self.chat_tabs.tabCloseRequested.connect(self._close_tab)
+        self.chat_tabs.currentChanged.connect(self._on_current_tab_changed)
+        self.tab_status_signal.connect(self._on_tab_status)
         self.update_chat_signal.connect(self._update_chat_history_slot)
         self.dark_mode_button.clicked.connect(self.toggle_dark_mode)
-        self.history_list_widget.itemClicked.connect(self._on_history_item_clicked)
+        self.history_list_view.clicked.connect(self._on_history_item_clicked)
+        self.history_search_edit.textChanged.connect(self.history_search_timer.start)
+        self.history_search_timer.timeout.connect(self._run_history_search)
+        self.search_index_synced_signal.connect(self._run_history_search)
+        self.history_search_finished_signal.connect(self._on_history_search_finished)
+        self.history_delegate.delete_requested.connect(self._on_delete_history_item_clicked)
         # 连接流式输出的信号
         self.stream_new_text_signal.connect(self._append_stream_text_slot)
         # 连接API请求完成的信号到槽
         self.api_request_finished_signal.connect(self._on_api_request_finished)
+        self.history_list_loaded_signal.connect(self.history_model.set_filenames)
+        self.persistence_failed_signal.connect(self._on_persistence_failed)
     def _load_config(self):
         try:
             config_path = get_asset_path('config.json')
@@ -211,148 +440,126 @@ class ChatGUI(QMainWindow):
                     self.api_key = config.get('api_key', '')
                     self.selected_model = config.get('selected_model', '')
                     self.is_dark_mode = config.get('is_dark_mode', False)
+                    self.stream_flush_policy = StreamFlushPolicy.from_config(config)
+                    self.api_base_url = config.get('api_base_url', '')
+                    self.backend_name = config.get('backend', 'dashscope')
+                    self.custom_models = config.get('models', {})
+                    self.context_token_budget = int(config.get('context_token_budget', 0) or 0)
+                    self.session_delta_mode = bool(config.get('session_delta_mode', True))
+                    self.response_cache_config.update(config.get('response_cache', {}))
+                    self.telemetry_config.update(config.get('telemetry', {}))
+                    self.scheduler_config.update(config.get('scheduler', {}))
+                    self.retry_config.update(config.get('retry', {}))
+                    self.transcript_config.update(config.get('transcript', {}))
                     logging.info(f'成功读取配置文件，api_key: {"*"*5 if self.api_key else ""}, selected_model: {self.selected_model}, is_dark_mode: {self.is_dark_mode}')
             else:
                 logging.warning('未找到配置文件 config.json，将使用默认空值。')
         except Exception as e:
             logging.error(f'读取配置文件时出错: {e}')
+        Controller.configure(base_url=self.api_base_url or None, backend=self.backend_name, models=self.custom_models)
+        if self.response_cache_config.get('enabled'):
+            Controller.configure_cache(ResponseCache(
+                get_cache_path(),
+                memory_entries=int(self.response_cache_config['memory_entries']),
+                disk_max_bytes=int(float(self.response_cache_config['disk_mb']) * 1024 * 1024),
+                ttl_seconds=int(float(self.response_cache_config['ttl_hours']) * 3600),
+            ))
+        else:
+            Controller.configure_cache(None)
+        Controller.configure_scheduler(RequestScheduler(
+            global_limit=int(self.scheduler_config['global_limit']),
+            per_model_limit=int(self.scheduler_config['per_model_limit']),
+            model_limits=self.scheduler_config.get('model_limits'),
+        ))
+        if self.retry_config.get('enabled'):
+            Controller.configure_retry(RetryPolicy(
+                max_retries=int(self.retry_config['max_retries']),
+                base_delay_ms=float(self.retry_config['base_delay_ms']),
+                max_delay_ms=float(self.retry_config['max_delay_ms']),
+                overload_retries=int(self.retry_config['overload_retries']),
+                hedge_after_ms=float(self.retry_config['hedge_after_ms'] or 0),
+            ))
+        else:
+            Controller.configure_retry(None)
     def _save_config(self):
-        try:
-            config_path = get_asset_path('config.json')
-            os.makedirs(os.path.dirname(config_path), exist_ok=True)
-            with open(config_path, 'w', encoding='utf-8') as f:
-                json.dump({
-                    'api_key': self.api_key,
-                    'selected_model': self.selected_model,
-                    'is_dark_mode': self.is_dark_mode,
-                }, f, indent=4)
-            logging.info('配置已保存！')
-        except Exception as e:
-            logging.error(f'保存配置文件时出错: {e}')
-            QMessageBox.critical(self, "错误", f"保存配置失败: {e}")
+        """在 GUI 线程中生成配置快照，交给后台线程原子写入；连续多次保存只写最后一次"""
+        config = {
+            'api_key': self.api_key,
+            'selected_model': self.selected_model,
+            'is_dark_mode': self.is_dark_mode,
+            'stream_flush_hz': self.stream_flush_policy.flush_hz,
+            'stream_max_pending_chars': self.stream_flush_policy.max_pending_chars,
+            'api_base_url': self.api_base_url,
+            'backend': self.backend_name,
+            'models': self.custom_models,
+            'context_token_budget': self.context_token_budget,
+            'session_delta_mode': self.session_delta_mode,
+            'response_cache': self.response_cache_config,
+            'telemetry': self.telemetry_config,
+            'scheduler': self.scheduler_config,
+            'retry': self.retry_config,
+            'transcript': self.transcript_config,
+        }
+        self.persistence.submit(('config',), self._write_config, copy.deepcopy(config)) # 快照与之后的修改互不影响
+    @staticmethod
+    def _write_config(config):
+        atomic_write_json(get_asset_path('config.json'), config)
+        logging.info('配置已保存！')
+    @Slot(str)
+    def _on_persistence_failed(self, message):
+        self.statusBar().showMessage(f"保存失败: {message}", 10000)
     def _load_stylesheet(self):
         stylesheet_name = 'dark_mode.qss' if self.is_dark_mode else 'light_mode.qss'
-        stylesheet_path = get_asset_path(stylesheet_name)
         try:
-            if os.path.exists(stylesheet_path):
-                with open(stylesheet_path, 'r', encoding='utf-8') as f:
-                    self.setStyleSheet(f.read())
-                logging.info(f"成功加载样式表: {stylesheet_path}")
+            # 两套样式表都在第一次加载时读入缓存，之后切换主题不再读取文件
+            stylesheet = load_stylesheet(stylesheet_name)
+            load_stylesheet('light_mode.qss' if self.is_dark_mode else 'dark_mode.qss')
+            self.setStyleSheet(stylesheet or "")
+            if stylesheet is not None:
+                logging.info(f"成功加载样式表: {stylesheet_name}")
                 self.dark_mode_button.setText("☀️ 日间模式" if self.is_dark_mode else "🌙 黑夜模式")
-            else:
-                logging.warning(f"样式表文件未找到: {stylesheet_path}")
-                self.setStyleSheet("")
         except Exception as e:
             logging.error(f"加载样式表时出错: {e}")
             self.setStyleSheet("")
     def toggle_dark_mode(self):
+        """消息 HTML 与主题无关，颜色来自聊天视图的样式表与调色板：切换时只替换样式表，不重建任何标签页的文档，
+        耗时与对话长度无关"""
         self.is_dark_mode = not self.is_dark_mode
         self._load_stylesheet()
         self._save_config()
         logging.info(f"黑夜模式状态切换为: {self.is_dark_mode}")
-        if self.is_displaying_historical_chat and self.current_history_file:
-            self._display_historical_chat(self.current_history_file)
-        else:
-            self.refresh_chat_display()
-    def refresh_chat_display(self):
-        current_scroll_value = self.chat_history_view.verticalScrollBar().value()
-        self.chat_history_view.clear()
-        
-        # 复制一份当前的对话历史用于重建显示
-        temp_dialog_history_for_refresh = self.dialog_history[:]
-        self.dialog_history.clear() # 清空内存中的对话历史，将通过add_message_to_history重新填充
-        # 重新添加欢迎信息 (如果不是在显示历史记录模式)
-        self.add_message_to_history("assistant", self.initial_welcome_message, is_stream=False)
-        for msg in temp_dialog_history_for_refresh:
-            # 跳过已添加的欢迎信息
-            if msg['role'] == 'assistant' and msg['content'] == self.initial_welcome_message:
-                continue
-            
-            # add_message_to_history 会根据角色处理消息内容并添加到 self.dialog_history
-            self.add_message_to_history(msg['role'], msg['content'], is_stream=False) # 刷新时按非流式处理
-            
-        self.chat_history_view.verticalScrollBar().setValue(current_scroll_value)
     @Slot(str, str)
     def _update_chat_history_slot(self, role, message_html_content):
         # 此槽用于添加完整消息（例如用户消息、欢迎消息或完整的历史消息）
-        self.chat_history_view.append(message_html_content)
-        self.chat_history_view.verticalScrollBar().setValue(self.chat_history_view.verticalScrollBar().maximum())
+        self.renderer.append_message(message_html_content)
     @Slot(str, str)
     def _append_stream_text_slot(self, role, text_delta):
-        # 此槽用于处理流式输出的增量文本
-        # 移动光标到文档末尾，以便在正确位置插入文本
-        cursor = self.chat_history_view.textCursor()
-        cursor.movePosition(QTextCursor.End)
-        self.chat_history_view.setTextCursor(cursor)
-        
-        # 插入新的文本（Plain text, not HTML yet）
-        self.chat_history_view.insertPlainText(text_delta)
-        
-        # 实时滚动到最底部
-        self.chat_history_view.verticalScrollBar().setValue(self.chat_history_view.verticalScrollBar().maximum())
+        # 此槽用于处理流式输出的增量文本，按 Markdown 增量渲染到正在输出的助手消息块末尾
+        self.renderer.append_markdown(self._stream_message_index, text_delta)
+    def _format_message_html(self, role, message_content):
+        """生成单条完整消息在聊天视图中的 HTML"""
+        return self.message_templates.format_message(role, message_content)
     def add_message_to_history(self, role, message_content, is_stream=False):
-        user_avatar_path = get_asset_path('user.ico')
-        robot_avatar_path = get_asset_path('robot.ico')
-        avatar_html = ""
-        message_box_class = "user-message-box" if role == 'user' else "assistant-message-box"
-        message_container_style = "display: flex; align-items: flex-start; margin-bottom: 10px;"
-        avatar_style = "width: 35px; height: 35px; border-radius: 100%; margin-right: 8px; vertical-align: top;"
         if role == 'user':
-            actual_html_content_for_display = f'<p>{message_content}</p>' # 用于显示
-            if os.path.exists(user_avatar_path):
-                avatar_html = f'<img src="file:///{user_avatar_path.replace(os.sep, "/")}" style="{avatar_style}">'
-            
             # 用户消息直接添加到内存历史
             if not self.is_displaying_historical_chat:
                 self.dialog_history.append({'role': role, 'content': message_content})
-            formatted_message = f"""
-            <div class="message-container" style="{message_container_style}">
-                {avatar_html}
-                <div class="{message_box_class}">
-                    {actual_html_content_for_display}
-                </div>
-            </div>
-            """
-            self.update_chat_signal.emit(role, formatted_message)
+            self.update_chat_signal.emit(role, self._format_message_html(role, message_content))
             self.current_assistant_response_text = "" # 重置助手当前累积的文本
         else: # assistant
             if is_stream:
                 # 对于流式助手的第一个消息，先显示框架和头像
                 if not self.current_assistant_response_text: # 首次接收流式内容时
-                    # 在文本浏览器中插入一个特殊标记，后续增量文本将插入到这个标记之前
-                    formatted_message_start = f"""
-                    <div id="assistant_stream_message" class="message-container" style="{message_container_style}">
-                        {f'<img src="file:///{robot_avatar_path.replace(os.sep, "/")}" style="{avatar_style}">' if os.path.exists(robot_avatar_path) else ''}
-                        <div class="{message_box_class}">
-                            <p id="stream_content"></p>
-                        </div>
-                    </div>
-                    """
-                    self.update_chat_signal.emit(role, formatted_message_start)
-                    # 移动光标到 <p id="stream_content"></p> 标签内部
-                    cursor = self.chat_history_view.textCursor()
-                    cursor.movePosition(QTextCursor.End)
-                # 重构 add_message_to_history 以适应流式输出
+                    self.update_chat_signal.emit(role, self.message_templates.stream_placeholder)
+                    # 后续增量文本插入到这条消息的末尾
+                    self._stream_message_index = len(self.renderer) - 1
                 self.stream_new_text_signal.emit(role, message_content) # 这里的 message_content 是 delta_text
             else: # 非流式助手消息（如欢迎语、错误信息或历史记录加载）
-                # 助手消息，actual_html_content_for_display 和 message_content 都是传入的 content
-                actual_html_content_for_display = message_content
-                if not message_content.strip().startswith('<'): # 如果助手消息不是HTML（例如纯文本错误）
-                     actual_html_content_for_display = f'<p>{message_content}</p>'
-                if os.path.exists(robot_avatar_path):
-                    avatar_html = f'<img src="file:///{robot_avatar_path.replace(os.sep, "/")}" style="{avatar_style}">'
-                
-                formatted_message = f"""
-                <div class="message-container" style="{message_container_style}">
-                    {avatar_html}
-                    <div class="{message_box_class}">
-                        {actual_html_content_for_display}
-                    </div>
-                </div>
-                """
-                self.update_chat_signal.emit(role, formatted_message)
+                self.update_chat_signal.emit(role, self._format_message_html(role, message_content))
                 # 避免重复添加欢迎语到内存历史
                 is_initial_welcome = (role == 'assistant' and message_content == self.initial_welcome_message)
+                if is_initial_welcome:
+                    self.renderer.mark_note(len(self.renderer) - 1) # 欢迎语不写入会话文件
                 is_already_first_welcome = (len(self.dialog_history) > 0 and
                                           self.dialog_history[0]['role'] == 'assistant' and
                                           self.dialog_history[0]['content'] == self.initial_welcome_message)
@@ -371,22 +578,27 @@ class ChatGUI(QMainWindow):
                 return
         QTextEdit.keyPressEvent(self.user_input_edit, event)
     def handle_user_command(self, text):
+        # 新消息、/reset 或切换会话前，先停止仍在进行的生成
+        self.stop_current_request()
         if self.is_displaying_historical_chat:
             self._start_new_current_session()
         if text.lower() == '/reset':
             self._save_current_history()
             self.dialog_history.clear()
+            self._saved_message_count = 0
+            self._evicted_message_count = 0
             self._session_id = None
             self.current_history_file = None
-            self.chat_history_view.clear()
+            self.history_pager.close()
+            self.renderer.clear()
             self.add_message_to_history('assistant', self.initial_welcome_message, is_stream=False)
-            self._load_history_list()
+            self._refresh_tab_title(self.current_tab)
             return
         if not self.current_history_file and not self.dialog_history:
             # 如果是新会话，且当前没有历史记录，创建一个新的历史文件
-            timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-            clean_timestamp = re.sub(r'[^\w\-_\. ]', '_', timestamp)
-            self.current_history_file = f"chat_{clean_timestamp}.html"
+            self.current_history_file = self._new_history_filename()
+            self._saved_message_count = 0
+            self._evicted_message_count = 0
             logging.info(f"新会话开始，历史文件: {self.current_history_file}")
         # 用户消息立即显示并加入到 dialog_history
         self.add_message_to_history('user', text, is_stream=False)
@@ -400,90 +612,272 @@ class ChatGUI(QMainWindow):
         # 助手回复的“容器”需要在流式开始前创建
         self.current_assistant_response_text = "" # 重置累积文本
         # 显示一个空的助手消息容器作为流式输出的起点
-        robot_avatar_path = get_asset_path('robot.ico')
-        avatar_html = f'<img src="file:///{robot_avatar_path.replace(os.sep, "/")}" style="width: 35px; height: 35px; border-radius: 100%; margin-right: 8px; vertical-align: top;">' if os.path.exists(robot_avatar_path) else ''
-        initial_assistant_html = f"""
-        <div class="message-container" style="display: flex; align-items: flex-start; margin-bottom: 10px;">
-            {avatar_html}
-            <div class="assistant-message-box">
-                <p style="margin:0; padding:0; display:inline;" id="streaming_output_placeholder"></p>
-            </div>
-        </div>
-        """
-        self.update_chat_signal.emit("assistant", initial_assistant_html) # 发送 HTML 容器
-        threading.Thread(target=self._process_api_request_thread, daemon=True).start()
-    def _process_api_request_thread(self):
-        """在后台线程中处理API请求，完成后通过信号通知主线程。"""
-        # 构建发送给API的messages列表
-        # self.dialog_history 在这里是只读的，是安全的
+        self.update_chat_signal.emit("assistant", self.message_templates.stream_placeholder) # 发送 HTML 容器
+        self._stream_message_index = len(self.renderer) - 1 # 记录该容器的序号，结束时只替换这一条消息
+        self.stream_buffer.start()
+        # 构建发送给API的messages列表（在主线程中复制一份，请求协程只读取这份副本）
         api_messages_for_request = [
             msg for msg in self.dialog_history
             if not (msg['role'] == 'assistant' and msg['content'] == self.initial_welcome_message)
         ]
+        # 按模型的 token 预算裁剪较早的轮次（token 数按消息增量统计，不会每轮重算）
+        api_messages_for_request = self.context_window.fit(
+            api_messages_for_request, self.selected_model, self.context_token_budget or None)
+        self._active_request_id += 1
         if not api_messages_for_request:
             logging.warning("API messages for request is empty after filtering. Cannot send request.")
-            self.api_request_finished_signal.emit({'error': "没有有效的消息发送给API。", 'session_id': None, 'final_answer': ''})
+            self.api_request_finished_signal.emit({'error': "没有有效的消息发送给API。", 'session_id': None, 'final_answer': '',
+                                                   'request_id': self._active_request_id})
+            return
+        request_messages, fallback_messages = api_messages_for_request, None
+        self._pending_delta_savings = None
+        if self.session_delta_mode and self._session_id and api_messages_for_request[-1]['role'] == 'user':
+            # 服务端会话已保存之前的上下文，只发送新的用户消息；会话失效时由 Controller 回退为完整历史
+            request_messages, fallback_messages = api_messages_for_request[-1:], api_messages_for_request
+            self._pending_delta_savings = self._estimate_delta_savings(api_messages_for_request, request_messages)
+        # 请求在共享的事件循环线程中执行，不再为每条消息创建新线程；各标签页的请求由调度器限制并发
+        tab = self.current_tab
+        self._active_request_future = Controller.submit(self._process_api_request_async(
+            tab, self._active_request_id, self.api_key, self.selected_model, request_messages, self._session_id, fallback_messages))
+        self._refresh_tab_title(tab)
+    def _estimate_delta_savings(self, full_messages, delta_messages):
+        def payload_size(messages):
+            return len(json.dumps(messages, ensure_ascii=False).encode('utf-8'))
+        saved_bytes = payload_size(full_messages) - payload_size(delta_messages)
+        saved_tokens = self.context_window.last_stats.get('sent_tokens', 0) - \
+            sum(self.context_window.counter.count_message(m) for m in delta_messages)
+        return saved_bytes, max(saved_tokens, 0)
+    def _update_delta_savings(self, session_fallback):
+        if self._pending_delta_savings is None:
             return
+        if session_fallback:
+            self.delta_savings_label.setText("增量发送：服务端会话已失效，本次已回退为发送完整历史")
+        else:
+            saved_bytes, saved_tokens = self._pending_delta_savings
+            self._delta_savings_total[0] += saved_bytes
+            self._delta_savings_total[1] += saved_tokens
+            self.delta_savings_label.setText(
+                f"增量发送：本次节省 {saved_bytes / 1024:.1f} KB / {saved_tokens} tokens，"
+                f"累计 {self._delta_savings_total[0] / 1024:.1f} KB / {self._delta_savings_total[1]} tokens")
+            logging.info(f"增量发送节省 {saved_bytes} 字节 / {saved_tokens} tokens")
+        self._pending_delta_savings = None
+    async def _process_api_request_async(self, tab, request_id, api_key, model_name, api_messages_for_request, session_id,
+                                         full_history=None):
+        """在事件循环线程中处理 tab 的API请求，完成后通过信号通知主线程。被取消时协程直接结束，不再发信号。
+        这里只读写 tab 本身，不使用 ChatGUI 上随当前标签页变化的会话属性。"""
+        answer_text = ""
         try:
-            # Controller.process_api_request 现在是一个生成器
-            for response_data in Controller.process_api_request(
-                self.api_key, api_messages_for_request, self.selected_model, self._session_id
+            # Controller.aprocess_api_request 是一个异步生成器
+            async for response_data in Controller.aprocess_api_request(
+                api_key, api_messages_for_request, model_name, session_id, full_history, owner=tab.tab_id
             ):
                 text_delta = response_data.get('text', '')
-                new_session_id = response_data.get('session_id')
                 is_end = response_data.get('is_end', False)
                 error_occurred = response_data.get('error', False)
-                if new_session_id:
-                    self._session_id = new_session_id
+                if response_data.get('session_id'):
+                    session_id = response_data['session_id']
+                if request_id != tab.active_request_id:
+                    return # 请求已被新的操作取代，丢弃后续输出
+                if response_data.get('queued') is not None:
+                    self.tab_status_signal.emit(tab.tab_id, True)
+                    continue
+                if tab.is_queued:
+                    self.tab_status_signal.emit(tab.tab_id, False)
                 if error_occurred:
-                    self.api_request_finished_signal.emit({'error': text_delta, 'session_id': self._session_id, 'final_answer': ''})
+                    self.api_request_finished_signal.emit({'error': text_delta, 'session_id': session_id, 'final_answer': '',
+                                                           'request_id': request_id, 'tab_id': tab.tab_id})
                     return # 发生错误，终止流并返回
-                
-                # 更新累积文本
-                self.current_assistant_response_text += text_delta
-                # 发射信号更新UI，如果不是结束标志，并且有增量文本
+                answer_text += text_delta
+                # 写入流式缓冲，由 GUI 线程按帧率合并刷新，而不是每个增量发一次信号
                 if not is_end and text_delta:
-                    self.stream_new_text_signal.emit("assistant", text_delta)
+                    tab.stream_buffer.push(text_delta)
                 elif is_end:
                     # 流式结束，发送最终信号，包含完整的答案
                     self.api_request_finished_signal.emit({
-                        'answer': self.current_assistant_response_text, 
-                        'session_id': self._session_id, 
-                        'is_end': True
+                        'answer': answer_text,
+                        'session_id': session_id,
+                        'is_end': True,
+                        'request_id': request_id,
+                        'tab_id': tab.tab_id,
+                        'session_fallback': response_data.get('session_fallback', False),
+                        'cached': response_data.get('cached'),
+                        'failover_model': response_data.get('failover_model'),
+                        'resumed': response_data.get('resumed', False),
                     })
                     break # 结束循环
         except Exception as e:
             logging.error(f"处理API请求流时发生错误: {e}", exc_info=True)
-            self.api_request_finished_signal.emit({'error': f"请求出错，请稍后再试。错误详情：{str(e)}", 'session_id': self._session_id, 'final_answer': ''})
+            self.api_request_finished_signal.emit({'error': f"请求出错，请稍后再试。错误详情：{str(e)}", 'session_id': session_id,
+                                                   'final_answer': '', 'request_id': request_id, 'tab_id': tab.tab_id})
+    def _on_stream_flush(self, tab, text):
+        """流式缓冲刷新回调（主线程）：累积已显示的文本并插入到 tab 的视图"""
+        with self._bind_tab(tab):
+            self.current_assistant_response_text += text
+            self._append_stream_text_slot("assistant", text)
+    def is_request_active(self):
+        return self._active_request_future is not None
+    @property
+    def current_tab(self):
+        if self._bound_tab is not None:
+            return self._bound_tab
+        return self._tabs[self.chat_tabs.currentWidget().property('tab_id')]
+    @contextmanager
+    def _bind_tab(self, tab):
+        """在 with 块内让会话状态属性指向 tab（用于处理非当前标签页的回调）"""
+        previous, self._bound_tab = self._bound_tab, tab
+        try:
+            yield tab
+        finally:
+            self._bound_tab = previous
+    def _new_tab(self, activate=True):
+        tab = ChatTab(self.session_store, self._format_message_html, self.stream_flush_policy, self._on_stream_flush, self,
+                      wait_for_writes=self._wait_for_history_write, register_resources=self.message_templates.register)
+        tab.view.setProperty('tab_id', tab.tab_id)
+        self._tabs[tab.tab_id] = tab
+        self.chat_tabs.addTab(tab.view, tab.title)
+        with self._bind_tab(tab):
+            self.add_message_to_history("assistant", self.initial_welcome_message, is_stream=False) # 初始欢迎消息非流式
+        if activate:
+            self.chat_tabs.setCurrentWidget(tab.view)
+        logging.info(f"新建对话标签页: {tab.tab_id}")
+        return tab
+    def _close_tab(self, index):
+        tab = self._tabs[self.chat_tabs.widget(index).property('tab_id')]
+        with self._bind_tab(tab):
+            self.stop_current_request()
+            if not self.is_displaying_historical_chat:
+                self._save_current_history()
+        if len(self._tabs) == 1:
+            # 至少保留一个标签页：关闭最后一个时换成新的空白会话
+            self._new_tab()
+        self.chat_tabs.removeTab(self.chat_tabs.indexOf(tab.view))
+        del self._tabs[tab.tab_id]
+        tab.dispose()
+        tab.deleteLater()
+    def _tab_for_file(self, filename):
+        return next((tab for tab in self._tabs.values() if tab.current_history_file == filename), None)
+    def _new_history_filename(self):
+        taken = {tab.current_history_file for tab in self._tabs.values() if tab.current_history_file}
+        return self.session_store.new_session_filename(taken)
+    def _refresh_tab_title(self, tab):
+        """标签页标题：会话的第一条用户消息（或历史记录时间），生成中显示 ●，排队中显示 ⏳"""
+        first_user_message = next((m['content'] for m in tab.dialog_history if m['role'] == 'user'), None)
+        if tab.evicted_message_count and tab.title:
+            title = tab.title # 第一条用户消息已移出内存，沿用之前的标题
+        elif first_user_message:
+            title = first_user_message.replace('\n', ' ')
+            title = title[:12] + '…' if len(title) > 12 else title
+        elif tab.current_history_file:
+            title = format_history_title(tab.current_history_file)
+        else:
+            title = "新对话"
+        tab.title = title
+        if tab.is_queued:
+            title = '⏳ ' + title
+        elif tab.is_busy:
+            title = '● ' + title
+        index = self.chat_tabs.indexOf(tab.view)
+        if index >= 0:
+            self.chat_tabs.setTabText(index, title)
+            self.chat_tabs.setTabToolTip(index, tab.title)
+        self._update_stop_button()
+    def _update_stop_button(self):
+        if self._tabs and self.chat_tabs.currentWidget() is not None:
+            self.stop_button.setEnabled(self._tabs[self.chat_tabs.currentWidget().property('tab_id')].is_busy)
+    @Slot(int)
+    def _on_current_tab_changed(self, index):
+        self._update_stop_button()
+    @Slot(int, bool)
+    def _on_tab_status(self, tab_id, queued):
+        tab = self._tabs.get(tab_id)
+        if tab is None or not tab.is_busy:
+            return
+        tab.is_queued = queued
+        self._refresh_tab_title(tab)
+    def stop_current_request(self):
+        """停止正在进行的生成：取消请求并释放连接，已输出的部分回答保留在对话历史中"""
+        if self._active_request_future is None:
+            return False
+        self._active_request_future.cancel() # 取消事件循环中的任务，底层连接随之关闭
+        self._active_request_future = None
+        self._active_request_id += 1 # 之后到达的信号都会被忽略
+        # 被取消的这一轮不一定已写入服务端会话，下一次请求重新发送完整历史以保持上下文一致
+        self._session_id = None
+        self._pending_delta_savings = None
+        self.stream_buffer.stop() # 把已到达的增量文本刷新出去，保证保留的内容与显示一致
+        partial_answer = self.current_assistant_response_text
+        if partial_answer:
+            self.dialog_history.append({'role': 'assistant', 'content': partial_answer})
+            display_html = self._format_message_html('assistant', render_markdown(partial_answer) + '<p><i>（已停止生成）</i></p>')
+        else:
+            display_html = self._format_message_html('assistant', '<i>（已停止生成）</i>')
+            self.renderer.mark_note(self._stream_message_index) # 没有写入对话历史的停止提示
+        self.renderer.replace_message(self._stream_message_index, display_html)
+        logging.info(f"已停止生成，保留的部分回答长度: {len(partial_answer)}")
+        self.current_assistant_response_text = ""
+        self._stream_message_index = None
+        self.current_tab.is_queued = False
+        self._refresh_tab_title(self.current_tab)
+        self._save_current_history()
+        return True
     @Slot(dict)
     def _on_api_request_finished(self, result_package):
-        """在主线程中处理API请求完成后的操作（包括流式结束时）。"""
+        """在主线程中处理API请求完成后的操作（包括流式结束时），作用于发起请求的标签页。"""
+        tab = self._tabs.get(result_package.get('tab_id'), self.current_tab)
+        with self._bind_tab(tab):
+            self._finish_api_request(tab, result_package)
+    def _finish_api_request(self, tab, result_package):
+        if result_package.get('request_id') != self._active_request_id:
+            logging.info("忽略已取消请求的完成信号。")
+            return
         answer = result_package.get('answer')
         new_session_id = result_package.get('session_id')
         error_message = result_package.get('error')
-        
+        self._active_request_future = None
+        tab.is_queued = False
+        self._refresh_tab_title(tab)
         if new_session_id:
             self._session_id = new_session_id
-        # 找到最近添加的助手消息块并更新其内容
-        cursor = self.chat_history_view.textCursor()
-        cursor.movePosition(QTextCursor.End)
+        self.stream_buffer.stop() # 先把缓冲中剩余的增量文本刷新出去
         if error_message:
-            # 如果有错误，直接显示错误信息
-            self.add_message_to_history('assistant', error_message, is_stream=False)
-            self.current_assistant_response_text = "" # 清空累积文本
+            # 如果有错误，用错误信息替换流式输出的消息块
+            self.renderer.replace_message(self._stream_message_index, self._format_message_html('assistant', error_message))
+            self.dialog_history.append({'role': 'assistant', 'content': error_message})
+        elif answer and result_package.get('cached'):
+            # 缓存的回答没有经过服务端会话，下一轮需发送完整历史以保持上下文
+            self._session_id = None
+            self._pending_delta_savings = None
+            self.dialog_history.append({'role': 'assistant', 'content': answer})
+            self._finish_stream_message(answer)
+            stats = Controller.cache_stats() or {}
+            self.statusBar().showMessage(
+                f"回答来自本地缓存（{result_package['cached']}），缓存命中率 {stats.get('hit_rate', 0):.0%}", 5000)
         elif answer:
+            if result_package.get('failover_model') or result_package.get('resumed'):
+                # 这一轮不在原模型的服务端会话中，下一轮发送完整历史
+                self._session_id = None
+                self._pending_delta_savings = None
+                if result_package.get('failover_model'):
+                    self.statusBar().showMessage(f"{self.selected_model} 繁忙，本次回答由备用模型 {result_package['failover_model']} 生成", 8000)
+                else:
+                    self.statusBar().showMessage("回答中途连接中断，已重新连接并接着输出", 8000)
+            self._update_delta_savings(result_package.get('session_fallback', False))
             # 流式结束，将最终的完整答案添加到dialog_history
-            if self.current_assistant_response_text: # 确保有累积的文本
-                self.dialog_history.append({'role': 'assistant', 'content': self.current_assistant_response_text})
-                logging.info(f"完整的助手回复已添加到历史：{self.current_assistant_response_text[:50]}...")
-            self.current_assistant_response_text = "" # 清空累积文本
+            self.dialog_history.append({'role': 'assistant', 'content': answer})
+            logging.info(f"完整的助手回复已添加到历史：{answer[:50]}...")
+            self._finish_stream_message(answer)
         else:
             logging.info("API请求完成，但未收到有效回复或错误信息。")
-            self.current_assistant_response_text = "" # 清空累积文本
+            self.renderer.mark_note(self._stream_message_index) # 保留的空消息块没有对应的会话记录
+        self.current_assistant_response_text = "" # 清空累积文本
+        self._stream_message_index = None
         # 每次API请求（无论流式还是非流式）结束后，保存当前会话并刷新历史列表
         self._save_current_history()
-        self._load_history_list() # 刷新侧边栏
-        self.refresh_chat_display() # 重新刷新聊天显示，将累积的流式文本固化为HTML格式
+        self._compact_transcript()
+    def _finish_stream_message(self, answer):
+        """流式结束：已显示的内容就是完整回答时只渲染末尾的块，否则只把这一条消息替换为最终格式化的 HTML"""
+        if self.renderer.finish_markdown(self._stream_message_index) != answer:
+            self.renderer.replace_message(self._stream_message_index, self._format_message_html('assistant', answer))
     def show_settings_dialog(self):
         dialog = SettingsDialog(self, self.api_key, self.selected_model)
         dialog.settings_saved.connect(self.handle_settings_saved)
@@ -549,7 +943,7 @@ class ChatGUI(QMainWindow):
                      content = f'<p>{content}</p>'
             else:
                 if not content.strip().startswith('<'):
-                     content = f'<p>{content}</p>'
+                     content = render_markdown(content)
             html_content += f"""
             <div class="message-container">
                 <img src="file:///{avatar_src}" class="avatar">
@@ -561,6 +955,7 @@ class ChatGUI(QMainWindow):
         html_content += "</body></html>"
         return html_content
     def _save_current_history(self):
+        """将当前会话中尚未保存的消息追加写入历史文件，已保存的部分不再重写"""
         # 从 self.dialog_history 中排除初始欢迎信息
         history_to_save = [
             msg for msg in self.dialog_history
@@ -568,143 +963,295 @@ class ChatGUI(QMainWindow):
         ]
         if not history_to_save:
             logging.info("当前会话为空或只有欢迎语，不保存历史记录。")
-            if self.current_history_file:
-                file_path_to_check = get_history_path(self.current_history_file)
-                if os.path.exists(file_path_to_check):
-                    pass # 决定不主动删除，避免误删用户手动创建的空文件
             return
-        if not self.current_history_file:
-            timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-            clean_timestamp = re.sub(r'[^\w\-_\. ]', '_', timestamp)
-            self.current_history_file = f"chat_{clean_timestamp}.html"
+        if not self.current_history_file or not SessionStore.is_session_file(self.current_history_file):
+            self.current_history_file = self._new_history_filename()
+            self._saved_message_count = 0
+            self._evicted_message_count = 0
             logging.info(f"为当前活动会话创建历史文件: {self.current_history_file}")
-        file_path = get_history_path(self.current_history_file)
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
-        
-        html_output = self._get_html_for_history(history_to_save, 'dark' if self.is_dark_mode else 'light')
+        new_messages = history_to_save[self._saved_message_count:]
+        if not new_messages:
+            return
+        # 追加写入与更新索引在后台线程执行；同一会话尚未写入的追加合并为一次
+        self.persistence.submit(('history', self.current_history_file), self._append_history,
+                                (self.current_history_file, list(new_messages), self._evicted_message_count + self._saved_message_count),
+                                merge=lambda old, new: (old[0], old[1] + new[1], old[2]))
+        self._saved_message_count = len(history_to_save)
+        self.history_model.add_session(self.current_history_file) # 新会话原地插入侧边栏，已存在时不做任何事
+    def _compact_transcript(self):
+        """控制长会话的内存：视图中的消息超出上限约 1/4 时移除较早的消息块，之后向上滚动时由 history_pager 从会话文件读回；
+        内存中的对话历史同样只保留最近的部分（已写入会话文件，发送时较早的轮次本来也会按 token 预算裁剪）。
+        只移除已保存的消息，并且只在视图停在底部时进行，不打断用户正在查看的内容"""
+        max_rendered = int(self.transcript_config.get('max_rendered_messages') or 0)
+        if max_rendered <= 0 or self.is_displaying_historical_chat or self.current_tab.is_busy or not self.current_history_file:
+            return
+        history_to_save = [
+            msg for msg in self.dialog_history
+            if not (msg['role'] == 'assistant' and msg['content'] == self.initial_welcome_message)
+        ]
+        scroll_bar = self.chat_history_view.verticalScrollBar()
+        if self._saved_message_count != len(history_to_save) or scroll_bar.maximum() - scroll_bar.value() > scroll_bar.pageStep():
+            return # 用户正在向上翻看较早的内容
+        tab = self.current_tab
+        rendered_before, history_before = len(self.renderer), len(self.dialog_history)
+        if len(self.renderer) > max_rendered * 5 // 4:
+            self.renderer.remove_first(len(self.renderer) - max_rendered)
+            # 留在视图中的是会话文件末尾的这些记录（欢迎语、停止提示等不计入），之后保存的消息也显示在它们后面；
+            # 较早的部分由 history_pager 按需读回
+            first_displayed = self._evicted_message_count + self._saved_message_count - self.renderer.record_count()
+            self.history_pager.follow(
+                self.current_history_file,
+                lambda: tab.evicted_message_count + tab.saved_message_count - first_displayed,
+                header_html=self._format_message_html('assistant', self.initial_welcome_message))
+        max_history = max(int(self.transcript_config.get('max_history_messages') or 0), max_rendered)
+        if len(history_to_save) > max_history * 5 // 4:
+            drop = len(history_to_save) - max_history
+            self.dialog_history[:] = history_to_save[drop:]
+            self._evicted_message_count += drop
+            self._saved_message_count -= drop
+        if (rendered_before, history_before) != (len(self.renderer), len(self.dialog_history)):
+            logging.info(f"标签页 {tab.tab_id} 已移出较早的消息：视图 {rendered_before} -> {len(self.renderer)} 条，"
+                         f"对话历史 {history_before} -> {len(self.dialog_history)} 条，共 {self._evicted_message_count} 条只保存在文件中")
+    def _append_history(self, payload):
+        """在写入线程中执行：把新消息追加到会话文件并更新全文索引"""
+        filename, new_messages, start_position = payload
+        self.session_store.append(filename, new_messages)
+        logging.info(f"已追加 {len(new_messages)} 条消息到: {filename}")
         try:
-            with open(file_path, 'w', encoding='utf-8') as f:
-                f.write(html_output)
-            logging.info(f"对话历史已保存到: {file_path}")
+            file_size = os.path.getsize(get_history_path(filename))
+            self.search_index.add_messages(filename, new_messages, start_position, file_size)
         except Exception as e:
-            logging.error(f"保存对话历史到文件失败: {file_path}, 错误: {e}")
+            logging.warning(f"更新聊天记录索引失败: {e}")
+    def _wait_for_history_write(self, filename, timeout=5.0):
+        """读取、导出或删除会话文件前等待它尚未完成的后台写入"""
+        if not self.persistence.flush(('history', filename), timeout):
+            logging.warning(f"等待历史记录 {filename} 写入超时")
+    def export_current_history(self):
+        """将当前查看的会话导出为 HTML 文件，HTML 只在导出时生成"""
+        if self.is_displaying_historical_chat and self.current_history_file:
+            if not SessionStore.is_session_file(self.current_history_file):
+                QMessageBox.information(self, "提示", "该历史记录本身已是 HTML 文件，无需导出。")
+                return
+            self._wait_for_history_write(self.current_history_file)
+            history_data = self.session_store.read_all(self.current_history_file)
+        elif self._evicted_message_count:
+            # 较早的消息已移出内存，先保存剩余的消息，再从会话文件读取完整记录
+            self._save_current_history()
+            self._wait_for_history_write(self.current_history_file)
+            history_data = self.session_store.read_all(self.current_history_file)
+        else:
+            history_data = [
+                msg for msg in self.dialog_history
+                if not (msg['role'] == 'assistant' and msg['content'] == self.initial_welcome_message)
+            ]
+        if not history_data:
+            QMessageBox.information(self, "提示", "当前没有可导出的对话。")
+            return
+        default_name = (self.current_history_file or self.session_store.new_session_filename()).replace('.jsonl', '.html')
+        file_path, _ = QFileDialog.getSaveFileName(self, "导出聊天记录", default_name, "HTML 文件 (*.html)")
+        if not file_path:
+            return
+        try:
+            atomic_write(file_path, self._get_html_for_history(history_data, 'dark' if self.is_dark_mode else 'light'))
+            logging.info(f"聊天记录已导出到: {file_path}")
+        except Exception as e:
+            logging.error(f"导出聊天记录失败: {file_path}, 错误: {e}")
+            QMessageBox.critical(self, "错误", f"导出聊天记录失败: {e}")
     def _load_history_list(self):
-        self.history_list_widget.clear()
-        history_dir = get_history_path()
-        
-        if not os.path.exists(history_dir):
-            os.makedirs(history_dir, exist_ok=True)
+        """在写入线程中重新扫描历史目录，完成后加载侧边栏（仅在启动或文件被外部改动时需要）；
+        排在之前提交的写入之后，扫描结果包含刚保存的会话"""
+        self.persistence.submit(('history_list',), self._scan_history_list, self.history_model.history_dir)
+    def _scan_history_list(self, history_dir):
+        self.history_list_loaded_signal.emit(self.history_model.scan())
+    def _start_search_index_sync(self):
+        """在后台线程为旧的或尚未索引的历史记录补建全文索引，完成后刷新当前的搜索结果"""
+        def run():
+            try:
+                self.search_index.sync_directory(get_history_path(), self.session_store, self._search_sync_stop)
+            except Exception as e:
+                logging.warning(f"同步聊天记录索引失败: {e}")
+                return
+            if not self._search_sync_stop.is_set():
+                self.search_index_synced_signal.emit()
+        self._search_sync_thread = threading.Thread(target=run, name="search-index-sync", daemon=True)
+        self._search_sync_thread.start()
+    def _configure_telemetry(self):
+        """启用请求指标记录；读取最近的指标文件以恢复统计面板，所以放在窗口显示之后"""
+        if not self.telemetry_config.get('enabled'):
+            Controller.configure_telemetry(None)
             return
-        history_files_with_paths = []
-        for f_name in os.listdir(history_dir):
-            if f_name.endswith('.html'):
-                full_path = get_history_path(f_name)
-                try:
-                    if os.path.getsize(full_path) > 200:
-                        history_files_with_paths.append(f_name)
-                except OSError:
-                    pass
-        
-        history_files = sorted(history_files_with_paths, reverse=True)
-        delete_icon_path = get_asset_path('delete.png')
-        delete_icon = QIcon(delete_icon_path) if os.path.exists(delete_icon_path) else QIcon()
-        for filename in history_files:
+        metrics_log = MetricsLog(
+            get_metrics_path('requests_metrics.jsonl'),
+            max_bytes=int(float(self.telemetry_config['max_mb']) * 1024 * 1024),
+            backups=int(self.telemetry_config['backups']),
+        )
+        Controller.configure_telemetry(Telemetry(metrics_log, window=int(self.telemetry_config['window'])))
+    def _memory_usage(self):
+        """所有标签页的视图文档与对话历史占用（字符数）合计"""
+        total = {}
+        for tab in self._tabs.values():
+            for key, value in tab.memory_usage().items():
+                total[key] = total.get(key, 0) + value
+        return total
+    def show_metrics_dialog(self):
+        if self.metrics_dialog is None:
+            self.metrics_dialog = MetricsDialog(lambda: Controller.telemetry, self, self._memory_usage)
+        self.metrics_dialog.show()
+        self.metrics_dialog.raise_()
+    @Slot()
+    def show_compare_dialog(self):
+        """把输入框中的问题同时发给多个模型对比，采用的回答写入当前标签页的对话"""
+        if not self.api_key:
+            QMessageBox.warning(self, "提示", "请先在设置中填写有效的 API 密钥。")
+            return
+        if self.current_tab.is_busy:
+            self._new_tab() # 当前标签页仍在生成，对比结果写入新标签页
+        elif self.is_displaying_historical_chat:
+            self._start_new_current_session()
+        tab = self.current_tab
+        model_names = list(model_app_id_map)
+        selected_models = [self.selected_model] + [m for m in model_names if m != self.selected_model][:1]
+        history_messages = [
+            msg for msg in self.dialog_history
+            if not (msg['role'] == 'assistant' and msg['content'] == self.initial_welcome_message)
+        ]
+        if history_messages:
+            # 各模型共用一份上下文，按所有可选模型中最小的预算裁剪
+            budget = self.context_token_budget or min(get_context_budget(m) for m in model_names)
+            history_messages = ContextWindow().fit(history_messages, self.selected_model, budget)
+        dialog = CompareDialog(self.api_key, history_messages, self.user_input_edit.toPlainText().strip(), model_names,
+                               selected_models, self.stream_flush_policy, self)
+        dialog.answer_chosen.connect(lambda question, model_name, answer: self._adopt_compare_answer(tab, question, model_name, answer))
+        if dialog.exec() == QDialog.DialogCode.Accepted or dialog.adopted:
+            self.user_input_edit.clear()
+    def _adopt_compare_answer(self, tab, question, model_name, answer):
+        if tab.tab_id not in self._tabs:
+            return # 标签页已关闭
+        with self._bind_tab(tab):
+            if tab.is_busy:
+                self.stop_current_request()
+            self.add_message_to_history('user', question, is_stream=False)
+            self.add_message_to_history('assistant', answer, is_stream=False)
+            self._session_id = None # 这一轮不在服务端会话中，下一轮发送完整历史
+            self._save_current_history()
+            self._compact_transcript()
+            self._refresh_tab_title(tab)
+        logging.info(f"已采用 {model_name} 的对比回答，长度: {len(answer)}")
+        self.statusBar().showMessage(f"已采用 {model_name} 的回答", 5000)
+    def _run_history_search(self):
+        """在搜索线程中查询索引，输入框不会因查询而卡顿；结果返回时输入已经变化的直接丢弃"""
+        self._history_search_generation += 1
+        query = self.history_search_edit.text().strip()
+        if not query:
+            if self.history_list_view.model() is not self.history_model:
+                self.history_list_view.setModel(self.history_model)
+            return
+        generation = self._history_search_generation
+        def search():
+            if generation != self._history_search_generation:
+                return # 排队期间又输入了新的内容
             try:
-                match = re.match(r'chat_(\d{14})\.html', filename)
-                if match:
-                    timestamp_str = match.group(1)
-                    display_title = datetime.strptime(timestamp_str, "%Y%m%d%H%M%S").strftime("%Y年%m月%d日%H点%M分%S秒")
-                else:
-                    display_title = filename.replace(".html", "")
-                item = QListWidgetItem(self.history_list_widget)
-                item.setData(Qt.UserRole, filename)
-                item_widget = QWidget()
-                item_layout = QHBoxLayout(item_widget)
-                item_layout.setContentsMargins(5, 2, 5, 2)
-                item_layout.setSpacing(5)
-                title_label = QLabel(display_title)
-                title_label.setFont(QFont("微软雅黑", 9))
-                title_label.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Preferred)
-                title_label.setWordWrap(True)
-                delete_button = QPushButton()
-                if delete_icon.isNull():
-                    delete_button.setText("删")
-                    delete_button.setFixedSize(20,20)
-                else:
-                    delete_button.setIcon(delete_icon)
-                    delete_button.setIconSize(QSize(16, 16))
-                    delete_button.setFixedSize(24, 24)
-                delete_button.setFlat(True)
-                delete_button.setToolTip(f"删除历史记录: {filename}")
-                delete_button.setObjectName("history_delete_button")
-                delete_button.clicked.connect(lambda checked=False, fn=filename: self._on_delete_history_item_clicked(fn))
-                
-                item_layout.addWidget(title_label)
-                item_layout.addStretch()
-                item_layout.addWidget(delete_button)
-                
-                item_widget.setLayout(item_layout)
-                item.setSizeHint(item_widget.sizeHint())
-                self.history_list_widget.addItem(item)
-                self.history_list_widget.setItemWidget(item, item_widget)
+                results = self.search_index.search(query)
             except Exception as e:
-                logging.warning(f"加载历史文件项 {filename} 失败: {e}", exc_info=True)
-    
+                logging.warning(f"搜索聊天记录失败: {e}")
+                results = []
+            self.history_search_finished_signal.emit(generation, results)
+        self._history_search_executor.submit(search)
+    @Slot(int, object)
+    def _on_history_search_finished(self, generation, results):
+        if generation != self._history_search_generation:
+            return
+        self.history_search_model.set_results(results)
+        if self.history_list_view.model() is not self.history_search_model:
+            self.history_list_view.setModel(self.history_search_model)
     def _on_delete_history_item_clicked(self, filename_to_delete):
         reply = QMessageBox.question(self, "确认删除", 
                                      f"您确定要删除历史记录 '{filename_to_delete}' 吗？\n此操作无法撤销。",
                                      QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No, 
                                      QMessageBox.StandardButton.No)
         if reply == QMessageBox.StandardButton.Yes:
+            owner_tab = self._tab_for_file(filename_to_delete)
+            if owner_tab is not None:
+                with self._bind_tab(owner_tab):
+                    self.stop_current_request()
             file_path = get_history_path(filename_to_delete)
+            self._wait_for_history_write(filename_to_delete) # 否则尚未完成的追加会在删除后重新创建文件
             try:
                 if os.path.exists(file_path):
-                    os.remove(file_path)
+                    self.session_store.delete(filename_to_delete)
                     logging.info(f"成功删除历史文件: {file_path}")
-                    if self.is_displaying_historical_chat and self.current_history_file == filename_to_delete:
-                        self.chat_history_view.clear()
-                        self.is_displaying_historical_chat = False
-                        self.current_history_file = None
-                        self.dialog_history.clear()
-                        self._session_id = None
-                        self.add_message_to_history("assistant", self.initial_welcome_message, is_stream=False)
-                    elif not self.is_displaying_historical_chat and self.current_history_file == filename_to_delete:
-                        self.current_history_file = None 
-                    self._load_history_list()
+                    if owner_tab is not None:
+                        with self._bind_tab(owner_tab):
+                            self._forget_deleted_history()
+                    self.history_model.remove_session(filename_to_delete)
+                    self.history_search_model.remove_session(filename_to_delete)
+                    self.search_index.remove_session(filename_to_delete)
                 else:
                     QMessageBox.warning(self, "错误", f"文件 '{filename_to_delete}' 未找到。")
-                    self._load_history_list()
+                    self.history_model.remove_session(filename_to_delete)
             except Exception as e:
                 logging.error(f"删除历史文件 {file_path} 失败: {e}", exc_info=True)
                 QMessageBox.critical(self, "删除失败", f"无法删除历史记录: {e}")
-    @Slot(QListWidgetItem)
-    def _on_history_item_clicked(self, item):
-        if not item: return
-        filename = item.data(Qt.UserRole)
+    def _forget_deleted_history(self):
+        if self.is_displaying_historical_chat:
+            self.history_pager.close()
+            self.renderer.clear()
+            self.is_displaying_historical_chat = False
+            self.current_history_file = None
+            self.dialog_history.clear()
+            self._saved_message_count = 0
+            self._evicted_message_count = 0
+            self._session_id = None
+            self.add_message_to_history("assistant", self.initial_welcome_message, is_stream=False)
+        else:
+            self.current_history_file = None
+            self._saved_message_count = 0
+            self._evicted_message_count = 0
+        self._refresh_tab_title(self.current_tab)
+    @Slot(QModelIndex)
+    def _on_history_item_clicked(self, index):
+        if not index.isValid(): return
+        filename = index.data(HistoryListModel.FilenameRole)
         if filename:
+            open_tab = self._tab_for_file(filename)
+            if open_tab is not None and (open_tab.is_busy or open_tab.is_displaying_historical_chat):
+                # 会话已在某个标签页中打开，直接切换过去
+                self.chat_tabs.setCurrentWidget(open_tab.view)
+                return
+            if self.current_tab.is_busy:
+                self._new_tab() # 当前标签页仍在生成，在新标签页中查看历史，不打断正在进行的请求
             if not self.is_displaying_historical_chat and self.dialog_history and \
                not (len(self.dialog_history) == 1 and self.dialog_history[0]['content'] == self.initial_welcome_message):
                 self._save_current_history()
             self._display_historical_chat(filename)
             self.is_displaying_historical_chat = True
             self.current_history_file = filename
+            self._refresh_tab_title(self.current_tab)
         else:
             logging.warning("_on_history_item_clicked: item has no filename data.")
     def _display_historical_chat(self, filename):
+        self._wait_for_history_write(filename)
         file_path = get_history_path(filename)
         if os.path.exists(file_path):
             try:
+                current_mode_str = 'dark' if self.is_dark_mode else 'light'
+                if SessionStore.is_session_file(filename):
+                    # 结构化会话记录分页显示：先显示最后一页，向上滚动时再加载更早的消息
+                    welcome_html = self._format_message_html('assistant', self.initial_welcome_message)
+                    count = self.history_pager.open(filename, header_html=welcome_html)
+                    logging.info(f"已加载历史记录: {filename}，首屏 {count} 条消息")
+                    return
+                self.history_pager.close()
                 with open(file_path, 'r', encoding='utf-8') as f:
                     html_content = f.read()
                 
                 body_tag_pattern = re.compile(r'<body\s*data-mode=["\'](light|dark)["\']([^>]*)>', re.IGNORECASE)
-                current_mode_str = 'dark' if self.is_dark_mode else 'light'
                 
                 if body_tag_pattern.search(html_content):
                     html_content = body_tag_pattern.sub(f'<body data-mode="{current_mode_str}"\\2>', html_content)
                 else:
                     html_content = html_content.replace('<body>', f'<body data-mode="{current_mode_str}">', 1)
-                self.chat_history_view.setHtml(html_content)
+                self.renderer.set_html(html_content)
                 self.chat_history_view.moveCursor(QTextCursor.End)
                 logging.info(f"已加载历史记录: {filename}，并应用当前模式: {current_mode_str}")
             except Exception as e:
@@ -712,21 +1259,41 @@ class ChatGUI(QMainWindow):
                 QMessageBox.warning(self, "错误", f"无法加载历史记录: {e}")
         else:
             QMessageBox.warning(self, "错误", f"历史记录文件不存在: {file_path}")
-            self._load_history_list()
+            self.history_model.remove_session(filename)
     def _start_new_current_session(self):
+        self.stop_current_request()
         if not self.is_displaying_historical_chat:
              self._save_current_history()
         self.dialog_history.clear()
+        self._saved_message_count = 0
+        self._evicted_message_count = 0
         self._session_id = None
         self.current_history_file = None
         self.is_displaying_historical_chat = False
-        self.chat_history_view.clear()
+        self.history_pager.close()
+        self.renderer.clear()
         self.add_message_to_history('assistant', self.initial_welcome_message, is_stream=False)
-        
+        self._refresh_tab_title(self.current_tab)
         logging.info("已切换到新的当前会话模式。")
     def closeEvent(self, event):
-        if not self.is_displaying_historical_chat:
-            self._save_current_history()
+        for tab in list(self._tabs.values()):
+            with self._bind_tab(tab):
+                self.stop_current_request()
+                if not self.is_displaying_historical_chat:
+                    self._save_current_history()
+            tab.dispose()
         self._save_config()
+        # 最多等待几秒把排队的写入完成，网络盘卡住时也不会让窗口无法关闭
+        if not self.persistence.shutdown(timeout=5.0):
+            logging.warning("部分历史记录或配置未能在关闭前写入。")
+        self.session_store.close() # 关闭前将未落盘的记录全部 fsync
+        self._search_sync_stop.set()
+        if self._search_sync_thread is not None:
+            self._search_sync_thread.join(2.0)
+        self._history_search_executor.shutdown(wait=True, cancel_futures=True)
+        self.search_index.close()
+        Controller.shutdown() # 关闭连接池与事件循环线程
+        if Controller.telemetry is not None:
+            Controller.telemetry.close() # 请求已全部结束，写完剩余的指标记录
         logging.info("应用程序关闭。")
         super().closeEvent(event)
\ No newline at end of file
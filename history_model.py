@@ -0,0 +1,219 @@
+# history_model.py
+import os
+import re
+import logging
+from datetime import datetime
+from PySide6.QtCore import Qt, QAbstractListModel, QModelIndex, QRect, QSize, QEvent, Signal
+from PySide6.QtGui import QIcon
+from PySide6.QtWidgets import QApplication, QStyledItemDelegate, QStyleOptionViewItem, QStyle
+HISTORY_FILE_PATTERN = re.compile(r'chat_(\d{14})\.(?:html|jsonl)$')
+def format_history_title(filename):
+    """把 chat_YYYYmmddHHMMSS.* 文件名转换为侧边栏显示的标题"""
+    match = HISTORY_FILE_PATTERN.match(filename)
+    if match:
+        try:
+            return datetime.strptime(match.group(1), "%Y%m%d%H%M%S").strftime("%Y年%m月%d日%H点%M分%S秒")
+        except ValueError:
+            pass
+    return os.path.splitext(filename)[0]
+class HistoryListModel(QAbstractListModel):
+    """历史记录列表模型：只保存文件名，标题按需生成，行数据分批加载，新建或删除会话时原地插入/移除"""
+    FilenameRole = Qt.UserRole
+    FETCH_BATCH_SIZE = 200
+    def __init__(self, history_dir, parent=None):
+        super().__init__(parent)
+        self.history_dir = history_dir
+        self._filenames = [] # 按时间倒序排列的全部文件名
+        self._loaded_count = 0 # 已暴露给视图的行数
+        self._titles = {} # filename -> 显示标题缓存
+    @staticmethod
+    def _is_listed(entry):
+        # .jsonl 为追加式会话记录，.html 为旧版本保存的历史记录（过小的视为空文件）
+        try:
+            if entry.name.endswith('.jsonl'):
+                return entry.stat().st_size > 0
+            if entry.name.endswith('.html'):
+                return entry.stat().st_size > 200
+        except OSError:
+            pass
+        return False
+    def scan(self):
+        """扫描历史目录，返回按时间倒序排列的文件名（只读目录，可以在后台线程调用）"""
+        try:
+            with os.scandir(self.history_dir) as entries:
+                filenames = [entry.name for entry in entries if self._is_listed(entry)]
+        except OSError as e:
+            logging.warning(f"扫描历史目录失败: {e}")
+            filenames = []
+        return sorted(filenames, reverse=True)
+    def set_filenames(self, filenames):
+        self.beginResetModel()
+        self._filenames = list(filenames)
+        self._loaded_count = min(len(self._filenames), self.FETCH_BATCH_SIZE)
+        self._titles.clear()
+        self.endResetModel()
+    def refresh(self):
+        """重新扫描历史目录（仅在启动或文件被外部改动时调用）"""
+        self.set_filenames(self.scan())
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self._loaded_count
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self._loaded_count < len(self._filenames)
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return
+        remaining = len(self._filenames) - self._loaded_count
+        batch = min(remaining, self.FETCH_BATCH_SIZE)
+        if batch <= 0:
+            return
+        self.beginInsertRows(QModelIndex(), self._loaded_count, self._loaded_count + batch - 1)
+        self._loaded_count += batch
+        self.endInsertRows()
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or not 0 <= index.row() < self._loaded_count:
+            return None
+        filename = self._filenames[index.row()]
+        if role == Qt.DisplayRole:
+            title = self._titles.get(filename)
+            if title is None:
+                title = self._titles[filename] = format_history_title(filename)
+            return title
+        if role == self.FilenameRole:
+            return filename
+        if role == Qt.ToolTipRole:
+            return filename
+        return None
+    def filename_at(self, row):
+        return self._filenames[row] if 0 <= row < self._loaded_count else None
+    def contains(self, filename):
+        return self._row_of(filename) is not None
+    def _insert_position(self, filename):
+        # 列表按文件名倒序排列，二分查找第一个不大于 filename 的位置
+        lo, hi = 0, len(self._filenames)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._filenames[mid] > filename:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+    def _row_of(self, filename):
+        row = self._insert_position(filename)
+        if row < len(self._filenames) and self._filenames[row] == filename:
+            return row
+        return None
+    def add_session(self, filename):
+        """新会话保存后插入到对应位置，不重建列表"""
+        if not filename or self.contains(filename):
+            return
+        row = self._insert_position(filename)
+        if row > self._loaded_count:
+            self._filenames.insert(row, filename) # 尚未加载到视图的部分，直接插入即可
+            return
+        self.beginInsertRows(QModelIndex(), row, row)
+        self._filenames.insert(row, filename)
+        self._loaded_count += 1
+        self.endInsertRows()
+    def remove_session(self, filename):
+        row = self._row_of(filename)
+        if row is None:
+            return
+        self._titles.pop(filename, None)
+        if row >= self._loaded_count:
+            del self._filenames[row]
+            return
+        self.beginRemoveRows(QModelIndex(), row, row)
+        del self._filenames[row]
+        self._loaded_count -= 1
+        self.endRemoveRows()
+class HistorySearchModel(QAbstractListModel):
+    """侧边栏搜索结果：每个命中的会话一行，附带命中片段，与 HistoryListModel 共用同一个委托"""
+    FilenameRole = HistoryListModel.FilenameRole
+    SnippetRole = Qt.UserRole + 1
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._results = [] # [{'filename', 'snippet', 'role'}]，已按相关度排序
+    def set_results(self, results):
+        self.beginResetModel()
+        self._results = list(results)
+        self.endResetModel()
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._results)
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or not 0 <= index.row() < len(self._results):
+            return None
+        result = self._results[index.row()]
+        if role == Qt.DisplayRole:
+            return format_history_title(result['filename'])
+        if role == self.FilenameRole:
+            return result['filename']
+        if role == self.SnippetRole:
+            return result['snippet']
+        if role == Qt.ToolTipRole:
+            return result['snippet']
+        return None
+    def remove_session(self, filename):
+        for row, result in enumerate(self._results):
+            if result['filename'] == filename:
+                self.beginRemoveRows(QModelIndex(), row, row)
+                del self._results[row]
+                self.endRemoveRows()
+                return
+class HistoryItemDelegate(QStyledItemDelegate):
+    """绘制历史记录行：标题（搜索结果另加一行命中片段）+ 右侧删除图标，点击图标时发出 delete_requested 信号"""
+    delete_requested = Signal(str)
+    ROW_HEIGHT = 36
+    SNIPPET_ROW_HEIGHT = 52
+    ICON_SIZE = 16
+    def __init__(self, delete_icon_path, parent=None):
+        super().__init__(parent)
+        self.delete_icon = QIcon(delete_icon_path) if os.path.exists(delete_icon_path) else QIcon()
+    def _delete_rect(self, option_rect):
+        size = self.ICON_SIZE
+        return QRect(option_rect.right() - size - 8, option_rect.center().y() - size // 2, size, size)
+    def sizeHint(self, option, index):
+        hint = super().sizeHint(option, index)
+        height = self.SNIPPET_ROW_HEIGHT if index.data(HistorySearchModel.SnippetRole) else self.ROW_HEIGHT
+        return QSize(hint.width(), max(hint.height(), height))
+    def paint(self, painter, option, index):
+        opt = QStyleOptionViewItem(option)
+        self.initStyleOption(opt, index)
+        title = opt.text
+        opt.text = ""
+        style = opt.widget.style() if opt.widget else QApplication.style()
+        style.drawControl(QStyle.CE_ItemViewItem, opt, painter, opt.widget) # 背景、悬停与选中效果
+        # 标题绘制在删除图标左侧的区域
+        painter.save()
+        is_selected = bool(opt.state & QStyle.State_Selected)
+        painter.setPen(opt.palette.highlightedText().color() if is_selected else opt.palette.text().color())
+        text_rect = opt.rect.adjusted(8, 0, -(self.ICON_SIZE + 16), 0)
+        snippet = index.data(HistorySearchModel.SnippetRole)
+        if snippet:
+            title_rect = text_rect.adjusted(0, 4, 0, -text_rect.height() // 2)
+            snippet_rect = text_rect.adjusted(0, text_rect.height() // 2, 0, -4)
+            painter.drawText(title_rect, Qt.AlignLeft | Qt.AlignVCenter, title)
+            font = painter.font()
+            font.setPointSizeF(font.pointSizeF() * 0.9)
+            painter.setFont(font)
+            if not is_selected:
+                painter.setPen(opt.palette.placeholderText().color())
+            painter.drawText(snippet_rect, Qt.AlignLeft | Qt.AlignVCenter,
+                             painter.fontMetrics().elidedText(snippet, Qt.ElideRight, snippet_rect.width()))
+        else:
+            painter.drawText(text_rect, Qt.AlignLeft | Qt.AlignVCenter | Qt.TextWordWrap, title)
+        painter.restore()
+        delete_rect = self._delete_rect(option.rect)
+        if self.delete_icon.isNull():
+            painter.drawText(delete_rect, Qt.AlignCenter, "删")
+        else:
+            self.delete_icon.paint(painter, delete_rect)
+    def editorEvent(self, event, model, option, index):
+        if event.type() == QEvent.MouseButtonRelease and self._delete_rect(option.rect).contains(event.position().toPoint()):
+            filename = index.data(HistoryListModel.FilenameRole)
+            if filename:
+                self.delete_requested.emit(filename)
+            return True
+        if event.type() in (QEvent.MouseButtonPress, QEvent.MouseButtonDblClick) and \
+                self._delete_rect(option.rect).contains(event.position().toPoint()):
+            return True # 点击删除图标时不触发选中/打开
+        return super().editorEvent(event, model, option, index)
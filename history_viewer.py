@@ -0,0 +1,140 @@
+# history_viewer.py
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from PySide6.QtCore import QObject, Signal, Slot
+class HistoryPager(QObject):
+    """分页查看历史会话：打开时只读取并渲染最后一页，向上滚动接近顶部时插入更早的一页；
+    下一页总是提前在后台线程读取好，打开任意长度的会话耗时都与会话长度无关。
+    实时会话的较早消息被移出视图后也用它在向上滚动时从会话文件中读回（见 follow）"""
+    _page_loaded = Signal(int, object, int) # generation, records, start_offset（跨线程投递到 GUI 线程）
+    messages_prepended = Signal(int) # 在视图开头插入的消息条数，已有消息的序号随之后移
+    PAGE_SIZE = 50
+    LOAD_THRESHOLD = 200 # 滚动条距顶部小于该像素数时加载更早的一页
+    def __init__(self, session_store, renderer, format_message, parent=None, wait_for_writes=None):
+        super().__init__(parent)
+        self.session_store = session_store
+        self.wait_for_writes = wait_for_writes # filename -> None，读取前等待该会话尚未完成的后台写入
+        self.renderer = renderer
+        self.format_message = format_message # (role, content) -> 单条消息 HTML
+        self.header_html = None # 读到会话开头时插入在最前面的内容（例如欢迎语）
+        self.filename = None
+        self._generation = 0 # 每次打开或关闭时递增，丢弃过期的后台读取结果
+        self._next_offset = 0 # 下一页（更早的记录）的结束偏移，0 表示已全部加载，None 表示需要先按 _displayed_count 定位
+        self._displayed_count = None # 实时会话：返回视图中显示的是会话文件末尾多少条记录
+        self._prefetched = None # 已读取但尚未插入的一页：(records, start_offset)
+        self._prefetching = False
+        self._want_more = False # 用户已滚动到顶部，但下一页还在读取中
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history-pager")
+        self._page_loaded.connect(self._on_page_loaded)
+        self.renderer.view.verticalScrollBar().valueChanged.connect(self._on_scrolled)
+    @property
+    def is_active(self):
+        return self.filename is not None
+    def open(self, filename, header_html=None):
+        """显示会话的最后一页并开始预取上一页，返回本页的记录条数"""
+        self.close()
+        self.filename = filename
+        self.header_html = header_html
+        records, start_offset = self.session_store.read_page(filename, limit=self.PAGE_SIZE)
+        self.renderer.clear()
+        for record in records:
+            self.renderer.append_message(self.format_message(record['role'], record['content']))
+        self._next_offset = start_offset
+        if start_offset == 0:
+            self._insert_header()
+        else:
+            self._prefetch()
+        self._maybe_load_more()
+        return len(records)
+    def follow(self, filename, displayed_count, header_html=None):
+        """实时会话的较早消息已移出视图：视图中保留的是会话文件末尾的 displayed_count() 条记录（之后还会继续追加），
+        向上滚动到顶部时从文件中读回更早的消息"""
+        self.close()
+        self.filename = filename
+        self.header_html = header_html
+        self._displayed_count = displayed_count
+        self._next_offset = None
+        self._prefetch()
+    def close(self):
+        self._generation += 1
+        self.filename = None
+        self._displayed_count = None
+        self._next_offset = 0
+        self._prefetched = None
+        self._prefetching = False
+        self._want_more = False
+    def shutdown(self):
+        self.close()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+    def _insert_header(self):
+        if self.header_html:
+            self.renderer.prepend_messages([self.header_html])
+            self.renderer.mark_note(0)
+            self.messages_prepended.emit(1)
+    def _has_more(self):
+        return self._next_offset is None or self._next_offset > 0
+    def _prefetch(self):
+        if self._prefetching or self._prefetched is not None or not self._has_more():
+            return
+        self._prefetching = True
+        generation, filename, end_offset, displayed_count = self._generation, self.filename, self._next_offset, self._displayed_count
+        def read():
+            try:
+                offset = end_offset
+                if offset is None:
+                    offset = self._locate(filename, displayed_count)
+                elif self.wait_for_writes is not None:
+                    self.wait_for_writes(filename)
+                if offset == 0:
+                    records, start_offset = [], 0
+                else:
+                    records, start_offset = self.session_store.read_page(filename, offset, self.PAGE_SIZE)
+            except Exception as e:
+                logging.error(f"读取历史记录 {filename} 失败: {e}")
+                records, start_offset = [], 0
+            self._page_loaded.emit(generation, records, start_offset)
+        self._executor.submit(read)
+    def _locate(self, filename, displayed_count):
+        """在读取线程中找到视图中第一条记录在会话文件中的偏移：跳过文件末尾已显示的记录，只读取这一段，与会话总长度无关。
+        等待写入前后已显示的条数不同（期间又保存了消息）时重新定位"""
+        while True:
+            displayed = displayed_count()
+            if self.wait_for_writes is not None:
+                self.wait_for_writes(filename)
+            offset = self.session_store.read_page(filename, None, displayed)[1] if displayed > 0 else None
+            if displayed_count() == displayed:
+                return offset
+    @Slot(int, object, int)
+    def _on_page_loaded(self, generation, records, start_offset):
+        if generation != self._generation:
+            return
+        self._prefetching = False
+        self._prefetched = (records, start_offset)
+        if self._want_more:
+            self._want_more = False
+            self._load_previous_page()
+    def _load_previous_page(self):
+        if self._prefetched is None:
+            self._want_more = self._has_more()
+            self._prefetch()
+            return
+        records, start_offset = self._prefetched
+        self._prefetched = None
+        self._next_offset = start_offset
+        self.renderer.prepend_messages([self.format_message(r['role'], r['content']) for r in records])
+        if records:
+            self.messages_prepended.emit(len(records))
+        if start_offset == 0:
+            self._insert_header()
+        else:
+            self._prefetch()
+        self._maybe_load_more()
+    def _maybe_load_more(self):
+        # 内容还不足一屏或已滚动到顶部附近时继续加载
+        if self.is_active and self._has_more() and \
+                self.renderer.view.verticalScrollBar().value() < self.LOAD_THRESHOLD:
+            self._load_previous_page()
+    @Slot(int)
+    def _on_scrolled(self, value):
+        if value < self.LOAD_THRESHOLD:
+            self._maybe_load_more()
@@ -2,9 +2,27 @@
 import sys
 import os
 import logging
+import startup_profile
+PROFILE_STARTUP = '--profile-startup' in sys.argv # 输出启动各阶段耗时后自动退出
+if PROFILE_STARTUP:
+    startup_profile.reset()
+    sys.argv.remove('--profile-startup')
 from PySide6.QtWidgets import QApplication
 from PySide6.QtGui import QFont # 可选：设置全局字体
+from PySide6.QtCore import QObject, QEvent, QTimer
+startup_profile.mark("导入 Qt")
 from gui import ChatGUI, get_asset_path # 导入 get_asset_path
+startup_profile.mark("导入界面模块")
+class FirstPaintWatcher(QObject):
+    """记录输入框第一次绘制完成（即可以开始输入）的时间"""
+    def __init__(self, on_painted):
+        super().__init__()
+        self.on_painted = on_painted
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.Paint:
+            obj.removeEventFilter(self)
+            QTimer.singleShot(0, self.on_painted)
+        return False
 if __name__ == "__main__":
     # 配置日志
     logging.basicConfig(
@@ -17,9 +35,21 @@ if __name__ == "__main__":
     )
     logging.info("应用程序启动...")
     app = QApplication(sys.argv)
+    startup_profile.mark("创建 QApplication")
     # 可选: 设置全局字体 (如果需要统一风格)
     # default_font = QFont("微软雅黑", 10)
     # app.setFont(default_font)
     main_window = ChatGUI()
     main_window.show()
+    if PROFILE_STARTUP:
+        progress = {'painted': False, 'deferred': False}
+        def finish_if_done(key):
+            progress[key] = True
+            if all(progress.values()):
+                startup_profile.report()
+                main_window.close()
+                app.quit()
+        paint_watcher = FirstPaintWatcher(lambda: (startup_profile.mark("首次绘制输入框"), finish_if_done('painted')))
+        main_window.user_input_edit.viewport().installEventFilter(paint_watcher)
+        main_window.startup_finished.connect(lambda: finish_if_done('deferred'))
     sys.exit(app.exec())
\ No newline at end of file
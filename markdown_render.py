@@ -0,0 +1,90 @@
+# markdown_render.py
+import re
+from functools import lru_cache
+from PySide6.QtGui import QTextCursor, QTextDocument, QTextDocumentFragment, QTextBlockFormat, QTextCharFormat
+FENCE_PATTERN = re.compile(r' {0,3}(`{3,}|~{3,})')
+BODY_PATTERN = re.compile(r'<body[^>]*>(.*)</body>', re.S)
+@lru_cache(maxsize=512)
+def render_markdown(text):
+    """把一条完整回答的 Markdown 转换为可插入聊天视图的 HTML 片段（按文本缓存，刷新或翻页时不重复解析）"""
+    document = QTextDocument()
+    document.setMarkdown(text)
+    match = BODY_PATTERN.search(document.toHtml())
+    return match.group(1).strip() if match else document.toHtml()
+class MarkdownStream:
+    """一条流式消息的增量 Markdown 渲染：已经完成的块（空行之后且不在代码块内）只插入一次并固定在文档中，
+    每次增量只删除并重新解析末尾尚未完成的那个块，开销与末尾块的长度有关，而不是整条回答的长度。
+    end_position 返回这条消息在文档中所占区域的末尾位置（消息必须位于该区域的最后）"""
+    def __init__(self, document, end_position):
+        self.document = document
+        self.end_position = end_position
+        self.text = ""
+        self._frozen = 0 # text 中已经固定到文档里的字符数
+        self._scanned = 0 # 已扫描过的完整行的末尾
+        self._boundary = 0 # 最后一个已完成块的末尾
+        self._fence = None # 当前所在代码块的围栏（例如 ```），不在代码块内时为 None
+        self._tail_length = 0 # 末尾未完成块在文档中占用的字符数
+    def _scan(self):
+        # 只扫描新到达的完整行，找出块的边界
+        while True:
+            line_end = self.text.find('\n', self._scanned)
+            if line_end < 0:
+                return
+            line = self.text[self._scanned:line_end]
+            self._scanned = line_end + 1
+            fence = FENCE_PATTERN.match(line)
+            if self._fence is None:
+                if fence:
+                    self._fence = fence.group(1)
+                elif not line.strip():
+                    self._boundary = self._scanned
+            elif fence and fence.group(1)[0] == self._fence[0] and len(fence.group(1)) >= len(self._fence) \
+                    and not line.strip().strip(self._fence[0]):
+                self._fence = None
+                self._boundary = self._scanned # 代码块结束即是一个完整的块
+    def _insert(self, cursor, text):
+        fragment = QTextDocument()
+        fragment.setMarkdown(text)
+        start = cursor.position()
+        cursor.insertFragment(QTextDocumentFragment(fragment))
+        first_block = fragment.firstBlock()
+        if first_block.textList() is None:
+            # 片段的第一个块并入光标所在的段落时会丢掉自己的块格式（代码块、引用），这里补回去
+            first = QTextCursor(self.document)
+            first.setPosition(start)
+            first.setBlockFormat(first_block.blockFormat())
+    def _take_tail(self):
+        """删除上次插入的末尾块，返回位于其起点的光标"""
+        end = self.end_position()
+        cursor = QTextCursor(self.document)
+        cursor.setPosition(end - self._tail_length)
+        if self._tail_length:
+            cursor.setPosition(end, QTextCursor.KeepAnchor)
+            cursor.removeSelectedText()
+            # 剩下的空段落可能带着上次末尾块的格式（列表、代码块等），重新解析前先清掉
+            cursor.setBlockFormat(QTextBlockFormat())
+            cursor.setCharFormat(QTextCharFormat())
+        return cursor
+    def feed(self, delta):
+        self.text += delta
+        self._scan()
+        self._render(self._boundary, final=False)
+    def finish(self):
+        """流式结束：末尾的块也随之完成"""
+        self._render(len(self.text), final=True)
+    def _render(self, boundary, final):
+        cursor = self._take_tail()
+        cursor.beginEditBlock()
+        if boundary > self._frozen and not self.text[self._frozen:boundary].strip():
+            self._frozen = boundary # 块之间多余的空行不产生内容
+        elif boundary > self._frozen:
+            self._insert(cursor, self.text[self._frozen:boundary])
+            self._frozen = boundary
+            # 末尾块从新的段落开始，不并入已固定的块；以表格结尾的片段之后本来就是一个空段落，直接用作起点
+            if not final and cursor.block().length() > 1:
+                cursor.insertBlock(QTextBlockFormat(), QTextCharFormat())
+        tail_start = cursor.position()
+        if self._frozen < len(self.text):
+            self._insert(cursor, self.text[self._frozen:])
+        cursor.endEditBlock()
+        self._tail_length = self.end_position() - tail_start
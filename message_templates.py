@@ -0,0 +1,42 @@
+# message_templates.py
+import os
+from PySide6.QtCore import QUrl
+from PySide6.QtGui import QImage, QTextDocument
+from markdown_render import render_markdown
+CONTAINER_STYLE = "display: flex; align-items: flex-start; margin-bottom: 10px;"
+AVATAR_STYLE = "width: 35px; height: 35px; border-radius: 100%; margin-right: 8px; vertical-align: top;"
+BOX_CLASSES = {'user': 'user-message-box', 'assistant': 'assistant-message-box'}
+class MessageTemplates:
+    """聊天视图中单条消息的 HTML 模板：每个角色的外层结构只拼接一次，渲染消息时只需插入正文；
+    头像在创建时解码一次，作为文档资源（avatar:角色）引用，不再每条消息查找文件并由 Qt 重新读取解码"""
+    def __init__(self, avatar_paths):
+        self.resources = {} # QUrl -> QImage，由 TranscriptRenderer 注册到各视图的文档中
+        self._templates = {} # 角色 -> (正文之前的 HTML, 正文之后的 HTML)
+        for role, box_class in BOX_CLASSES.items():
+            avatar_html = ""
+            path = avatar_paths.get(role)
+            image = QImage(path) if path and os.path.exists(path) else QImage()
+            if not image.isNull():
+                url = f"avatar:{role}"
+                self.resources[QUrl(url)] = image
+                avatar_html = f'<img src="{url}" style="{AVATAR_STYLE}">'
+            self._templates[role] = (
+                f'<div class="message-container" style="{CONTAINER_STYLE}">{avatar_html}<div class="{box_class}">',
+                '</div></div>',
+            )
+        prefix, suffix = self._templates['assistant']
+        # 流式输出开始前显示的空助手消息，增量文本随后插入到它的末尾
+        self.stream_placeholder = prefix + '<p style="margin:0; padding:0; display:inline;" id="streaming_output_placeholder"></p>' + suffix
+    def format_message(self, role, message_content):
+        """生成单条完整消息的 HTML：用户消息原样放入段落，模型的回答（以及纯文本错误信息）按 Markdown 渲染"""
+        if role == 'user':
+            body = f'<p>{message_content}</p>'
+        elif not message_content.strip().startswith('<'):
+            body = render_markdown(message_content)
+        else:
+            body = message_content
+        prefix, suffix = self._templates['user' if role == 'user' else 'assistant']
+        return prefix + body + suffix
+    def register(self, document):
+        for url, image in self.resources.items():
+            document.addResource(QTextDocument.ImageResource, url, image)
@@ -0,0 +1,91 @@
+# persistence.py
+import os
+import json
+import logging
+import tempfile
+import threading
+def atomic_write(path, text, encoding='utf-8'):
+    """先写入同一目录下的临时文件并 fsync，再用 os.replace 原子地替换目标文件，中途失败不会留下写了一半的文件"""
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(prefix=f'.{os.path.basename(path)}.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding=encoding) as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+def atomic_write_json(path, data):
+    atomic_write(path, json.dumps(data, indent=4))
+class PersistenceWorker:
+    """后台写入线程：GUI 线程只提交写入任务，文件 I/O 在这里串行执行。
+    同一个 key 的任务尚未开始执行时会合并为一个（默认保留最新的一份数据，也可以传入 merge 合并），
+    例如连续保存同一会话或配置只会写一次；同一个 key 的任务按提交顺序执行"""
+    def __init__(self, on_error=None, name="persistence"):
+        self.on_error = on_error # (key, exception)，在后台线程中调用
+        self._condition = threading.Condition()
+        self._pending = {} # key -> (func, payload)，按首次提交的顺序执行
+        self._running_key = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+    def submit(self, key, func, payload, merge=None):
+        """在后台线程中执行 func(payload)；merge(旧数据, 新数据) 用于合并同一个 key 尚未执行的任务"""
+        with self._condition:
+            if self._closed:
+                logging.warning(f"写入线程已停止，直接在当前线程执行: {key}")
+            else:
+                if key in self._pending and merge is not None:
+                    payload = merge(self._pending[key][1], payload)
+                self._pending[key] = (func, payload) # 已在队列中的 key 保持原来的位置
+                self._condition.notify_all()
+                return
+        self._execute(key, func, payload)
+    def _execute(self, key, func, payload):
+        try:
+            func(payload)
+        except Exception as e:
+            logging.error(f"后台写入失败（{key}）: {e}", exc_info=True)
+            if self.on_error is not None:
+                self.on_error(key, e)
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+                key = next(iter(self._pending))
+                func, payload = self._pending.pop(key)
+                self._running_key = key
+            try:
+                self._execute(key, func, payload)
+            finally:
+                with self._condition:
+                    self._running_key = None
+                    self._condition.notify_all()
+    def _is_idle(self, key=None):
+        if key is None:
+            return not self._pending and self._running_key is None
+        return key not in self._pending and self._running_key != key
+    def flush(self, key=None, timeout=None):
+        """等待 key（为 None 时等待全部）已提交的写入完成，返回是否在超时前完成"""
+        with self._condition:
+            return self._condition.wait_for(lambda: self._is_idle(key), timeout)
+    def shutdown(self, timeout=5.0):
+        """等待最多 timeout 秒把剩余的写入完成后停止线程，返回是否全部写完"""
+        flushed = self.flush(timeout=timeout)
+        with self._condition:
+            if not flushed:
+                logging.warning(f"关闭时仍有 {len(self._pending)} 个写入任务未完成: {list(self._pending)}")
+            self._closed = True
+            self._pending.clear()
+            self._condition.notify_all()
+        self._thread.join(0.5 if flushed else 0)
+        return flushed
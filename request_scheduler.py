@@ -0,0 +1,95 @@
+# request_scheduler.py
+import asyncio
+import logging
+from collections import deque, Counter
+class RequestSlot:
+    """一次请求的执行名额：wait() 等到被调度，release() 归还名额（排队中被取消时从队列移除）"""
+    def __init__(self, scheduler, model_name, owner):
+        self.scheduler = scheduler
+        self.model_name = model_name
+        self.owner = owner
+        self.granted = False
+        self.released = False
+        self._future = asyncio.get_running_loop().create_future()
+    async def wait(self):
+        if not self.granted:
+            await self._future
+    def release(self):
+        self.scheduler._release(self)
+class RequestScheduler:
+    """请求调度器：限制全局与单个模型的并发请求数；有空闲名额时优先放行最久没有被调度过的发起方（标签页），
+    一个标签页连续发出的请求不会挤占其他标签页。只能在事件循环线程中使用"""
+    def __init__(self, global_limit=4, per_model_limit=2, model_limits=None):
+        self.global_limit = max(1, global_limit)
+        self.per_model_limit = max(1, per_model_limit)
+        self.model_limits = dict(model_limits or {}) # 模型名 -> 该模型的并发上限，覆盖 per_model_limit
+        self._active_total = 0
+        self._active_by_model = Counter()
+        self._active_by_owner = Counter()
+        self._queues = {} # owner -> deque[RequestSlot]，按发起先后排列
+        self._last_served = {} # owner -> 上次被放行时的序号，发起方没有排队或执行中的请求时移除
+        self._served_count = 0
+    def _model_limit(self, model_name):
+        return max(1, self.model_limits.get(model_name, self.per_model_limit))
+    def _can_run(self, model_name):
+        return self._active_total < self.global_limit and self._active_by_model[model_name] < self._model_limit(model_name)
+    @property
+    def queued_count(self):
+        return sum(len(queue) for queue in self._queues.values())
+    def request(self, model_name, owner=None):
+        """申请名额，返回 RequestSlot；名额足够时立即获得（slot.granted 为 True）"""
+        slot = RequestSlot(self, model_name, owner)
+        self._queues.setdefault(owner, deque()).append(slot)
+        self._dispatch()
+        if not slot.granted:
+            logging.info(f"请求排队中: 模型 {model_name}，前面还有 {self.queued_count - 1} 个请求")
+        return slot
+    def _grant(self, slot):
+        slot.granted = True
+        self._active_total += 1
+        self._active_by_model[slot.model_name] += 1
+        self._active_by_owner[slot.owner] += 1
+        if not slot._future.done():
+            slot._future.set_result(None)
+    def _dispatch(self):
+        # 只看各发起方队首的请求（保证同一发起方内先来先服务），在能执行的里面放行最久没有被调度过的发起方
+        while self._queues and self._active_total < self.global_limit:
+            runnable = [owner for owner, queue in self._queues.items() if self._can_run(queue[0].model_name)]
+            if not runnable:
+                return # 所有队首请求的模型都已满
+            owner = min(runnable, key=lambda o: self._last_served.get(o, -1))
+            queue = self._queues[owner]
+            self._grant(queue.popleft())
+            self._served_count += 1
+            self._last_served[owner] = self._served_count
+            if not queue:
+                del self._queues[owner]
+    def _release(self, slot):
+        if slot.released:
+            return
+        slot.released = True
+        if slot.granted:
+            self._active_total -= 1
+            self._active_by_model[slot.model_name] -= 1
+            self._active_by_owner[slot.owner] -= 1
+        else:
+            queue = self._queues.get(slot.owner)
+            if queue is not None and slot in queue:
+                queue.remove(slot)
+                if not queue:
+                    del self._queues[slot.owner]
+            if not slot._future.done():
+                slot._future.cancel()
+        if not self._active_by_owner[slot.owner] and slot.owner not in self._queues:
+            # 发起方已空闲（例如标签页关闭或客户端断开），不再保留它的调度记录，长时间运行时不会随发起方数量增长
+            self._active_by_owner.pop(slot.owner, None)
+            self._last_served.pop(slot.owner, None)
+        self._dispatch()
+    def stats(self):
+        return {
+            'active': self._active_total,
+            'active_by_model': dict(+self._active_by_model),
+            'queued': self.queued_count,
+            'global_limit': self.global_limit,
+            'per_model_limit': self.per_model_limit,
+        }
@@ -0,0 +1,150 @@
+# response_cache.py
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+WHITESPACE_PATTERN = re.compile(r'\s+')
+CJK_INNER_SPACE_PATTERN = re.compile(r'(?<=[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]) (?=[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef])')
+class ResponseCache:
+    """回答缓存：内存 LRU 一级缓存 + 按总大小淘汰、带过期时间的磁盘二级缓存"""
+    def __init__(self, cache_dir, memory_entries=256, disk_max_bytes=50 * 1024 * 1024, ttl_seconds=7 * 24 * 3600):
+        self.cache_dir = cache_dir
+        self.memory_entries = memory_entries
+        self.disk_max_bytes = disk_max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._memory = OrderedDict() # key -> (created_at, text)
+        self._disk_index = None # key -> (size, last_access)，首次访问磁盘时建立
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+        os.makedirs(self.cache_dir, exist_ok=True)
+    @staticmethod
+    def normalize_text(text):
+        # 全角/半角统一、去掉首尾空白、合并连续空白并去掉中文字符之间的空格，使只有格式差异的问题命中同一条缓存
+        text = WHITESPACE_PATTERN.sub(' ', unicodedata.normalize('NFKC', text)).strip()
+        return CJK_INNER_SPACE_PATTERN.sub('', text)
+    @classmethod
+    def make_key(cls, model_name, messages, namespace=()):
+        """namespace 区分回答的来源（后端、接口地址、应用 ID），换用替身服务器或其他后端生成的回答不会被当作原来的回答回放"""
+        normalized = [[m['role'], cls.normalize_text(m['content'])] for m in messages]
+        raw = json.dumps([list(namespace), model_name, normalized], ensure_ascii=False, separators=(',', ':'))
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+    def _path_for(self, key):
+        return os.path.join(self.cache_dir, f'{key}.json')
+    def _is_expired(self, created_at):
+        return self.ttl_seconds > 0 and time.time() - created_at > self.ttl_seconds
+    def _load_disk_index(self):
+        if self._disk_index is not None:
+            return
+        self._disk_index = {}
+        self._disk_bytes = 0
+        try:
+            with os.scandir(self.cache_dir) as entries:
+                for entry in entries:
+                    if entry.name.endswith('.json'):
+                        stat = entry.stat()
+                        self._disk_index[entry.name[:-5]] = (stat.st_size, stat.st_mtime)
+                        self._disk_bytes += stat.st_size
+        except OSError as e:
+            logging.warning(f"扫描回答缓存目录失败: {e}")
+    def _remember(self, key, created_at, text):
+        self._memory[key] = (created_at, text)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+    def get(self, key):
+        """返回 (文本, 命中层级) 或 None；磁盘读取较慢，不应在 GUI 线程调用"""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created_at, text = entry
+                if not self._is_expired(created_at):
+                    self._memory.move_to_end(key)
+                    self._stats['memory_hits'] += 1
+                    return text, 'memory'
+                del self._memory[key]
+            self._load_disk_index()
+            if key not in self._disk_index:
+                self._stats['misses'] += 1
+                return None
+            path = self._path_for(key)
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except (OSError, ValueError) as e:
+                logging.warning(f"读取回答缓存失败，已丢弃: {e}")
+                self._drop_disk_entry(key)
+                self._stats['misses'] += 1
+                return None
+            if self._is_expired(data.get('created_at', 0)):
+                self._drop_disk_entry(key)
+                self._stats['misses'] += 1
+                return None
+            now = time.time()
+            try:
+                os.utime(path, (now, now)) # 用访问时间作为磁盘淘汰顺序
+            except OSError:
+                pass
+            self._disk_index[key] = (self._disk_index[key][0], now)
+            self._remember(key, data['created_at'], data['text'])
+            self._stats['disk_hits'] += 1
+            return data['text'], 'disk'
+    def put(self, key, text, model_name=None):
+        if not text:
+            return
+        created_at = time.time()
+        payload = json.dumps({'created_at': created_at, 'model': model_name, 'text': text}, ensure_ascii=False)
+        with self._lock:
+            self._remember(key, created_at, text)
+            self._load_disk_index()
+            path = self._path_for(key)
+            tmp_path = f'{path}.tmp'
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    f.write(payload)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                logging.warning(f"写入回答缓存失败: {e}")
+                return
+            size = len(payload.encode('utf-8'))
+            old_size = self._disk_index.get(key, (0, 0))[0]
+            self._disk_index[key] = (size, created_at)
+            self._disk_bytes += size - old_size
+            self._stats['stores'] += 1
+            self._evict_disk()
+    def _drop_disk_entry(self, key):
+        size, _ = self._disk_index.pop(key, (0, 0))
+        self._disk_bytes -= size
+        try:
+            os.remove(self._path_for(key))
+        except OSError:
+            pass
+    def _evict_disk(self):
+        if self._disk_bytes <= self.disk_max_bytes:
+            return
+        # 按最近访问时间从旧到新淘汰，直到低于上限
+        for key, _ in sorted(self._disk_index.items(), key=lambda item: item[1][1]):
+            if self._disk_bytes <= self.disk_max_bytes:
+                break
+            self._drop_disk_entry(key)
+            self._memory.pop(key, None)
+            self._stats['evictions'] += 1
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._load_disk_index()
+            for key in list(self._disk_index):
+                self._drop_disk_entry(key)
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+            stats['hit_rate'] = (stats['memory_hits'] + stats['disk_hits']) / lookups if lookups else 0.0
+            stats['memory_entries'] = len(self._memory)
+            stats['disk_bytes'] = self._disk_bytes
+            return stats
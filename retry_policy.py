@@ -0,0 +1,44 @@
+# retry_policy.py
+import sys
+import random
+import asyncio
+from http import HTTPStatus
+# 服务端过载或限流：同一模型稍后重试意义不大，尽快切换到备用模型
+OVERLOAD_CODES = {'Throttling', 'Throttling.RateQuota', 'Throttling.AllocationQuota', 'Throttling.User', 'ServiceUnavailable',
+                  'ModelServiceFailed', 'RequestTimeOut'}
+# 服务端的临时故障，可以在同一模型上重试
+TRANSIENT_CODES = {'InternalError', 'InternalError.Algo', 'InternalError.Timeout', 'SystemError'}
+OVERLOAD_STATUS = {HTTPStatus.TOO_MANY_REQUESTS, HTTPStatus.SERVICE_UNAVAILABLE}
+TRANSIENT_STATUS = {HTTPStatus.REQUEST_TIMEOUT, HTTPStatus.INTERNAL_SERVER_ERROR, HTTPStatus.BAD_GATEWAY,
+                    HTTPStatus.GATEWAY_TIMEOUT}
+class RetryPolicy:
+    """请求失败时的重试策略：可重试的错误按带随机抖动的指数退避重试，同一模型的重试次数用完（过载时提前）后
+    切换到备用模型；hedge_after_ms 大于 0 时，首个增量在该时间内未到达就再发一个相同的请求，先出字的一方胜出"""
+    def __init__(self, max_retries=2, base_delay_ms=500, max_delay_ms=8000, overload_retries=1, hedge_after_ms=0, seed=None):
+        self.max_retries = max(0, max_retries)
+        self.base_delay = base_delay_ms / 1000
+        self.max_delay = max_delay_ms / 1000
+        self.overload_retries = max(0, overload_retries)
+        self.hedge_after = hedge_after_ms / 1000 if hedge_after_ms and hedge_after_ms > 0 else None
+        self.random = random.Random(seed)
+    @staticmethod
+    def is_overloaded(error):
+        code, status = getattr(error, 'code', None), getattr(error, 'status_code', None)
+        return code in OVERLOAD_CODES or status in OVERLOAD_STATUS
+    @staticmethod
+    def is_network_error(error):
+        if isinstance(error, (ConnectionError, asyncio.TimeoutError)):
+            return True
+        aiohttp = sys.modules.get('aiohttp') # aiohttp 延迟导入，未导入时不可能出现它的异常
+        return aiohttp is not None and isinstance(error, aiohttp.ClientError)
+    def is_retryable(self, error):
+        if self.is_overloaded(error) or self.is_network_error(error):
+            return True
+        code, status = getattr(error, 'code', None), getattr(error, 'status_code', None)
+        return code in TRANSIENT_CODES or status in TRANSIENT_STATUS
+    def retries_for(self, error):
+        """同一模型上最多重试几次，之后切换到备用模型"""
+        return min(self.max_retries, self.overload_retries) if self.is_overloaded(error) else self.max_retries
+    def backoff(self, attempt):
+        """第 attempt 次重试（从 0 开始）前等待的秒数：在 [0, base * 2^attempt] 内均匀随机（full jitter），不超过 max_delay"""
+        return self.random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
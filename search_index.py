@@ -0,0 +1,210 @@
+# search_index.py
+import os
+import re
+import html
+import sqlite3
+import logging
+import threading
+SNIPPET_OPEN, SNIPPET_CLOSE = '【', '】'
+TAG_PATTERN = re.compile(r'<[^>]+>')
+SCRIPT_STYLE_PATTERN = re.compile(r'<(script|style|head)[^>]*>.*?</\1>', re.IGNORECASE | re.DOTALL)
+MESSAGE_BOX_PATTERN = re.compile(r'class="(user|assistant)-message-box"')
+WORD_RUN_PATTERN = re.compile(r'\w+')
+BACKFILL_BATCH = 500
+def html_to_text(fragment):
+    fragment = SCRIPT_STYLE_PATTERN.sub(' ', fragment)
+    return re.sub(r'\s+', ' ', html.unescape(TAG_PATTERN.sub(' ', fragment))).strip()
+def to_bigrams(text):
+    """把文本中每段连续的文字展开为重叠的双字词（最后一个字单独成词），以空格分隔，供 unicode61 分词的 FTS5 表检索：
+    '风控模型' -> '风控 控模 模型 型'。trigram 无法索引的两个字的词（大多数中文查询）由此也能走索引"""
+    tokens = []
+    for run in WORD_RUN_PATTERN.findall(text.lower()):
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        tokens.append(run[-1])
+    return ' '.join(tokens)
+def bigram_match_expression(terms):
+    """查询词对应的 MATCH 表达式：两个字以上的词为其双字词组成的短语，单个字按前缀匹配，多个词之间为 AND"""
+    parts = []
+    for term in terms:
+        for run in WORD_RUN_PATTERN.findall(term.lower()):
+            if len(run) == 1:
+                parts.append(f'"{run}"*')
+            else:
+                parts.append('"' + ' '.join(run[i:i + 2] for i in range(len(run) - 1)) + '"')
+    return ' AND '.join(parts)
+def extract_legacy_html_messages(html_content):
+    """从旧版本保存的 HTML 历史记录中提取消息（按 message-container 切分）"""
+    messages = []
+    for chunk in html_content.split('class="message-container"')[1:]:
+        match = MESSAGE_BOX_PATTERN.search(chunk)
+        if not match:
+            continue
+        text = html_to_text(chunk[match.end():].split('>', 1)[-1])
+        if text:
+            messages.append({'role': match.group(1), 'content': text})
+    return messages
+class SearchIndex:
+    """聊天记录全文索引：SQLite FTS5 + trigram 分词（可检索任意中文子串），写入历史时增量更新。
+    少于 3 个字的词由另一张双字词表（message_bigrams，rowid 与 messages 相同）检索。
+    查询使用单独的只读连接（WAL 模式下读写互不阻塞），不会等待写入线程提交索引"""
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._read_lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS sessions (filename TEXT PRIMARY KEY, message_count INTEGER, size INTEGER)')
+        try:
+            self._conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS messages USING fts5("
+                               "filename UNINDEXED, position UNINDEXED, role UNINDEXED, content, tokenize='trigram')")
+            self.fts_enabled = True
+        except sqlite3.OperationalError as e:
+            # 旧版 SQLite 没有 trigram 分词器，退化为普通表 + LIKE 查询
+            logging.warning(f"SQLite 不支持 FTS5 trigram，全文检索退化为 LIKE 查询: {e}")
+            self._conn.execute('CREATE TABLE IF NOT EXISTS messages (filename TEXT, position INTEGER, role TEXT, content TEXT)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS messages_filename ON messages(filename)')
+            self.fts_enabled = False
+        has_bigrams = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'message_bigrams'").fetchone() is not None
+        try:
+            self._conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS message_bigrams USING fts5(content, tokenize='unicode61')")
+            self.bigrams_enabled = True
+        except sqlite3.OperationalError as e:
+            logging.warning(f"SQLite 不支持 FTS5，短词检索使用 LIKE 查询: {e}")
+            self.bigrams_enabled = False
+        self._conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)')
+        if self.bigrams_enabled and not has_bigrams:
+            # 旧版本的索引没有双字词表：记下需要补建的最大 rowid，由 sync_directory 在后台分批补建
+            last_rowid = self._conn.execute('SELECT max(rowid) FROM messages').fetchone()[0] or 0
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('bigram_backfill', ?)", (last_rowid,))
+        self._conn.commit()
+        self._read_conn = sqlite3.connect(db_path, check_same_thread=False)
+    def close(self):
+        with self._read_lock:
+            self._read_conn.close()
+        with self._lock:
+            self._conn.close()
+    def _bigrams_ready(self):
+        with self._read_lock:
+            row = self._read_conn.execute("SELECT value FROM meta WHERE key = 'bigram_backfill'").fetchone()
+        return self.bigrams_enabled and (row is None or row[0] <= 0)
+    def _insert_rows(self, rows):
+        for row in rows:
+            rowid = self._conn.execute('INSERT INTO messages (filename, position, role, content) VALUES (?, ?, ?, ?)', row).lastrowid
+            if self.bigrams_enabled:
+                self._conn.execute('INSERT INTO message_bigrams (rowid, content) VALUES (?, ?)', (rowid, to_bigrams(row[3])))
+    def _delete_session_rows(self, filename):
+        if self.bigrams_enabled:
+            self._conn.execute('DELETE FROM message_bigrams WHERE rowid IN (SELECT rowid FROM messages WHERE filename = ?)', (filename,))
+        self._conn.execute('DELETE FROM messages WHERE filename = ?', (filename,))
+        self._conn.execute('DELETE FROM sessions WHERE filename = ?', (filename,))
+    def backfill_bigrams(self, stop_event=None):
+        """为升级前已索引的消息分批补建双字词表（从最新的消息往前），完成前短词查询仍使用 LIKE"""
+        while stop_event is None or not stop_event.is_set():
+            with self._lock:
+                row = self._conn.execute("SELECT value FROM meta WHERE key = 'bigram_backfill'").fetchone()
+                if not self.bigrams_enabled or row is None or row[0] <= 0:
+                    return
+                upper = row[0]
+                rows = self._conn.execute('SELECT rowid, content FROM messages WHERE rowid <= ? ORDER BY rowid DESC LIMIT ?',
+                                          (upper, BACKFILL_BATCH)).fetchall()
+                with self._conn:
+                    self._conn.executemany('INSERT OR REPLACE INTO message_bigrams (rowid, content) VALUES (?, ?)',
+                                           [(rowid, to_bigrams(content)) for rowid, content in rows])
+                    next_upper = rows[-1][0] - 1 if len(rows) == BACKFILL_BATCH else 0
+                    self._conn.execute("UPDATE meta SET value = ? WHERE key = 'bigram_backfill'", (next_upper,))
+    def indexed_sessions(self):
+        with self._lock:
+            return {row[0]: (row[1], row[2]) for row in self._conn.execute('SELECT filename, message_count, size FROM sessions')}
+    def add_messages(self, filename, messages, start_position, file_size=None):
+        """追加一个会话中新写入的消息（start_position 为第一条新消息在会话中的序号）"""
+        rows = [(filename, start_position + i, m['role'], m['content']) for i, m in enumerate(messages)]
+        with self._lock:
+            with self._conn:
+                self._insert_rows(rows)
+                self._conn.execute(
+                    'INSERT INTO sessions (filename, message_count, size) VALUES (?, ?, ?) '
+                    'ON CONFLICT(filename) DO UPDATE SET message_count = excluded.message_count, size = excluded.size',
+                    (filename, start_position + len(rows), file_size or 0))
+    def replace_session(self, filename, messages, file_size=None):
+        with self._lock:
+            with self._conn:
+                self._delete_session_rows(filename)
+        self.add_messages(filename, messages, 0, file_size)
+    def remove_session(self, filename):
+        with self._lock:
+            with self._conn:
+                self._delete_session_rows(filename)
+    def sync_directory(self, history_dir, session_store, stop_event=None):
+        """为尚未索引或被外部修改过的会话补建索引，并清理已不存在的会话（适合在后台线程执行）"""
+        indexed = self.indexed_sessions()
+        seen = set()
+        with os.scandir(history_dir) as entries:
+            files = [(entry.name, entry.stat().st_size) for entry in entries
+                     if entry.name.endswith(('.jsonl', '.html'))]
+        for filename, size in files:
+            if stop_event is not None and stop_event.is_set():
+                return
+            seen.add(filename)
+            if indexed.get(filename, (None, None))[1] == size:
+                continue
+            try:
+                if filename.endswith('.jsonl'):
+                    messages = session_store.read_all(filename)
+                else:
+                    with open(os.path.join(history_dir, filename), 'r', encoding='utf-8') as f:
+                        messages = extract_legacy_html_messages(f.read())
+                self.replace_session(filename, messages, size)
+            except Exception as e:
+                logging.warning(f"为历史记录 {filename} 建立索引失败: {e}")
+        for filename in set(indexed) - seen:
+            self.remove_session(filename)
+        self.backfill_bigrams(stop_event)
+    def search(self, query, limit=50):
+        """返回按相关度排序的命中会话列表：[{'filename', 'snippet', 'role'}]，每个会话只取最相关的一条。
+        可以在任意线程调用"""
+        terms = query.split()
+        if not terms:
+            return []
+        use_match = self.fts_enabled and all(len(term) >= 3 for term in terms)
+        bigram_expr = bigram_match_expression(terms) if not use_match else ''
+        if use_match:
+            # trigram 分词下每个词作为短语匹配，多个词之间为 AND
+            match_expr = ' AND '.join('"' + term.replace('"', '""') + '"' for term in terms)
+            sql = (f"SELECT filename, role, snippet(messages, 3, '{SNIPPET_OPEN}', '{SNIPPET_CLOSE}', '…', 12) "
+                   "FROM messages WHERE messages MATCH ? ORDER BY bm25(messages) LIMIT ?")
+            params = (match_expr, limit * 20)
+        elif bigram_expr and self._bigrams_ready():
+            # 有少于 3 个字的词：在双字词表中检索，再按 rowid 取回原文生成摘要。
+            # 单字前缀匹配的命中往往很多，按相关度排序需要先取出全部命中，改为按写入时间倒序，取够即停
+            order = 'b.rowid DESC' if '*' in bigram_expr else 'bm25(message_bigrams)'
+            sql = ("SELECT m.filename, m.role, m.content FROM message_bigrams b JOIN messages m ON m.rowid = b.rowid "
+                   f"WHERE message_bigrams MATCH ? ORDER BY {order} LIMIT ?")
+            params = (bigram_expr, limit * 20)
+        else:
+            # 不支持 FTS5 或双字词表尚未补建完成时按 LIKE 扫描，结果按时间倒序
+            where = ' AND '.join('content LIKE ? ESCAPE \'\\\'' for _ in terms)
+            sql = f"SELECT filename, role, content FROM messages WHERE {where} ORDER BY filename DESC LIMIT ?"
+            params = tuple('%' + re.sub(r'([%_\\])', r'\\\1', term) + '%' for term in terms) + (limit * 20,)
+        with self._read_lock:
+            rows = self._read_conn.execute(sql, params).fetchall()
+        results = []
+        seen = set()
+        for filename, role, text in rows:
+            if filename in seen:
+                continue
+            seen.add(filename)
+            snippet = text if use_match else self._make_snippet(text, terms[0])
+            results.append({'filename': filename, 'role': role, 'snippet': snippet.replace('\n', ' ')})
+            if len(results) >= limit:
+                break
+        return results
+    @staticmethod
+    def _make_snippet(text, term, radius=20):
+        pos = text.lower().find(term.lower())
+        if pos < 0:
+            return text[:radius * 2]
+        start, end = max(0, pos - radius), pos + len(term) + radius
+        return (('…' if start > 0 else '') + text[start:pos] + SNIPPET_OPEN + text[pos:pos + len(term)] + SNIPPET_CLOSE +
+                text[pos + len(term):end] + ('…' if end < len(text) else ''))
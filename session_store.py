@@ -0,0 +1,149 @@
+# session_store.py
+import os
+import json
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+SESSION_SUFFIX = '.jsonl'
+class SessionStore:
+    """会话记录存储：每条消息作为一行 JSON 追加写入 history/chat_*.jsonl，按批次 fsync"""
+    def __init__(self, base_dir, fsync_every=8, fsync_interval=2.0):
+        self.base_dir = base_dir
+        self.fsync_every = fsync_every # 累计多少条未落盘记录后强制 fsync
+        self.fsync_interval = fsync_interval # 距离上次 fsync 超过多少秒后强制 fsync
+        self._handles = {} # filename -> 追加模式打开的文件对象
+        self._pending = {} # filename -> 尚未 fsync 的记录条数
+        self._last_sync = {} # filename -> 上次 fsync 的时间
+        self._issued = set() # 已分配的会话文件名，首次写入在后台进行，文件可能还没有创建
+        self._lock = threading.Lock()
+        os.makedirs(self.base_dir, exist_ok=True)
+    def path_for(self, filename):
+        return os.path.join(self.base_dir, filename)
+    def new_session_filename(self, taken=()):
+        """按当前时间生成会话文件名；与 taken 中的文件名、已分配过的文件名或目录中已有的文件重复时
+        （同一秒内新建多个会话或 /reset）顺延一秒，不会追加到其他会话的文件中"""
+        moment = datetime.now()
+        with self._lock:
+            while True:
+                filename = f"chat_{moment.strftime('%Y%m%d%H%M%S')}{SESSION_SUFFIX}"
+                if filename not in taken and filename not in self._issued and not os.path.exists(self.path_for(filename)):
+                    self._issued.add(filename)
+                    return filename
+                moment += timedelta(seconds=1)
+    @staticmethod
+    def is_session_file(filename):
+        return filename.endswith(SESSION_SUFFIX)
+    def _get_handle(self, filename):
+        handle = self._handles.get(filename)
+        if handle is None or handle.closed:
+            handle = open(self.path_for(filename), 'a', encoding='utf-8')
+            self._handles[filename] = handle
+            self._pending.setdefault(filename, 0)
+            self._last_sync.setdefault(filename, time.monotonic())
+        return handle
+    def append(self, filename, messages):
+        """追加若干条消息记录，只写入新增部分，不重写已有内容"""
+        if not messages:
+            return 0
+        lines = []
+        now = datetime.now().isoformat(timespec='seconds')
+        for msg in messages:
+            record = {'role': msg['role'], 'content': msg['content'], 'ts': msg.get('ts', now)}
+            lines.append(json.dumps(record, ensure_ascii=False) + '\n')
+        with self._lock:
+            handle = self._get_handle(filename)
+            handle.write(''.join(lines))
+            handle.flush() # 交给操作系统缓冲，真正落盘由 fsync 批量完成
+            self._pending[filename] += len(lines)
+            if (self._pending[filename] >= self.fsync_every or
+                    time.monotonic() - self._last_sync[filename] >= self.fsync_interval):
+                self._fsync(filename, handle)
+        return len(lines)
+    def _fsync(self, filename, handle):
+        try:
+            os.fsync(handle.fileno())
+        except OSError as e:
+            logging.warning(f"fsync 历史文件 {filename} 失败: {e}")
+        self._pending[filename] = 0
+        self._last_sync[filename] = time.monotonic()
+    def read_all(self, filename):
+        """读取会话全部消息记录，跳过损坏的行（例如异常退出时写了一半的最后一行）"""
+        records = []
+        with self._lock:
+            handle = self._handles.get(filename)
+            if handle is not None and not handle.closed:
+                handle.flush()
+        with open(self.path_for(filename), 'r', encoding='utf-8') as f:
+            for line_no, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    logging.warning(f"历史文件 {filename} 第 {line_no} 行无法解析，已跳过。")
+        return records
+    def read_page(self, filename, end_offset=None, limit=50, block_size=64 * 1024):
+        """从 end_offset（默认为文件末尾）向前读取最多 limit 条记录，返回 (记录列表, 起始偏移)。
+        只读取文件末尾需要的部分，起始偏移为 0 表示已读到文件开头"""
+        with self._lock:
+            handle = self._handles.get(filename)
+            if handle is not None and not handle.closed:
+                handle.flush()
+        with open(self.path_for(filename), 'rb') as f:
+            if end_offset is None:
+                end_offset = f.seek(0, os.SEEK_END)
+            pos = end_offset
+            buf = b''
+            while pos > 0 and buf.count(b'\n') <= limit:
+                size = min(block_size, pos)
+                pos -= size
+                f.seek(pos)
+                buf = f.read(size) + buf
+        lines = buf.split(b'\n')
+        line_offset = pos
+        if pos > 0:
+            line_offset += len(lines[0]) + 1 # 第一行可能只读到一半，留给下一页
+            lines = lines[1:]
+        offsets = []
+        for line in lines:
+            offsets.append(line_offset)
+            line_offset += len(line) + 1
+        records = []
+        start_offset = offsets[0] if offsets else pos
+        for offset, line in zip(reversed(offsets), reversed(lines)):
+            if len(records) >= limit:
+                break
+            start_offset = offset
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                logging.warning(f"历史文件 {filename} 偏移 {offset} 处的记录无法解析，已跳过。")
+        records.reverse()
+        return records, start_offset
+    def flush(self, filename=None):
+        """将未落盘的记录 fsync 到磁盘，filename 为空时处理全部会话"""
+        with self._lock:
+            names = [filename] if filename else list(self._handles)
+            for name in names:
+                handle = self._handles.get(name)
+                if handle is not None and not handle.closed and self._pending.get(name):
+                    handle.flush()
+                    self._fsync(name, handle)
+    def close(self, filename=None):
+        self.flush(filename)
+        with self._lock:
+            names = [filename] if filename else list(self._handles)
+            for name in names:
+                handle = self._handles.pop(name, None)
+                self._pending.pop(name, None)
+                self._last_sync.pop(name, None)
+                if handle is not None and not handle.closed:
+                    handle.close()
+    def delete(self, filename):
+        self.close(filename)
+        os.remove(self.path_for(filename))
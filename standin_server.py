@@ -0,0 +1,192 @@
+# standin_server.py
+"""兼容百炼（DashScope）应用流式接口的本地替身服务器，用于离线开发、压测与延迟实验。
+
+用法: python standin_server.py --port 8765 --first-token-ms 300 --token-interval-ms 30 --jitter-ms 10
+然后在 assets/config.json 中设置 "api_base_url": "http://127.0.0.1:8765/api/v1"
+"""
+import sys
+import json
+import time
+import uuid
+import random
+import asyncio
+import logging
+import argparse
+from aiohttp import web
+FILLER_TEXT = ('科技金融通过大数据风控、智能投顾、区块链结算和开放银行等手段，'
+               '提升金融服务的覆盖面与效率，同时也对数据安全和监管提出了新的要求。')
+ERROR_STATUS = {
+    'InvalidApiKey': 401,
+    'Throttling.RateQuota': 429,
+    'Throttling.AllocationQuota': 429,
+    'InternalError': 500,
+    'ServiceUnavailable': 503,
+}
+class StandInConfig:
+    """替身服务器的行为参数：延迟单位为毫秒，错误率为 0~1 之间的概率"""
+    def __init__(self, first_token_ms=300, token_interval_ms=30, jitter_ms=10, tokens=40, chunk_chars=4,
+                 error_rate=0.0, error_code='Throttling.RateQuota', stream_error_rate=0.0, session_ttl=3600, seed=None,
+                 slow_rate=0.0, slow_first_token_ms=3000, error_app_ids=()):
+        self.first_token_ms = first_token_ms
+        self.token_interval_ms = token_interval_ms
+        self.jitter_ms = jitter_ms
+        self.tokens = tokens
+        self.chunk_chars = chunk_chars
+        self.error_rate = error_rate
+        self.error_code = error_code
+        self.stream_error_rate = stream_error_rate
+        self.session_ttl = session_ttl
+        self.seed = seed
+        self.slow_rate = slow_rate # 首个增量特别慢（模拟长尾延迟）的请求比例
+        self.slow_first_token_ms = slow_first_token_ms
+        self.error_app_ids = set(error_app_ids) # 只对这些应用注入错误（模拟单个模型过载），为空时对所有应用注入
+    @classmethod
+    def from_args(cls, args):
+        return cls(args.first_token_ms, args.token_interval_ms, args.jitter_ms, args.tokens, args.chunk_chars,
+                   args.error_rate, args.error_code, args.stream_error_rate, args.session_ttl, args.seed,
+                   args.slow_rate, args.slow_first_token_ms, [a for a in args.error_apps.split(',') if a])
+class StandInServer:
+    """模拟 POST {base}/apps/{app_id}/completion：支持 SSE 增量/全量输出、服务端会话、错误码注入与可配置的延迟抖动"""
+    def __init__(self, config=None):
+        self.config = config or StandInConfig()
+        self.random = random.Random(self.config.seed)
+        self.sessions = {} # session_id -> {'messages': [...], 'last_used': 时间}
+        self.stats = {'requests': 0, 'active': 0, 'completed': 0, 'errors': 0, 'stream_errors': 0, 'disconnects': 0,
+                      'session_misses': 0, 'slow': 0}
+    def create_app(self):
+        app = web.Application()
+        app.router.add_post('/api/v1/apps/{app_id}/completion', self.handle_completion)
+        app.router.add_get('/stats', self.handle_stats)
+        return app
+    def _delay(self, base_ms):
+        jitter = self.config.jitter_ms
+        return max(0.0, base_ms + self.random.uniform(-jitter, jitter)) / 1000
+    @staticmethod
+    def _error_response(status, code, message, request_id):
+        return web.json_response({'code': code, 'message': message, 'request_id': request_id}, status=status)
+    def _expire_sessions(self):
+        deadline = time.monotonic() - self.config.session_ttl
+        for session_id in [sid for sid, session in self.sessions.items() if session['last_used'] < deadline]:
+            del self.sessions[session_id]
+    def _build_answer(self, messages, turn):
+        last_user = next((m.get('content', '') for m in reversed(messages) if m.get('role') == 'user'), '')
+        head = f'这是本地替身服务器的第 {turn} 轮回答。你刚才说：{last_user[:50]}。'
+        total_chars = max(len(head), self.config.tokens * self.config.chunk_chars)
+        body = (FILLER_TEXT * (total_chars // len(FILLER_TEXT) + 1))[:total_chars - len(head)]
+        text = head + body
+        size = self.config.chunk_chars
+        return [text[i:i + size] for i in range(0, len(text), size)]
+    async def handle_stats(self, request):
+        return web.json_response(dict(self.stats, sessions=len(self.sessions)))
+    async def handle_completion(self, request):
+        request_id = str(uuid.uuid4())
+        self.stats['requests'] += 1
+        if not request.headers.get('Authorization', '').removeprefix('Bearer ').strip():
+            self.stats['errors'] += 1
+            return self._error_response(401, 'InvalidApiKey', 'Invalid API-key provided.', request_id)
+        try:
+            body = await request.json()
+            messages = body['input'].get('messages')
+            if messages is None:
+                messages = [{'role': 'user', 'content': body['input']['prompt']}]
+        except (ValueError, KeyError, TypeError, AttributeError):
+            self.stats['errors'] += 1
+            return self._error_response(400, 'InvalidParameter', 'input.messages or input.prompt is required.', request_id)
+        error_app = not self.config.error_app_ids or request.match_info['app_id'] in self.config.error_app_ids
+        if error_app and self.config.error_rate and self.random.random() < self.config.error_rate:
+            self.stats['errors'] += 1
+            code = self.config.error_code
+            return self._error_response(ERROR_STATUS.get(code, 500), code, f'Injected error: {code}', request_id)
+        self._expire_sessions()
+        session_id = body['input'].get('session_id')
+        if session_id:
+            session = self.sessions.get(session_id)
+            if session is None:
+                self.stats['errors'] += 1
+                self.stats['session_misses'] += 1
+                return self._error_response(400, 'InvalidParameter', 'Session not found or expired.', request_id)
+        else:
+            session_id = uuid.uuid4().hex
+            session = self.sessions[session_id] = {'messages': [], 'last_used': time.monotonic()}
+        if 'messages' in body['input']:
+            session['messages'] = list(messages) # 与百炼一致：传入 messages 时以它为完整上下文，不使用会话中保存的记录
+        else:
+            session['messages'].extend(messages) # 只有 prompt：接在会话保存的上下文之后
+        session['last_used'] = time.monotonic()
+        turn = sum(1 for m in session['messages'] if m.get('role') == 'user')
+        chunks = self._build_answer(session['messages'], turn)
+        incremental = (body.get('parameters') or {}).get('incremental_output', False)
+        usage = {'models': [{'model_id': request.match_info['app_id'], 'input_tokens': sum(len(m.get('content', '')) for m in messages),
+                             'output_tokens': 0}]}
+        if request.headers.get('X-DashScope-SSE', '').lower() != 'enable':
+            await asyncio.sleep(self._delay(self.config.first_token_ms) + len(chunks) * self.config.token_interval_ms / 1000)
+            session['messages'].append({'role': 'assistant', 'content': ''.join(chunks)})
+            usage['models'][0]['output_tokens'] = len(chunks)
+            self.stats['completed'] += 1
+            return web.json_response({'output': {'text': ''.join(chunks), 'finish_reason': 'stop', 'session_id': session_id},
+                                      'usage': usage, 'request_id': request_id})
+        return await self._stream(request, request_id, session, session_id, chunks, incremental, usage)
+    async def _stream(self, request, request_id, session, session_id, chunks, incremental, usage):
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream;charset=UTF-8', 'Cache-Control': 'no-cache'})
+        await response.prepare(request)
+        fail_at = len(chunks) // 2 if self.config.stream_error_rate and self.random.random() < self.config.stream_error_rate else None
+        self.stats['active'] += 1
+        sent = ''
+        first_token_ms = self.config.first_token_ms
+        if self.config.slow_rate and self.random.random() < self.config.slow_rate:
+            self.stats['slow'] += 1
+            first_token_ms = self.config.slow_first_token_ms
+        try:
+            await asyncio.sleep(self._delay(first_token_ms))
+            for i, chunk in enumerate(chunks):
+                if i:
+                    await asyncio.sleep(self._delay(self.config.token_interval_ms))
+                if i == fail_at:
+                    self.stats['stream_errors'] += 1
+                    error = {'code': 'InternalError', 'message': 'Injected stream error.', 'request_id': request_id}
+                    await response.write(f'id:{i + 1}\nevent:error\n:HTTP_STATUS/500\ndata:{json.dumps(error)}\n\n'.encode('utf-8'))
+                    break
+                sent += chunk
+                is_last = i == len(chunks) - 1
+                usage['models'][0]['output_tokens'] = i + 1
+                data = {'output': {'session_id': session_id, 'finish_reason': 'stop' if is_last else 'null',
+                                   'text': chunk if incremental else sent},
+                        'usage': usage, 'request_id': request_id}
+                event = f'id:{i + 1}\nevent:result\n:HTTP_STATUS/200\ndata:{json.dumps(data, ensure_ascii=False)}\n\n'
+                await response.write(event.encode('utf-8'))
+            else:
+                session['messages'].append({'role': 'assistant', 'content': sent})
+                self.stats['completed'] += 1
+            await response.write_eof()
+        except (ConnectionResetError, asyncio.CancelledError):
+            self.stats['disconnects'] += 1
+            logging.info(f"客户端在第 {len(sent)} 个字符处断开连接: {request_id}")
+            raise
+        finally:
+            self.stats['active'] -= 1
+        return response
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='百炼应用流式接口的本地替身服务器')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--first-token-ms', type=float, default=300, help='首个增量前的延迟')
+    parser.add_argument('--token-interval-ms', type=float, default=30, help='相邻增量之间的间隔')
+    parser.add_argument('--jitter-ms', type=float, default=10, help='每次延迟随机增减的最大值')
+    parser.add_argument('--tokens', type=int, default=40, help='每次回答的增量个数')
+    parser.add_argument('--chunk-chars', type=int, default=4, help='每个增量的字符数')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='请求直接返回错误的概率')
+    parser.add_argument('--error-code', default='Throttling.RateQuota', choices=sorted(ERROR_STATUS), help='注入的错误码')
+    parser.add_argument('--error-apps', default='', help='只对这些应用ID注入错误（逗号分隔），默认全部')
+    parser.add_argument('--stream-error-rate', type=float, default=0.0, help='流式输出中途返回错误事件的概率')
+    parser.add_argument('--slow-rate', type=float, default=0.0, help='首个增量特别慢的请求比例（模拟长尾延迟）')
+    parser.add_argument('--slow-first-token-ms', type=float, default=3000, help='慢请求的首个增量延迟')
+    parser.add_argument('--session-ttl', type=float, default=3600, help='服务端会话的过期时间（秒）')
+    parser.add_argument('--seed', type=int, default=None, help='随机种子，便于复现延迟与错误序列')
+    return parser.parse_args(argv)
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s',
+                        handlers=[logging.StreamHandler(sys.stdout)])
+    args = parse_args()
+    server = StandInServer(StandInConfig.from_args(args))
+    logging.info(f"替身服务器已启动: http://{args.host}:{args.port}/api/v1")
+    web.run_app(server.create_app(), host=args.host, port=args.port, print=None)
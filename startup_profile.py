@@ -0,0 +1,30 @@
+# startup_profile.py
+import time
+import logging
+_start = time.perf_counter()
+_last = _start
+_phases = [] # [(阶段名, 本阶段耗时秒, 自启动起累计秒)]
+enabled = False
+def reset():
+    """开始计时（main.py 在导入其他模块之前调用）"""
+    global _start, _last, enabled
+    _start = _last = time.perf_counter()
+    _phases.clear()
+    enabled = True
+def mark(phase):
+    """记录从上一次 mark 到现在的耗时，未启用启动分析时不做任何事"""
+    global _last
+    if not enabled:
+        return
+    now = time.perf_counter()
+    _phases.append((phase, now - _last, now - _start))
+    _last = now
+def phases():
+    return list(_phases)
+def report():
+    lines = ["启动耗时分析（毫秒）:"]
+    for phase, elapsed, total in _phases:
+        lines.append(f"  {phase:<24}{elapsed * 1000:>9.1f}{total * 1000:>10.1f}")
+    text = '\n'.join(lines)
+    logging.info(text)
+    return text
@@ -0,0 +1,81 @@
+# stream_buffer.py
+import threading
+from PySide6.QtCore import QObject, QTimer, Signal, Slot, Qt
+class StreamFlushPolicy:
+    """流式输出的刷新策略：按固定帧率合并增量文本，积压过多时提前刷新"""
+    DEFAULT_FLUSH_HZ = 30
+    DEFAULT_MAX_PENDING_CHARS = 2048
+    def __init__(self, flush_hz=DEFAULT_FLUSH_HZ, max_pending_chars=DEFAULT_MAX_PENDING_CHARS):
+        self.flush_hz = flush_hz # <= 0 表示不合并，每个增量立即刷新
+        self.max_pending_chars = max_pending_chars
+    @classmethod
+    def from_config(cls, config):
+        try:
+            flush_hz = int(config.get('stream_flush_hz', cls.DEFAULT_FLUSH_HZ))
+            max_pending_chars = int(config.get('stream_max_pending_chars', cls.DEFAULT_MAX_PENDING_CHARS))
+        except (TypeError, ValueError):
+            return cls()
+        return cls(min(flush_hz, 120), max(max_pending_chars, 1))
+    @property
+    def immediate(self):
+        return self.flush_hz <= 0
+    @property
+    def interval_ms(self):
+        return 0 if self.immediate else max(1, round(1000 / self.flush_hz))
+class StreamBuffer(QObject):
+    """增量文本缓冲：后台线程调用 push 写入，GUI 线程的定时器按帧率批量取出并回调 flush_callback"""
+    _flush_requested = Signal()
+    def __init__(self, flush_callback, policy=None, parent=None):
+        super().__init__(parent)
+        self.flush_callback = flush_callback
+        self._lock = threading.Lock()
+        self._pending = []
+        self._pending_chars = 0
+        self._flush_request_sent = False
+        self._timer = QTimer(self)
+        self._timer.timeout.connect(self.drain)
+        # 跨线程的提前刷新请求通过排队连接回到 GUI 线程执行
+        self._flush_requested.connect(self.drain, Qt.QueuedConnection)
+        self.set_policy(policy or StreamFlushPolicy())
+    def set_policy(self, policy):
+        self.policy = policy
+        self._timer.setInterval(policy.interval_ms)
+    def start(self):
+        """开始一次流式输出（需在 GUI 线程调用）"""
+        self.clear()
+        if not self.policy.immediate:
+            self._timer.start()
+    def stop(self):
+        """结束流式输出，先把剩余文本全部刷新出去（需在 GUI 线程调用）"""
+        self._timer.stop()
+        self.drain()
+    def clear(self):
+        with self._lock:
+            self._pending.clear()
+            self._pending_chars = 0
+            self._flush_request_sent = False
+    def push(self, text):
+        """写入增量文本，可在任意线程调用"""
+        if not text:
+            return
+        with self._lock:
+            self._pending.append(text)
+            self._pending_chars += len(text)
+            need_flush = (self.policy.immediate or self._pending_chars >= self.policy.max_pending_chars)
+            if need_flush and self._flush_request_sent:
+                need_flush = False # 已有一个刷新请求在排队，避免重复发信号
+            elif need_flush:
+                self._flush_request_sent = True
+        if need_flush:
+            self._flush_requested.emit()
+    @Slot()
+    def drain(self):
+        with self._lock:
+            if not self._pending:
+                self._flush_request_sent = False
+                return
+            text = ''.join(self._pending)
+            self._pending.clear()
+            self._pending_chars = 0
+            self._flush_request_sent = False
+        self.flush_callback(text)
@@ -0,0 +1,221 @@
+# telemetry.py
+import os
+import json
+import math
+import time
+import uuid
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+from persistence import PersistenceWorker
+def percentile(values, q):
+    """最近邻法计算百分位数，values 为空时返回 None"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+def _round(value, digits=1):
+    return round(value, digits) if value is not None else None
+class RequestMetrics:
+    """单次请求的计时：首个增量时间（TTFT）、相邻增量间隔、总耗时与 token 数"""
+    def __init__(self, model_name, backend, request_messages):
+        self.request_id = uuid.uuid4().hex
+        self.model_name = model_name
+        self.backend = backend
+        self.request_messages = request_messages
+        self.started_at = time.perf_counter()
+        self.first_token_at = None
+        self.last_token_at = None
+        self.finished_at = None
+        self.gaps = [] # 相邻增量之间的间隔（秒）
+        self.chunks = 0
+        self.response_text = []
+        self.usage = None
+        self.status = 'cancelled' # 收到结束事件前被关闭即视为取消
+        self.error_code = None
+        self.status_code = None
+        self.cached = None
+        self.queued = False
+        self.session_fallback = False
+        self.retries = 0
+        self.failover_model = None # 实际回答的备用模型
+        self.resumed = False
+        self.hedged = None # 'primary' / 'hedge'，未发出对冲请求时为 None
+        self.recorded_at = None
+    def observe(self, event):
+        now = time.perf_counter()
+        if event.get('cached'):
+            self.cached = event['cached']
+        if event.get('queued') is not None:
+            self.queued = True # 首字时间包含了排队等待的时间
+        if not event.get('is_end'):
+            if event.get('text'):
+                if self.first_token_at is None:
+                    self.first_token_at = now
+                else:
+                    self.gaps.append(now - self.last_token_at)
+                self.last_token_at = now
+                self.chunks += 1
+                self.response_text.append(event['text'])
+            return
+        self.finished_at = now
+        if event.get('error'):
+            self.status = 'error'
+            self.error_code = event.get('error_code')
+            self.status_code = event.get('status_code')
+        else:
+            self.status = 'ok'
+        self.session_fallback = bool(event.get('session_fallback'))
+        self.retries = event.get('retries', 0)
+        self.failover_model = event.get('failover_model')
+        self.resumed = bool(event.get('resumed'))
+        self.hedged = event.get('hedged')
+        self.usage = event.get('usage') or None
+    def freeze(self):
+        """请求结束（或被取消）时在事件循环中调用：固定结束时间与请求消息，之后可以在其他线程中生成记录"""
+        if self.finished_at is None:
+            self.finished_at = time.perf_counter()
+        self.recorded_at = datetime.now()
+        self.request_messages = list(self.request_messages)
+    def to_record(self):
+        end = self.finished_at or time.perf_counter()
+        duration = end - self.started_at
+        ttft = self.first_token_at - self.started_at if self.first_token_at is not None else None
+        request_tokens, response_tokens = self._token_counts()
+        generation_time = (self.last_token_at - self.first_token_at) if self.chunks > 1 else None
+        gaps_ms = [gap * 1000 for gap in self.gaps]
+        return {
+            'ts': (self.recorded_at or datetime.now()).isoformat(timespec='milliseconds'),
+            'request_id': self.request_id,
+            'model': self.model_name,
+            'backend': self.backend,
+            'status': self.status,
+            'error_code': self.error_code,
+            'status_code': self.status_code,
+            'cached': self.cached,
+            'queued': self.queued,
+            'session_fallback': self.session_fallback,
+            'retries': self.retries,
+            'failover_model': self.failover_model,
+            'resumed': self.resumed,
+            'hedged': self.hedged,
+            'ttft_ms': _round(ttft * 1000 if ttft is not None else None),
+            'duration_ms': _round(duration * 1000),
+            'itl_p50_ms': _round(percentile(gaps_ms, 50), 2),
+            'itl_p95_ms': _round(percentile(gaps_ms, 95), 2),
+            'itl_max_ms': _round(max(gaps_ms) if gaps_ms else None, 2),
+            'chunks': self.chunks,
+            'request_tokens': request_tokens,
+            'response_tokens': response_tokens,
+            'tokens_per_s': _round(response_tokens / generation_time if generation_time and response_tokens else None),
+        }
+    def _token_counts(self):
+        # 优先使用服务端返回的用量，没有时用本地分词器估算
+        usage = self.usage or {}
+        request_tokens, response_tokens = usage.get('input_tokens'), usage.get('output_tokens')
+        if request_tokens is None or response_tokens is None:
+            from context_manager import get_token_counter # 避免与 controller 循环导入
+            counter = get_token_counter()
+            if request_tokens is None:
+                request_tokens = sum(counter.count_message(m) for m in self.request_messages)
+            if response_tokens is None:
+                response_tokens = counter.count_text(''.join(self.response_text)) if self.response_text else 0
+        return request_tokens, response_tokens
+class MetricsLog:
+    """按大小轮转的 JSONL 指标文件：超过 max_bytes 时 metrics.jsonl -> metrics.jsonl.1 -> ...，最多保留 backups 个"""
+    def __init__(self, path, max_bytes=5 * 1024 * 1024, backups=3):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    def append(self, record):
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with self._lock:
+            try:
+                if os.path.exists(self.path) and os.path.getsize(self.path) + len(line) > self.max_bytes:
+                    self._rotate()
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(line)
+            except OSError as e:
+                logging.warning(f"写入请求指标失败: {e}")
+    def _rotate(self):
+        for index in range(self.backups - 1, 0, -1):
+            source = f'{self.path}.{index}'
+            if os.path.exists(source):
+                os.replace(source, f'{self.path}.{index + 1}')
+        if self.backups > 0:
+            os.replace(self.path, f'{self.path}.1')
+        else:
+            os.remove(self.path)
+    def read_recent(self, limit=500):
+        """读取最近的记录（用于启动时恢复统计面板）"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                lines = deque(f, maxlen=limit)
+        except OSError:
+            return []
+        records = []
+        for line in lines:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+        return records
+class Telemetry:
+    """请求指标：写入 JSONL 文件，并按模型保留最近 window 条记录用于计算滚动 p50/p95。
+    统计 token、写文件与轮转都在后台写入线程中进行，不占用处理流式输出的事件循环"""
+    def __init__(self, metrics_log=None, window=200):
+        self.metrics_log = metrics_log
+        self.window = window
+        self._recent = {} # model -> deque[record]
+        self._lock = threading.Lock()
+        self._writer = PersistenceWorker(name="telemetry")
+        if metrics_log is not None:
+            for record in metrics_log.read_recent(window * 4):
+                self._remember(record)
+    def _remember(self, record):
+        with self._lock:
+            self._recent.setdefault(record.get('model'), deque(maxlen=self.window)).append(record)
+    def start(self, model_name, backend, request_messages):
+        return RequestMetrics(model_name, backend, request_messages)
+    def record(self, metrics):
+        """固定本次请求的计时后交给写入线程，立即返回"""
+        metrics.freeze()
+        self._writer.submit(('metrics', metrics.request_id), self._write, metrics)
+    def _write(self, metrics):
+        record = metrics.to_record()
+        self._remember(record)
+        if self.metrics_log is not None:
+            self.metrics_log.append(record)
+        logging.info(f"请求指标: 模型 {record['model']}，状态 {record['status']}，TTFT {record['ttft_ms']} ms，"
+                     f"总耗时 {record['duration_ms']} ms，{record['tokens_per_s']} tokens/s")
+    def flush(self, timeout=None):
+        """等待已提交的记录写完，返回是否在超时前完成"""
+        return self._writer.flush(timeout=timeout)
+    def close(self, timeout=2.0):
+        return self._writer.shutdown(timeout=timeout)
+    def summary(self):
+        """按模型汇总最近的记录：{模型: {'count', 'errors', 'retried', 'failovers', 'ttft_p50', 'ttft_p95', 'itl_p50', 'itl_p95', 'tps_p50', 'duration_p95'}}"""
+        with self._lock:
+            recent = {model: list(records) for model, records in self._recent.items()}
+        summary = {}
+        for model, records in recent.items():
+            live = [r for r in records if r.get('status') == 'ok' and not r.get('cached')] # 缓存命中不代表服务延迟
+            def values(key):
+                return [r[key] for r in live if r.get(key) is not None]
+            summary[model] = {
+                'count': len(records),
+                'errors': sum(1 for r in records if r.get('status') == 'error'),
+                'retried': sum(1 for r in records if r.get('retries')),
+                'failovers': sum(1 for r in records if r.get('failover_model')),
+                'ttft_p50': percentile(values('ttft_ms'), 50),
+                'ttft_p95': percentile(values('ttft_ms'), 95),
+                'itl_p50': percentile(values('itl_p50_ms'), 50),
+                'itl_p95': percentile(values('itl_p95_ms'), 95),
+                'tps_p50': percentile(values('tokens_per_s'), 50),
+                'duration_p95': percentile(values('duration_ms'), 95),
+            }
+        return summary
@@ -0,0 +1,11 @@
+# test_chat_backend.py
+import pytest
+from controller import ChatBackend, DashScopeAppBackend
+def test_incomplete_backend_fails_when_created():
+    class IncompleteBackend(ChatBackend):
+        name = 'incomplete'
+    with pytest.raises(TypeError):
+        IncompleteBackend()
+def test_dashscope_backend_implements_the_interface():
+    backend = DashScopeAppBackend()
+    assert isinstance(backend, ChatBackend)
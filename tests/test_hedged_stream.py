@@ -0,0 +1,65 @@
+# test_hedged_stream.py
+import asyncio
+import pytest
+from controller import Controller
+from retry_policy import RetryPolicy
+class FakeStream:
+    """按给定的 (延迟秒数, 事件或异常) 依次产出，记录是否被 aclose"""
+    def __init__(self, steps):
+        self.steps = list(steps)
+        self.closed = False
+    def __aiter__(self):
+        return self
+    async def __anext__(self):
+        if self.closed or not self.steps:
+            raise StopAsyncIteration
+        delay, item = self.steps.pop(0)
+        await asyncio.sleep(delay)
+        if isinstance(item, Exception):
+            raise item
+        return item
+    async def aclose(self):
+        self.closed = True
+class FakeBackend:
+    def __init__(self, *streams):
+        self.streams = list(streams)
+    def stream(self, api_key, model_name, messages, session_id):
+        return self.streams.pop(0)
+@pytest.fixture
+def hedging(monkeypatch):
+    def install(*streams):
+        monkeypatch.setattr(Controller, '_backend', FakeBackend(*streams))
+        monkeypatch.setattr(Controller, 'retry_policy', RetryPolicy(hedge_after_ms=50))
+    return install
+def collect(generator, limit=None):
+    async def run():
+        events = []
+        try:
+            async for event in generator:
+                events.append(event)
+                if limit is not None and len(events) >= limit:
+                    break
+        finally:
+            await generator.aclose()
+        return events
+    return asyncio.run(run())
+def hedged_stream():
+    return Controller._hedged_stream('key', 'qwen-plus', [], None, [])
+def test_primary_failing_before_hedge_is_closed(hedging):
+    primary = FakeStream([(0, RuntimeError('boom'))])
+    hedging(primary)
+    with pytest.raises(RuntimeError):
+        collect(hedged_stream())
+    assert primary.closed
+def test_consumer_closing_during_hedged_event_closes_every_stream(hedging):
+    primary = FakeStream([(1, {'text': '慢'})])
+    hedge = FakeStream([(0, {'text': '快'}), (0, {'text': '后续'})])
+    hedging(primary, hedge)
+    assert collect(hedged_stream(), limit=1) == [{'hedged': 'hedge'}]
+    assert primary.closed and hedge.closed
+def test_hedge_wins_and_streams_to_the_end(hedging):
+    primary = FakeStream([(1, {'text': '慢'})])
+    hedge = FakeStream([(0, {'text': '快'}), (0, {'text': '后续'})])
+    hedging(primary, hedge)
+    assert collect(hedged_stream()) == [{'hedged': 'hedge'}, {'text': '快'}, {'text': '后续'}]
+    assert primary.closed and hedge.closed
@@ -0,0 +1,34 @@
+# test_request_scheduler.py
+import asyncio
+from request_scheduler import RequestScheduler
+def test_idle_owners_are_forgotten():
+    async def run():
+        scheduler = RequestScheduler(global_limit=1, per_model_limit=1)
+        for i in range(100):
+            # 每个连接（发起方）只发一个请求，完成后不应留下调度记录
+            slot = scheduler.request('qwen-plus', owner=f'client-{i}')
+            await slot.wait()
+            slot.release()
+        assert scheduler._last_served == {}
+        assert not scheduler._active_by_owner
+        first = scheduler.request('qwen-plus', owner='a')
+        queued = scheduler.request('qwen-plus', owner='b')
+        assert first.granted and not queued.granted
+        queued.release() # 排队中取消
+        assert 'b' not in scheduler._last_served
+        assert 'a' in scheduler._last_served # 仍有执行中的请求
+        first.release()
+        assert scheduler._last_served == {}
+    asyncio.run(run())
+def test_least_recently_served_owner_goes_first():
+    async def run():
+        scheduler = RequestScheduler(global_limit=1, per_model_limit=1)
+        running = scheduler.request('qwen-plus', owner='a')
+        a_next = scheduler.request('qwen-plus', owner='a')
+        b_first = scheduler.request('qwen-plus', owner='b')
+        running.release()
+        assert b_first.granted and not a_next.granted
+        b_first.release()
+        assert a_next.granted
+        a_next.release()
+    asyncio.run(run())
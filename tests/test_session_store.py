@@ -0,0 +1,13 @@
+# test_session_store.py
+from session_store import SessionStore
+def test_new_session_filename_skips_existing_files(tmp_path):
+    store = SessionStore(str(tmp_path))
+    first = store.new_session_filename()
+    store.append(first, [{'role': 'user', 'content': '你好'}])
+    store.close()
+    second = SessionStore(str(tmp_path)).new_session_filename() # 同一秒内新建（例如 /reset），文件已在磁盘上
+    assert second != first
+def test_new_session_filename_skips_names_not_yet_written(tmp_path):
+    store = SessionStore(str(tmp_path))
+    names = {store.new_session_filename() for _ in range(3)} # 首次写入尚未完成
+    assert len(names) == 3
@@ -0,0 +1,32 @@
+# test_telemetry.py
+import json
+import threading
+from telemetry import Telemetry, MetricsLog, RequestMetrics
+def test_record_writes_off_the_calling_thread(tmp_path, monkeypatch):
+    threads = []
+    original = RequestMetrics._token_counts
+    def token_counts(self):
+        threads.append(threading.current_thread())
+        return original(self)
+    monkeypatch.setattr(RequestMetrics, '_token_counts', token_counts)
+    path = tmp_path / 'metrics.jsonl'
+    telemetry = Telemetry(MetricsLog(str(path)))
+    metrics = telemetry.start('qwen-plus', 'dashscope', [{'role': 'user', 'content': '你好'}])
+    metrics.observe({'text': '你好！', 'is_end': False})
+    metrics.observe({'text': '', 'is_end': True, 'usage': {'input_tokens': 3}})
+    telemetry.record(metrics)
+    assert telemetry.flush(timeout=5)
+    assert threads and threading.current_thread() not in threads
+    record = json.loads(path.read_text(encoding='utf-8'))
+    assert record['status'] == 'ok' and record['request_tokens'] == 3 and record['response_tokens'] > 0
+    assert telemetry.summary()['qwen-plus']['count'] == 1
+    telemetry.close()
+def test_cancelled_request_keeps_its_duration(tmp_path):
+    telemetry = Telemetry(MetricsLog(str(tmp_path / 'metrics.jsonl')))
+    metrics = telemetry.start('qwen-plus', 'dashscope', [])
+    telemetry.record(metrics) # 没有收到结束事件：计时在提交时固定，不包含写入线程的等待
+    finished_at = metrics.finished_at
+    assert telemetry.flush(timeout=5)
+    assert metrics.finished_at == finished_at
+    assert telemetry.summary()['qwen-plus']['count'] == 1
+    telemetry.close()
@@ -0,0 +1,59 @@
+# test_transcript_compaction.py
+import re
+import asyncio
+import shutil
+import tempfile
+import pytest
+from PySide6.QtWidgets import QApplication
+from benchmark import create_window, wait_for, process_events
+from controller import Controller
+@pytest.fixture
+def window(monkeypatch):
+    app = QApplication.instance() or QApplication([])
+    async def fake_aprocess_api_request(api_key, dialog_history, model_name, session_id=None, full_history=None,
+                                        use_cache=True, owner=None):
+        question = dialog_history[-1]['content']
+        if question.startswith('停止'):
+            await asyncio.sleep(5) # 在收到任何增量之前被停止
+        answer = '' if question.startswith('空回答') else f'回答：{question}'
+        if answer:
+            yield {'text': answer, 'session_id': 'test-session', 'is_end': False}
+        yield {'text': '', 'session_id': 'test-session', 'is_end': True, 'answer': answer}
+    monkeypatch.setattr(Controller, 'aprocess_api_request', staticmethod(fake_aprocess_api_request))
+    history_dir = tempfile.mkdtemp()
+    w = create_window(history_dir)
+    w.transcript_config.update(max_rendered_messages=6, max_history_messages=6)
+    w.handle_user_command('/reset')
+    yield w
+    w.close()
+    app.processEvents()
+    shutil.rmtree(history_dir, ignore_errors=True)
+def ask(w, question):
+    assert wait_for(w.api_request_finished_signal, 5, lambda: w.handle_user_command(question))
+    process_events(0.02)
+def test_compact_after_stop_without_partial_answer(window):
+    w = window
+    questions = []
+    # 最后一次移出时视图中还留着第二条停止提示，较早的空回答也还没有被移出
+    for i in range(12):
+        if i in (5, 10):
+            question = f'停止 {i}'
+            w.handle_user_command(question) # 还没有收到任何增量就停止，视图中留下没有会话记录的停止提示
+            assert w.stop_current_request()
+            assert w.chat_history_view.toPlainText().rstrip().endswith('（已停止生成）')
+        elif i == 8:
+            question = f'空回答 {i}'
+            ask(w, question)
+        else:
+            question = f'问题 {i}'
+            ask(w, question)
+        questions.append(question)
+    assert w._evicted_message_count > 0
+    assert len(w.renderer) < 2 * len(questions)
+    scroll_bar = w.chat_history_view.verticalScrollBar()
+    for _ in range(60):
+        scroll_bar.setValue(0)
+        process_events(0.03)
+    text = w.chat_history_view.toPlainText()
+    shown = re.findall(r'(?<!回答：)((?:问题|停止|空回答) \d+)', text)
+    assert shown == questions # 读回的较早消息没有重复或遗漏
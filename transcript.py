@@ -0,0 +1,150 @@
+# transcript.py
+import logging
+from PySide6.QtGui import QTextCursor, QTextFrameFormat
+from markdown_render import MarkdownStream
+class TranscriptRenderer:
+    """聊天记录视图的增量渲染器：每条消息放在独立的 QTextFrame 中，按消息序号索引，
+    追加或替换单条消息时不会重建之前的内容"""
+    def __init__(self, text_browser, register_resources=None):
+        self.view = text_browser
+        self.register_resources = register_resources # document -> None，注册消息中引用的图片（头像）等文档资源
+        self._frames = [] # 消息序号 -> QTextFrame，frame 的位置会随文档编辑自动更新
+        self._markdown_streams = {} # 正在流式输出的 QTextFrame -> MarkdownStream
+        self._notes = set() # 不对应会话记录的消息（欢迎语、停止提示等）的 QTextFrame
+        self._frame_format = QTextFrameFormat()
+        self._frame_format.setBottomMargin(10)
+        self._register_resources()
+    def _register_resources(self):
+        # 清空文档时资源也会一并清除，需要重新注册
+        if self.register_resources is not None:
+            self.register_resources(self.view.document())
+    def __len__(self):
+        return len(self._frames)
+    def mark_note(self, index):
+        """标记指定消息只用于显示、没有对应的会话记录，record_count 不计入它"""
+        frame = self._frame_at(index)
+        if frame is not None:
+            self._notes.add(frame)
+    def record_count(self):
+        """视图中对应会话记录的消息条数"""
+        return len(self._frames) - len(self._notes)
+    def clear(self):
+        self._frames.clear()
+        self._markdown_streams.clear()
+        self._notes.clear()
+        self.view.clear()
+        self._register_resources()
+    def set_html(self, html):
+        """整体替换文档内容（例如查看历史记录），原有的消息索引随之失效"""
+        self._frames.clear()
+        self._markdown_streams.clear()
+        self._notes.clear()
+        self.view.setHtml(html)
+        self._register_resources()
+    def _is_at_bottom(self):
+        scroll_bar = self.view.verticalScrollBar()
+        return scroll_bar.value() >= scroll_bar.maximum() - 4
+    def _keep_scroll(self, was_at_bottom, previous_value):
+        scroll_bar = self.view.verticalScrollBar()
+        scroll_bar.setValue(scroll_bar.maximum() if was_at_bottom else previous_value)
+    def append_message(self, message_html):
+        """在文档末尾追加一条消息，返回它的序号"""
+        cursor = QTextCursor(self.view.document())
+        cursor.movePosition(QTextCursor.End)
+        frame = cursor.insertFrame(self._frame_format)
+        cursor.insertHtml(message_html)
+        self._frames.append(frame)
+        self.view.verticalScrollBar().setValue(self.view.verticalScrollBar().maximum())
+        return len(self._frames) - 1
+    def prepend_messages(self, messages_html):
+        """在文档开头按顺序插入若干条消息（分页加载更早的历史记录），保持当前可见内容的位置不变；
+        已有消息的序号相应后移"""
+        if not messages_html:
+            return
+        scroll_bar = self.view.verticalScrollBar()
+        previous_value, previous_maximum = scroll_bar.value(), scroll_bar.maximum()
+        cursor = QTextCursor(self.view.document())
+        cursor.beginEditBlock()
+        position = 0
+        frames = []
+        for message_html in messages_html:
+            cursor.setPosition(position)
+            frame = cursor.insertFrame(self._frame_format)
+            cursor.insertHtml(message_html)
+            frames.append(frame)
+            position = frame.lastPosition() + 1
+        cursor.endEditBlock()
+        self._frames[0:0] = frames
+        scroll_bar.setValue(previous_value + scroll_bar.maximum() - previous_maximum)
+    def remove_first(self, count):
+        """从文档开头移除 count 条消息以释放内存，保持当前可见内容的位置不变；其余消息的序号相应前移"""
+        count = min(count, len(self._frames))
+        if count <= 0:
+            return
+        scroll_bar = self.view.verticalScrollBar()
+        was_at_bottom, previous_value, previous_maximum = self._is_at_bottom(), scroll_bar.value(), scroll_bar.maximum()
+        cursor = QTextCursor(self.view.document())
+        cursor.setPosition(self._frames[0].firstPosition() - 1)
+        if count < len(self._frames):
+            cursor.setPosition(self._frames[count].firstPosition() - 1, QTextCursor.KeepAnchor)
+        else:
+            cursor.movePosition(QTextCursor.End, QTextCursor.KeepAnchor)
+        cursor.removeSelectedText()
+        for frame in self._frames[:count]:
+            self._markdown_streams.pop(frame, None)
+            self._notes.discard(frame)
+        del self._frames[:count]
+        if was_at_bottom:
+            scroll_bar.setValue(scroll_bar.maximum())
+        else:
+            scroll_bar.setValue(max(0, previous_value - (previous_maximum - scroll_bar.maximum())))
+    def replace_message(self, index, message_html):
+        """只替换指定消息的内容，其他消息保持不变"""
+        frame = self._frame_at(index)
+        if frame is None:
+            return False
+        scroll_bar = self.view.verticalScrollBar()
+        was_at_bottom, previous_value = self._is_at_bottom(), scroll_bar.value()
+        self._markdown_streams.pop(frame, None)
+        cursor = frame.firstCursorPosition()
+        cursor.setPosition(frame.lastPosition(), QTextCursor.KeepAnchor)
+        cursor.insertHtml(message_html)
+        self._keep_scroll(was_at_bottom, previous_value)
+        return True
+    def append_text(self, index, text):
+        """在指定消息末尾插入纯文本（用于流式输出）"""
+        frame = self._frame_at(index)
+        if frame is None:
+            return False
+        scroll_bar = self.view.verticalScrollBar()
+        was_at_bottom, previous_value = self._is_at_bottom(), scroll_bar.value()
+        cursor = frame.lastCursorPosition()
+        cursor.insertText(text)
+        self._keep_scroll(was_at_bottom, previous_value)
+        return True
+    def append_markdown(self, index, text):
+        """在指定消息末尾追加流式输出的 Markdown 文本：已完成的块固定不变，只重新渲染末尾未完成的块"""
+        frame = self._frame_at(index)
+        if frame is None:
+            return False
+        stream = self._markdown_streams.get(frame)
+        if stream is None:
+            stream = self._markdown_streams[frame] = MarkdownStream(self.view.document(), frame.lastPosition)
+        scroll_bar = self.view.verticalScrollBar()
+        was_at_bottom, previous_value = self._is_at_bottom(), scroll_bar.value()
+        stream.feed(text)
+        self._keep_scroll(was_at_bottom, previous_value)
+        return True
+    def finish_markdown(self, index):
+        """流式输出结束：渲染末尾的块，返回已显示的 Markdown 原文（没有流式输出过时为 None）"""
+        frame = self._frame_at(index)
+        stream = self._markdown_streams.pop(frame, None) if frame is not None else None
+        if stream is None:
+            return None
+        stream.finish()
+        return stream.text
+    def _frame_at(self, index):
+        if index is None or not 0 <= index < len(self._frames):
+            logging.warning(f"无效的消息序号: {index}")
+            return None
+        return self._frames[index]